@@ -6,10 +6,12 @@ This file is part of mailpy - the mail API framework.
 
 import logging
 import sys
-import re
+import os
 
 from mailpy.utils import parse_message
-from mailpy.view import MailView
+from mailpy.request import MailEnvelope, parse_recipient
+from mailpy.supervisor import load_view_class, send_envelope, SupervisorUnavailable
+from mailpy.contrib.admission import TooManyRequests
 
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
@@ -19,28 +21,86 @@ root_logger.addHandler(handler)
 logger = root_logger.getChild('mail.py')
 
 
+def dispatch_to_supervisor(socket_path, envelope):
+    """Pass the message to a worker of mail.supervisor.py and return True or return False if the message must be
+    processed in this process (the supervisor is not running or it does not serve the resource)"""
+    logger.info('Passing mail request to supervisor %s: %r', socket_path, envelope)
+
+    try:
+        reply = send_envelope(socket_path, envelope)
+    except SupervisorUnavailable as exc:
+        logger.warning('%s; Processing mail request in this process', exc)
+        return False
+    except Exception as exc:
+        raise SystemExit('Could not pass mail request to supervisor %s: %s' % (socket_path, exc))
+
+    if reply.get('unknown_resource'):
+        logger.info('Supervisor does not serve resource "%s"; Processing mail request in this process',
+                    envelope.resource)
+        return False
+
+    if reply['error']:
+        raise SystemExit('Could not process mail request %r: %s' % (envelope, reply['error']))
+
+    logger.info('Mail response was sent by supervisor: %s', reply['response'])
+
+    return True
+
+
+def admit(sender, recipient):
+    """Return (admission control, ticket) of the view according to the SMTP envelope before the message is read;
+    A rejected message is deferred by the MTA"""
+    try:
+        method, resource = parse_recipient(recipient)
+        admission = load_view_class(resource).admission
+    except Exception:
+        return None, None  # Errors are reported when the message is processed
+
+    if admission is None:
+        return None, None
+
+    try:
+        return admission, admission.admit(sender, method, resource)
+    except TooManyRequests as exc:
+        logger.warning('Mail request from "%s" to "%s" was deferred: %s', sender, recipient, exc)
+        sys.stderr.write('%s\n' % exc)
+        sys.exit(os.EX_TEMPFAIL)  # The MTA will try to deliver the message later
+
+
 def main():
     sender, recipient, nexthop = sys.argv[1:]
 
     if nexthop == '_invalid_':
         raise SystemExit('Invalid resource "%s" from "%s"' % (recipient, sender))
 
+    admission, ticket = admit(sender, recipient)
+
     try:
-        request = parse_message(sys.stdin, sender, recipient)
-    except Exception as e:
-        raise SystemExit('Could not parse message from "%s" sent to "%s". Error was: %s' % (sender, recipient, e))
+        process(sender, recipient)
+    finally:
+        if ticket:
+            admission.release(ticket)
+
+
+def process(sender, recipient):
+    """Process the mail request read from stdin in this process or pass it to the supervisor"""
+    supervisor_socket = os.environ.get('MAILPY_SUPERVISOR_SOCKET')
 
     try:
-        modname = request.resource
-        viewname = modname.split('.')[-1]
-        clsname = viewname[0].upper() + re.sub(r'_+([a-zA-Z0-9])', lambda m: m.group(1).upper(), viewname[1:])
-        module = __import__(modname, fromlist=[clsname])
-        viewcls = getattr(module, clsname)
+        if supervisor_socket and os.path.exists(supervisor_socket):
+            envelope = MailEnvelope(sender, recipient, getattr(sys.stdin, 'buffer', sys.stdin).read())
+
+            if dispatch_to_supervisor(supervisor_socket, envelope):
+                return
 
-        if not issubclass(viewcls, MailView):
-            raise SystemExit('Mail view "%s" is not an instance of MailView' % viewcls.__name__)
+            request = envelope.request
+        else:
+            request = parse_message(sys.stdin, sender, recipient)
+    except Exception as e:
+        raise SystemExit('Could not parse message from "%s" sent to "%s". Error was: %s' % (sender, recipient, e))
 
-        viewobj = viewcls()
+    try:
+        viewobj = load_view_class(request.resource)()
     except Exception as exc:
         logger.exception(exc)
         raise SystemExit('Could not load view class from "%s": %s' % (request.resource, exc))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+This file is part of mailpy - the mail API framework.
+
+Pre-forking supervisor serving mail views to mail.py through a unix socket:
+
+    mail.supervisor.py /run/mailpy.sock blog.blog_admin [other.resource ...]
+
+Set MAILPY_SUPERVISOR_SOCKET=/run/mailpy.sock in the environment of mail.py to use it.
+MAILPY_WORKER_MAX_RSS limits private memory (USS) of a worker in bytes; Pages shared with the supervisor are not
+counted.
+"""
+
+import logging
+import os
+import sys
+
+from mailpy.supervisor import MailSupervisor, load_view_class
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(process)d: %(message)s'))
+root_logger.addHandler(handler)
+
+
+def main():
+    if len(sys.argv) < 3:
+        raise SystemExit('Usage: %s <socket path> <resource> [resource ...]' % sys.argv[0])
+
+    socket_path = sys.argv[1]
+    views = [(resource, load_view_class(resource)) for resource in sys.argv[2:]]
+    max_rss = os.environ.get('MAILPY_WORKER_MAX_RSS')
+    supervisor = MailSupervisor(views, socket_path,
+                                workers=int(os.environ.get('MAILPY_WORKERS', 0)) or None,
+                                max_requests=int(os.environ.get('MAILPY_WORKER_MAX_REQUESTS', 1000)),
+                                max_rss=int(max_rss) if max_rss else None)
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import errno
+import select
+
+from mailpy.exceptions import MailPyError
+from mailpy.contrib.filelock import FileLock, FileLockTimeout
+from mailpy.contrib.filetransaction import FileTransaction
+
+
+class TooManyRequests(MailPyError):
+    """
+    Request rejected by admission control; retry_after is the number of seconds after which it may be admitted.
+    """
+    def __init__(self, message, retry_after=None):
+        super(TooManyRequests, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionControl(object):
+    """
+    Admission control in front of mail views shared by all processes through files next to state_file.
+    Requests are admitted by bin/mail.py according to the SMTP envelope before the message is read, so a rejected
+    message is deferred by the MTA (exit code EX_TEMPFAIL) and delivered again later.
+
+    Token buckets: every request takes one token from the bucket of its sender (sender_limit) and from the bucket
+    of its resource/method (method_limits, default_method_limit). Limits are (capacity, tokens per second) tuples.
+    A request is rejected when any of its buckets is empty. Buckets are stored in the JSON state_file.
+
+    Bounded queue: at most max_active requests are processed at the same time and at most max_queued requests
+    wait for a free slot (max_queued_writes of them are write requests). Every slot is a file locked (flock) by
+    the request holding it, so slots of dead processes are released by the kernel. Only the first waiting read
+    and write request check for a free slot; They sleep on a FIFO, which is written by release(), and re-check
+    at least every doorbell_timeout seconds. Waiting read requests (read_methods) are always admitted before
+    waiting write requests. A request waiting longer than queue_timeout is rejected.
+    """
+    version = 2
+    read_methods = frozenset(('get', 'list', 'search', 'preview'))
+    doorbell_timeout = 1  # Slots released by dead processes do not ring the doorbell
+    bucket_max_idle = 3600  # Unused buckets are refilled by now and need not be stored
+
+    def __init__(self, state_file, sender_limit=(30, 0.5), method_limits=None, default_method_limit=None,
+                 max_active=4, max_queued=32, max_queued_writes=8, queue_timeout=60):
+        self.state_file = state_file
+        self.sender_limit = sender_limit
+        self.method_limits = method_limits or {}  # {method: (capacity, rate)}
+        self.default_method_limit = default_method_limit
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queued_writes = max_queued_writes
+        self.queue_timeout = queue_timeout
+        self.slots_dir = state_file + '.d'
+        self._lock_file = state_file + '.lock'
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.state_file)
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r') as fp:
+                state = json.load(fp)
+        except (IOError, OSError, ValueError):
+            state = None
+
+        if not isinstance(state, dict) or state.get('version') != self.version:
+            state = {'version': self.version, 'buckets': {}}
+
+        return state
+
+    def _save_state(self, state):
+        """Atomically replace the state file"""
+        fd, temp_file = FileTransaction.mkstemp(os.path.dirname(self.state_file) or '.')
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(state, fp, separators=(',', ':'))
+
+            os.rename(temp_file, self.state_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+    def _update_state(self, fun, *args):
+        """Run fun(state, *args) with exclusive access to the state file and return its result;
+        The function returns (result, modified) tuple and the state file is saved only if it was modified"""
+        with FileLock(self._lock_file):
+            state = self._load_state()
+            res, modified = fun(state, *args)
+
+            if modified:
+                self._save_state(state)
+
+        return res
+
+    def _get_limits(self, sender, method, resource):
+        """Return list of (bucket key, (capacity, rate)) tuples for request"""
+        limits = []
+
+        if self.sender_limit:
+            limits.append(('sender:%s' % sender, self.sender_limit))
+
+        method_limit = self.method_limits.get(method, self.default_method_limit)
+
+        if method_limit:
+            limits.append(('method:%s/%s' % (resource, method), method_limit))
+
+        return limits
+
+    @staticmethod
+    def _refill(buckets, key, capacity, rate, now):
+        tokens, last = buckets.get(key, (capacity, now))
+
+        return min(capacity, tokens + (now - last) * rate)
+
+    def _take_tokens(self, state, limits, now):
+        """Take one token from every bucket and return 0 or return seconds until a token is available
+        (see _update_state())"""
+        buckets = state['buckets']
+        tokens = [(key, self._refill(buckets, key, capacity, rate, now), rate) for key, (capacity, rate) in limits]
+        wait = max([(1 - available) / rate for _, available, rate in tokens if available < 1] or [0])
+
+        if not wait:
+            for key, available, _ in tokens:
+                buckets[key] = [available - 1, now]
+
+        for key, (_, last) in list(buckets.items()):
+            if now - last > self.bucket_max_idle:
+                del buckets[key]
+
+        return wait, True
+
+    def _get_queue(self, priority):
+        """Return (name, size) of the waiting queue for read (priority 0) or write requests"""
+        if priority:
+            return 'write', self.max_queued_writes
+        else:
+            return 'read', self.max_queued - self.max_queued_writes
+
+    def _get_path(self, name):
+        return os.path.join(self.slots_dir, name)
+
+    def _lock_free_slot(self, name, size):
+        """Lock and return first free slot (FileLock) of size slots named name or return None"""
+        for i in range(size):
+            flock = FileLock(self._get_path('%s-%d' % (name, i)))
+
+            try:
+                flock.acquire(timeout=0)
+            except FileLockTimeout:
+                continue
+
+            return flock
+
+        return None
+
+    def _count_held_slots(self, name, size, first_only=False):
+        """Return number of slots held by other requests"""
+        held = 0
+
+        for i in range(size):
+            flock = FileLock(self._get_path('%s-%d' % (name, i)), shared=True)
+
+            try:
+                flock.acquire(timeout=0)
+            except FileLockTimeout:
+                held += 1
+
+                if first_only:
+                    break
+            else:
+                flock.release()
+
+        return held
+
+    def _open_doorbell(self, name):
+        """Open FIFO used for waking up the first waiting request of the queue"""
+        path = self._get_path(name + '.doorbell')
+
+        try:
+            os.mkfifo(path, 0o600)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        return os.open(path, os.O_RDWR | os.O_NONBLOCK)  # Read-write, so there is always a writer (no EOF)
+
+    def _ring(self, name):
+        """Wake up the first waiting request of the queue"""
+        try:
+            fd = os.open(self._get_path(name + '.doorbell'), os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            return  # Nobody is waiting
+
+        try:
+            os.write(fd, b'.')
+        except OSError:
+            pass  # Full; The waiting request will be woken up anyway
+        finally:
+            os.close(fd)
+
+    def _wait_for_slot(self, queue, priority, deadline):
+        """Return locked active slot (FileLock) or None after deadline; Called only by the first waiting request"""
+        doorbell = self._open_doorbell(queue)
+
+        try:
+            while True:
+                readers_waiting = priority and self._count_held_slots(*self._get_queue(0), first_only=True)
+
+                if not readers_waiting:
+                    slot = self._lock_free_slot('active', self.max_active)
+
+                    if slot:
+                        return slot
+
+                timeout = deadline - time.time()
+
+                if timeout <= 0:
+                    return None
+
+                if select.select([doorbell], [], [], min(timeout, self.doorbell_timeout))[0]:
+                    try:
+                        os.read(doorbell, 4096)
+                    except OSError:
+                        pass
+        finally:
+            os.close(doorbell)
+
+    def admit(self, sender, method, resource):
+        """Wait for a free slot and return a ticket for release() or raise TooManyRequests"""
+        priority = int(method not in self.read_methods)
+        deadline = time.time() + self.queue_timeout
+        queue, queue_size = self._get_queue(priority)
+
+        if not os.path.isdir(self.slots_dir):
+            try:
+                os.makedirs(self.slots_dir)
+            except OSError:
+                pass  # Created by another process
+
+        queue_slot = self._lock_free_slot(queue, queue_size)
+
+        if queue_slot is None:
+            raise TooManyRequests('Server busy, retry after %d seconds' % self.queue_timeout,
+                                  retry_after=self.queue_timeout)
+
+        try:
+            wait = self._update_state(self._take_tokens, self._get_limits(sender, method, resource), time.time())
+
+            if wait:
+                retry_after = max(1, int(round(wait)))
+                raise TooManyRequests('Rate limit exceeded, retry after %d seconds' % retry_after,
+                                      retry_after=retry_after)
+
+            head = FileLock(self._get_path(queue + '.head'))  # Held by the first waiting request of the queue
+
+            try:
+                head.acquire(timeout=max(deadline - time.time(), 0.001))
+            except FileLockTimeout:
+                slot = None
+            else:
+                try:
+                    slot = self._wait_for_slot(queue, priority, deadline)
+                finally:
+                    head.release()
+        finally:
+            queue_slot.release()
+
+            if not priority:
+                self._ring('write')  # The first waiting write request may be waiting for this read request
+
+        if slot is None:
+            raise TooManyRequests('Request was queued for more than %s seconds' % self.queue_timeout,
+                                  retry_after=self.queue_timeout)
+
+        return slot
+
+    def release(self, ticket):
+        """Free the slot taken by admit()"""
+        ticket.release()
+        self._ring('read')
+        self._ring('write')
+
+    def stats(self):
+        """Return dict with numbers of active and queued requests"""
+        return {
+            'active': self._count_held_slots('active', self.max_active),
+            'queued': sum(self._count_held_slots(*self._get_queue(priority)) for priority in (0, 1)),
+            'buckets': len(self._load_state()['buckets']),
+        }
@@ -11,8 +11,21 @@ class BlogAdmin(PelicanMailView):
     settings_file = '/var/www/blog/pelicanconf.py'  # Path to pelican settings file
     article_class = RstArticle  # Subclass of PelicanArticle used for new articles (rst file format is the default one)
     article_file_name = '%Y-%m-%d-{slug}'  # Without extension; valid placeholders: {slug} and strftime() directives
+    # admission = AdmissionControl('/var/tmp/blog-admission.json', method_limits={'post': (10, 0.05)})  # Defer floods
+    # site_registry = SiteRegistry(max_size=8)  # Share LRU of PelicanAPI objects (mailpy.contrib.pelican.sites)
+    # dedup_static_files = True  # Link already stored attachments instead of saving identical copies
+    # image_max_size = (1600, 1600)  # Downscale, recompress and strip EXIF from attached images (requires Pillow)
+    # image_thumbnail_size = (400, 400)  # Show thumbnails linked to full size images in articles (requires Pillow)
+    # notifier = Notifier('/var/tmp/blog-notify')  # Mail new articles to subscribers (mailpy.contrib.notify)
+    # subscribers_file = '/var/www/blog/subscribers.txt'  # One address per line
+    # response_template = 'reply.html'  # Send HTML responses rendered from a template (requires Jinja2)
+    # template_dirs = ('/var/www/blog/mail_templates',)
     # papi_settings = (  # PelicanAPI settings
     #     ('images_dir', 'images'),  # Directory inside content path used for storing attached images
     #     ('files_dir', 'files'),    # Directory inside content path used for storing non-image mail attachments
     #     ('repo_path', '/var/www/blog'),  # Set to enable automatic git commits after post() and delete()
+    #     ('push_remotes', ('origin',)),  # Git remotes receiving new commits in background (requires repo_path)
+    #     ('deploy_path', '/var/www/html'),  # Web root receiving only changed output files after every publish
+    #     ('deploy_mode', 'symlink'),  # 'rename' (replace changed files) or 'symlink' (switch whole release at once)
+    #     ('build_worker', True),  # Run pelican in a separate, periodically recycled process
     # )
@@ -1,5 +1,15 @@
 import os
 import time
+import fcntl
+import signal
+import threading
+
+
+def _in_main_thread():
+    try:
+        return threading.current_thread() is threading.main_thread()
+    except AttributeError:  # Python 2
+        return threading.current_thread().name == 'MainThread'
 
 
 class FileLockTimeout(Exception):
@@ -12,25 +22,101 @@ class FileLockError(Exception):
 
 class FileLock(object):
     """
-    Simple file lock.
+    Simple file lock based on kernel advisory locks (flock).
+    Waiters are woken up immediately after the lock is released and the lock is released automatically
+    when the owning process dies. Use shared=True for a reader lock (multiple shared locks can be held at once).
+
+    A blocking wait with timeout uses SIGALRM only in the main thread and only if the process does not use
+    SIGALRM or ITIMER_REAL itself; Otherwise the lock is polled with exponential backoff.
     """
-    def __init__(self, lockfile):
+    def __init__(self, lockfile, shared=False):
         self._lockfile = lockfile
         self._lockfile_fd = None
+        self.shared = shared
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, self._lockfile)
 
     def __nonzero__(self):
         return self.is_locked()
+    __bool__ = __nonzero__
+
+    def __enter__(self):
+        self.acquire()
+        return self
 
-    def _write_file(self):
-        self._lockfile_fd = os.open(self._lockfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_TRUNC, 0o644)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    @property
+    def lockfile(self):
+        return self._lockfile
+
+    @property
+    def _operation(self):
+        if self.shared:
+            return fcntl.LOCK_SH
+        else:
+            return fcntl.LOCK_EX
 
-    def _remove_file(self):
+    def _open_file(self):
+        self._lockfile_fd = os.open(self._lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _close_file(self):
         os.close(self._lockfile_fd)
         self._lockfile_fd = None
-        os.remove(self._lockfile)
+
+    def _flock_nonblocking(self):
+        """Try to lock the file and return True on success"""
+        try:
+            fcntl.flock(self._lockfile_fd, self._operation | fcntl.LOCK_NB)
+        except (OSError, IOError):
+            return False
+        else:
+            return True
+
+    @staticmethod
+    def _can_use_alarm():
+        """Return True if SIGALRM and ITIMER_REAL are free to use in this thread"""
+        return (_in_main_thread() and signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0) and
+                signal.getsignal(signal.SIGALRM) in (signal.SIG_DFL, signal.SIG_IGN, None))
+
+    def _flock_alarm(self, timeout):
+        """Blocking lock interrupted by SIGALRM after timeout (see _can_use_alarm())"""
+        def alarm_handler(signum, frame):
+            raise FileLockTimeout('Could not acquire lock within %s seconds' % timeout)
+
+        old_handler = signal.signal(signal.SIGALRM, alarm_handler)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        try:
+            fcntl.flock(self._lockfile_fd, self._operation)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
+
+    def _flock_poll(self, timeout, sleep_interval):
+        """Non-blocking lock attempts with exponential backoff"""
+        start_time = time.time()
+        interval = 0.001
+
+        while not self._flock_nonblocking():
+            if (time.time() - start_time) > timeout:
+                raise FileLockTimeout('Could not acquire lock within %s seconds' % timeout)
+
+            time.sleep(interval)
+            interval = min(interval * 2, sleep_interval)
+
+    def _is_current_file(self):
+        """Return True if the locked file was not removed by unlink() in the meantime"""
+        try:
+            st = os.stat(self._lockfile)
+        except OSError:
+            return False
+
+        fst = os.fstat(self._lockfile_fd)
+
+        return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
 
     def exists(self):
         return os.path.exists(self._lockfile)
@@ -38,28 +124,53 @@ class FileLock(object):
     def is_locked(self):
         return self._lockfile_fd is not None
 
-    def acquire(self, timeout=30, sleep_interval=1):
-        start_time = time.time()
-
-        while not self.is_locked():
-            if not self.exists():
-                try:
-                    self._write_file()
-                except (OSError, IOError):
-                    pass  # Failed to create lock file
+    def acquire(self, timeout=30, sleep_interval=0.1):
+        """Acquire the lock; Wait forever if timeout is None or fail immediately if timeout is 0"""
+        if self.is_locked():
+            return
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            self._open_file()
+
+            try:
+                if timeout is None:
+                    fcntl.flock(self._lockfile_fd, self._operation)
+                elif not timeout:
+                    if not self._flock_nonblocking():
+                        raise FileLockTimeout('Lock is held by another process')
+                elif self._flock_nonblocking():
+                    pass
+                elif self._can_use_alarm():
+                    self._flock_alarm(timeout)
                 else:
-                    break  # Created lock file
+                    self._flock_poll(timeout, sleep_interval)
+            except BaseException:
+                self._close_file()
+                raise
+
+            if self._is_current_file():
+                return
 
-            if timeout is not None and (time.time() - start_time) > timeout:
-                raise FileLockTimeout('Could not acquire lock within %d seconds' % timeout)
-            else:
-                time.sleep(sleep_interval)
+            self._close_file()  # The lock file was removed by unlink() while we were waiting; Lock the new one
+
+            if timeout:
+                timeout = max(deadline - time.time(), 0.001)
+
+    def unlink(self):
+        """Remove the lock file while holding an exclusive lock and release the lock;
+        Processes waiting for the removed file will lock a new file"""
+        if not self.is_locked() or self.shared:
+            raise FileLockError('Exclusive lock is required')
+
+        os.remove(self._lockfile)
+        self.release()
 
     def release(self):
-        if self.exists():
-            if self.is_locked():
-                self._remove_file()
-            else:
-                raise FileLockError('Lock was never acquired')
-        else:
-            raise FileLockError('Not locked')
+        if not self.is_locked():
+            raise FileLockError('Lock was never acquired')
+
+        # The lock file is not removed, because another process may be already waiting on the same inode (see unlink())
+        fcntl.flock(self._lockfile_fd, fcntl.LOCK_UN)
+        self._close_file()
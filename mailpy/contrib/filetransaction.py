@@ -0,0 +1,188 @@
+import os
+import time
+import errno
+import tempfile
+
+
+def _get_file_mode():
+    """Return default permissions for new files (0666 & ~umask)"""
+    umask = os.umask(0)
+    os.umask(umask)
+
+    return 0o666 & ~umask
+
+
+class FileTransactionError(Exception):
+    pass
+
+
+class FileTransaction(object):
+    """
+    Atomic creation of a set of new files.
+    Every file is staged as a hidden temporary file in its target directory. commit() flushes all staged files
+    in one pass (one fsync per file and one per directory instead of a full sync cycle for every file) and then
+    links them into place. Existing files are never overwritten (unless added with replace=True) and a crash can
+    leave only complete files or temporary files behind (see cleanup()). On error all staged and already committed
+    files are removed and replaced files are restored.
+    """
+    temp_prefix = '.#mailpy-'  # Ignored by pelican (default IGNORE_FILES)
+    file_mode = _get_file_mode()  # Computed once on import; os.umask() is process-wide and not thread-safe
+
+    def __init__(self, fsync=True):
+        self.fsync = fsync
+        self._staged = []  # [(temp file, file path, replace)]
+        self._committed = []
+        self._replaced = []  # [(file path, backup file)]
+
+    def __repr__(self):
+        return '%s(%d staged, %d committed)' % (self.__class__.__name__, len(self._staged), len(self._committed))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            if self._staged:
+                self.commit()
+        else:
+            self.rollback()
+
+    @property
+    def files(self):
+        """List of staged or committed file paths"""
+        return [file_path for _, file_path, _ in self._staged] + self._committed
+
+    @classmethod
+    def mkstemp(cls, directory):
+        """Create new temporary file in directory with default file permissions and return (fd, path) tuple"""
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # Created by another process
+
+        fd, path = tempfile.mkstemp(prefix=cls.temp_prefix, dir=directory)
+        os.fchmod(fd, cls.file_mode)  # mkstemp() creates files readable only by the owner
+
+        return fd, path
+
+    def add(self, file_path, content=None, temp_file=None, replace=False):
+        """Stage new file with content (byte str) or from an existing temporary file in the same directory.
+        The transaction takes ownership of the temporary file. Use replace=True to atomically replace existing file"""
+        if temp_file is None:
+            fd, temp_file = self.mkstemp(os.path.dirname(file_path))
+
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(content)
+            except Exception:
+                os.remove(temp_file)
+                raise
+
+        self._staged.append((temp_file, file_path, replace))
+
+    @staticmethod
+    def _fsync_path(path, flags=os.O_RDONLY):
+        fd = os.open(path, flags)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def commit(self):
+        """Flush all staged files to disk and move them into place"""
+        if not self._staged:
+            raise FileTransactionError('Nothing to commit')
+
+        try:
+            if self.fsync:
+                for temp_file, _, _ in self._staged:
+                    self._fsync_path(temp_file)
+
+            while self._staged:
+                temp_file, file_path, replace = self._staged[0]
+
+                if replace:
+                    self._replace(temp_file, file_path)
+                else:
+                    try:
+                        os.link(temp_file, file_path)  # Atomic and fails if file_path exists (unlike rename)
+                    except OSError as exc:
+                        if exc.errno == errno.EEXIST:
+                            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), file_path)
+                        raise
+
+                    os.remove(temp_file)
+
+                self._committed.append(file_path)
+                self._staged.pop(0)
+
+            if self.fsync:
+                for directory in set(os.path.dirname(f) for f in self._committed):
+                    self._fsync_path(directory)
+        except Exception:
+            self.rollback()
+            raise
+
+        for _, backup in self._replaced:
+            if backup:
+                os.remove(backup)
+
+        del self._replaced[:]
+
+        return list(self._committed)
+
+    def _replace(self, temp_file, file_path):
+        """Keep a hard link to the original file (for rollback) and rename temporary file over it"""
+        if os.path.exists(file_path):
+            backup = temp_file + '.orig'
+            os.link(file_path, backup)
+        else:
+            backup = None
+
+        try:
+            os.rename(temp_file, file_path)
+        except OSError:
+            if backup:
+                os.remove(backup)
+            raise
+
+        self._replaced.append((file_path, backup))
+
+    def rollback(self):
+        """Remove all staged and committed files and restore replaced files"""
+        replaced = dict(self._replaced)
+
+        for f in [temp_file for temp_file, _, _ in self._staged] + self._committed:
+            try:
+                if replaced.get(f):
+                    os.rename(replaced[f], f)
+                else:
+                    os.remove(f)
+            except OSError:
+                pass
+
+        del self._staged[:]
+        del self._committed[:]
+        del self._replaced[:]
+
+    @classmethod
+    def cleanup(cls, directory, max_age=3600):
+        """Remove temporary files left behind by crashed processes and return list of removed files"""
+        removed = []
+        now = time.time()
+
+        for dirpath, _, filenames in os.walk(directory):
+            for f in filenames:
+                if f.startswith(cls.temp_prefix):
+                    path = os.path.join(dirpath, f)
+
+                    try:
+                        if now - os.path.getmtime(path) > max_age:
+                            os.remove(path)
+                            removed.append(path)
+                    except OSError:
+                        pass
+
+        return removed
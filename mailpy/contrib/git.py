@@ -1,4 +1,14 @@
 from subprocess import Popen, PIPE, STDOUT
+import atexit
+import logging
+import threading
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
 
 
 def execute(cmd, stderr_to_stdout=False, stdin=None, cwd=None):
@@ -100,3 +110,129 @@ class Git(object):
             raise GitError('Nothing to commit')
 
         return self._git('commit', '-m', msg)
+
+    def rev_parse(self, rev='HEAD'):
+        """git rev-parse <rev>"""
+        return self._git('rev-parse', rev).strip().decode('ascii')
+
+    def push(self, remote, *refspecs):
+        """git push <remote> <refspecs>"""
+        return self._git('push', '--porcelain', remote, *refspecs)
+
+
+class GitPusher(object):
+    """
+    Background git replication.
+    Commits queued by push() are collected for a short delay and then pushed in one batch to every remote
+    by a daemon worker thread. At interpreter exit (after the mail response was sent) pending commits are pushed
+    without the delay and retry pauses and a short-lived process waits at most exit_timeout seconds for them.
+    """
+    git_class = Git
+
+    def __init__(self, repo, remotes, refspecs=('HEAD',), delay=2, retries=3, retry_interval=5, idle_timeout=1,
+                 exit_timeout=10):
+        self.repo = repo
+        self.remotes = tuple(remotes)
+        self.refspecs = tuple(refspecs)
+        self.delay = delay
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.idle_timeout = idle_timeout
+        self.exit_timeout = exit_timeout
+        self.failed = {}  # remote -> last error
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._exiting = threading.Event()
+        self._atexit_registered = False
+
+    def __repr__(self):
+        return '%s(%s -> %s)' % (self.__class__.__name__, self.repo, ', '.join(self.remotes))
+
+    def _start_worker(self):
+        """Start the worker thread if it is not running"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='%s-worker' % self.__class__.__name__)
+                self._thread.daemon = True
+                self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self._shutdown)
+                self._atexit_registered = True
+
+    def _get_batch(self):
+        """Wait for queued commits and return all of them or None if the queue stayed empty"""
+        try:
+            batch = [self._queue.get(timeout=self.idle_timeout)]
+        except Empty:
+            with self._lock:
+                if self._queue.empty():
+                    self._thread = None
+                    return None
+
+            return self._get_batch()
+
+        self._exiting.wait(self.delay)  # Coalesce commits created shortly after the first one
+
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _push_remote(self, git, remote, commits):
+        """Push to one remote and retry on failure"""
+        for attempt in range(1, self.retries + 2):
+            try:
+                git.push(remote, *self.refspecs)
+            except GitError as exc:
+                logger.warning('Push of %d commit(s) to %s failed (attempt %d): %s', len(commits), remote, attempt, exc)
+                self.failed[remote] = exc
+
+                if attempt > self.retries or self._exiting.wait(self.retry_interval * attempt):
+                    break
+            else:
+                logger.info('Pushed %d commit(s) to %s: %s', len(commits), remote, ', '.join(commits))
+                self.failed.pop(remote, None)
+                return True
+
+        logger.error('Giving up push of %d commit(s) to %s', len(commits), remote)
+
+        return False
+
+    def _run(self):
+        """Worker thread loop"""
+        git = self.git_class(self.repo)
+
+        while True:
+            commits = self._get_batch()
+
+            if commits is None:
+                break
+
+            for remote in self.remotes:
+                self._push_remote(git, remote, commits)
+
+    def push(self, commit):
+        """Queue commit for replication"""
+        self._queue.put(commit)
+        self._start_worker()
+
+    def join(self, timeout=None):
+        """Wait for the worker thread to push all queued commits"""
+        thread = self._thread
+
+        if thread is not None:
+            thread.join(timeout)
+
+    def _shutdown(self):
+        """Push pending commits without waiting and give up after exit_timeout seconds (called at exit)"""
+        self._exiting.set()
+        self.join(self.exit_timeout)
+        thread = self._thread
+
+        if thread is not None and thread.is_alive():
+            logger.error('Giving up push to %s after %s seconds at exit', ', '.join(self.remotes), self.exit_timeout)
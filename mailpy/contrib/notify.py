@@ -0,0 +1,336 @@
+import os
+import json
+import errno
+import socket
+import smtplib
+import logging
+import threading
+from collections import namedtuple, OrderedDict
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty  # Python 2
+
+from mailpy.contrib.filelock import FileLock, FileLockTimeout
+from mailpy.contrib.filetransaction import FileTransaction
+
+logger = logging.getLogger(__name__)
+
+NotifyResult = namedtuple('NotifyResult', ('delivered', 'failed', 'skipped'))
+
+
+def get_domain(address):
+    return address.rsplit('@', 1)[-1].lower()
+
+
+class Notifier(object):
+    """
+    Delivery of one message to many recipients (e.g. blog subscribers) over a few persistent SMTP sessions.
+
+    The message is rendered only once. Recipients are grouped by domain and sent in batches of at most batch_size
+    envelope recipients per SMTP transaction. At most sessions SMTP connections (threads) deliver batches
+    concurrently and every connection is reused for all its batches. Permanently refused recipients (5xx) are
+    reported as failed; Temporary and unexpected errors are retried (retries) on a fresh connection.
+
+    Every job has a progress file in progress_dir with one JSON line per finished recipient and it is locked (flock)
+    by the process delivering it. A job interrupted by a crash is resumed (by resume() or by notify() with the same
+    job_id) and only recipients of the batches in flight during the crash can get the message twice. The job files
+    are kept until every recipient has a recorded result. Use submit() to deliver a job in a background thread.
+    """
+    progress_suffix = '.progress'
+    message_suffix = '.eml'
+    lock_suffix = '.lock'
+    lock_timeout = 30  # Seconds to wait for another process delivering the same job
+
+    def __init__(self, progress_dir, host='localhost', port=25, sessions=4, batch_size=50, retries=2, timeout=30,
+                 smtp_class=smtplib.SMTP):
+        self.progress_dir = progress_dir
+        self.host = host
+        self.port = port
+        self.sessions = sessions
+        self.batch_size = batch_size
+        self.retries = retries
+        self.timeout = timeout
+        self.smtp_class = smtp_class
+
+    def __repr__(self):
+        return '%s(%s:%s, sessions=%d)' % (self.__class__.__name__, self.host, self.port, self.sessions)
+
+    def _get_job_file(self, job_id, suffix):
+        return os.path.join(self.progress_dir, job_id + suffix)
+
+    def _save_job(self, job_id, sender, recipients, msg):
+        """Store job (envelope and rendered message) for resume()"""
+        job_file = self._get_job_file(job_id, self.message_suffix)
+        fd, temp_file = FileTransaction.mkstemp(self.progress_dir)
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'sender': sender, 'recipients': recipients, 'message': msg}, fp)
+
+            os.rename(temp_file, job_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+    def _load_job(self, job_id):
+        with open(self._get_job_file(job_id, self.message_suffix), 'r') as fp:
+            job = json.load(fp)
+
+        return job['sender'], job['recipients'], job['message']
+
+    def _load_progress(self, job_id):
+        """Return dict {recipient: error or None} of finished recipients"""
+        done = {}
+
+        try:
+            with open(self._get_job_file(job_id, self.progress_suffix), 'r') as fp:
+                for line in fp:
+                    try:
+                        rcpt, error = json.loads(line)
+                    except ValueError:
+                        continue  # Last line written during a crash
+
+                    done[rcpt] = error
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+        return done
+
+    def _remove_job(self, job_id):
+        for suffix in (self.message_suffix, self.progress_suffix):
+            try:
+                os.remove(self._get_job_file(job_id, suffix))
+            except OSError:
+                pass
+
+    def _lock_job(self, job_id, timeout):
+        """Return exclusive lock (FileLock) of the job or raise FileLockTimeout"""
+        if not os.path.isdir(self.progress_dir):
+            try:
+                os.makedirs(self.progress_dir)
+            except OSError:
+                pass  # Created by another process
+
+        flock = FileLock(self._get_job_file(job_id, self.lock_suffix))
+        flock.acquire(timeout=timeout)
+
+        return flock
+
+    def _unlock_job(self, job_id, flock):
+        """Release the job lock and remove the lock file of a finished job"""
+        if os.path.exists(self._get_job_file(job_id, self.message_suffix)):
+            flock.release()
+        else:
+            flock.unlink()
+
+    def get_pending_jobs(self):
+        """Return list of IDs of unfinished jobs"""
+        try:
+            files = os.listdir(self.progress_dir)
+        except OSError:
+            return []
+
+        return sorted(f[:-len(self.message_suffix)] for f in files if f.endswith(self.message_suffix))
+
+    def _get_batches(self, recipients):
+        """Split recipients into batches of at most batch_size recipients from the same domain"""
+        domains = OrderedDict()
+
+        for rcpt in recipients:
+            domains.setdefault(get_domain(rcpt), []).append(rcpt)
+
+        batches = []
+
+        for rcpts in domains.values():
+            for i in range(0, len(rcpts), self.batch_size):
+                batches.append(rcpts[i:i + self.batch_size])
+
+        batches.sort(key=len, reverse=True)  # Big domains first
+
+        return batches
+
+    def _connect(self):
+        return self.smtp_class(self.host, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            smtp.close()
+
+    def _send_batch(self, smtp, sender, batch, msg):
+        """Send one SMTP transaction and return dict {recipient: error or None}"""
+        try:
+            refused = smtp.sendmail(sender, batch, msg)
+        except smtplib.SMTPRecipientsRefused as exc:
+            refused = exc.recipients
+
+        res = dict.fromkeys(batch)
+
+        for rcpt, (code, resp) in refused.items():
+            if code < 500:
+                res.pop(rcpt)  # Temporary error; retry
+            else:
+                res[rcpt] = '%s %s' % (code, resp.decode('utf-8', 'replace') if isinstance(resp, bytes) else resp)
+
+        return res
+
+    def _worker(self, batches, sender, msg, record):
+        smtp = None
+
+        while True:
+            try:
+                batch, attempt = batches.get_nowait()
+            except Empty:
+                break
+
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+
+                res = self._send_batch(smtp, sender, batch, msg)
+            except Exception as exc:
+                if isinstance(exc, (smtplib.SMTPException, socket.error)):
+                    logger.warning('Could not deliver notification to %d recipients (attempt %d): %s',
+                                   len(batch), attempt + 1, exc)
+                else:
+                    logger.exception('Could not deliver notification to %d recipients (attempt %d): %s',
+                                     len(batch), attempt + 1, exc)
+
+                if smtp is not None:
+                    self._close(smtp)
+                    smtp = None
+
+                if attempt < self.retries:
+                    batches.put((batch, attempt + 1))
+                else:
+                    record(dict.fromkeys(batch, str(exc) or exc.__class__.__name__))
+
+                continue
+
+            record(res)
+            retry = [rcpt for rcpt in batch if rcpt not in res]
+
+            if retry:
+                if attempt < self.retries:
+                    batches.put((retry, attempt + 1))
+                else:
+                    record(dict.fromkeys(retry, 'Temporary failure'))
+
+        if smtp is not None:
+            self._close(smtp)
+
+    def _deliver(self, job_id, sender, recipients, msg):
+        """Run the job while holding its lock and return NotifyResult"""
+        if not os.path.exists(self._get_job_file(job_id, self.message_suffix)):
+            self._save_job(job_id, sender, recipients, msg)
+
+        done = self._load_progress(job_id)
+        pending = [rcpt for rcpt in OrderedDict.fromkeys(recipients) if rcpt not in done]
+        batches = Queue()
+
+        for batch in self._get_batches(pending):
+            batches.put((batch, 0))
+
+        results = {}
+        lock = threading.Lock()
+
+        with open(self._get_job_file(job_id, self.progress_suffix), 'a') as progress:
+            def record(res):
+                with lock:
+                    results.update(res)
+                    progress.write(''.join(json.dumps([rcpt, error]) + '\n' for rcpt, error in res.items()))
+                    progress.flush()
+
+            threads = [threading.Thread(target=self._worker, args=(batches, sender, msg, record))
+                       for _ in range(min(self.sessions, batches.qsize()))]
+
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        unfinished = [rcpt for rcpt in pending if rcpt not in results]
+
+        if unfinished:
+            logger.error('Notification job %s was interrupted; %d recipients are left for resume()', job_id,
+                         len(unfinished))
+        else:
+            self._remove_job(job_id)
+
+        failed = {rcpt: error for rcpt, error in results.items() if error}
+
+        return NotifyResult(len(results) - len(failed), failed, len(recipients) - len(pending))
+
+    def notify(self, job_id, sender, recipients, msg):
+        """Send rendered message (string) to all recipients and return NotifyResult;
+        Recipients already finished by a previous run of the same job are skipped"""
+        flock = self._lock_job(job_id, self.lock_timeout)
+
+        try:
+            return self._deliver(job_id, sender, recipients, msg)
+        finally:
+            self._unlock_job(job_id, flock)
+
+    def _deliver_submitted(self, job_id, sender, recipients, msg, flock):
+        try:
+            res = self._deliver(job_id, sender, recipients, msg)
+        except Exception as exc:
+            logger.exception('Notification job %s failed: %s', job_id, exc)
+        else:
+            logger.info('Notification job %s finished: %d delivered, %d failed, %d skipped', job_id, res.delivered,
+                        len(res.failed), res.skipped)
+        finally:
+            self._unlock_job(job_id, flock)
+
+    def submit(self, job_id, sender, recipients, msg):
+        """Save the job and deliver it by notify() in a background thread, which is returned;
+        The process waits for the thread before it exits and a job interrupted by the exit is finished by resume()"""
+        flock = self._lock_job(job_id, self.lock_timeout)
+
+        try:
+            if not os.path.exists(self._get_job_file(job_id, self.message_suffix)):
+                self._save_job(job_id, sender, recipients, msg)
+
+            thread = threading.Thread(target=self._deliver_submitted, args=(job_id, sender, recipients, msg, flock),
+                                      name='mailpy-notify-%s' % job_id)
+            thread.start()
+        except Exception:
+            flock.release()
+            raise
+
+        return thread
+
+    def resume(self):
+        """Finish all interrupted jobs and return dict {job_id: NotifyResult};
+        Jobs locked by a running notify() or submit() are skipped"""
+        res = {}
+
+        for job_id in self.get_pending_jobs():
+            try:
+                flock = self._lock_job(job_id, 0)
+            except FileLockTimeout:
+                continue  # Being delivered by another process or thread
+
+            try:
+                try:
+                    sender, recipients, msg = self._load_job(job_id)
+                except (IOError, OSError) as exc:
+                    if exc.errno != errno.ENOENT:
+                        logger.error('Could not load notification job %s: %s', job_id, exc)
+                    continue  # ENOENT: finished before we acquired the lock
+                except (ValueError, KeyError) as exc:
+                    logger.error('Could not load notification job %s: %s', job_id, exc)
+                    continue
+
+                res[job_id] = self._deliver(job_id, sender, recipients, msg)
+            finally:
+                self._unlock_job(job_id, flock)
+
+        return res
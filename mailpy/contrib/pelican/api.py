@@ -1,45 +1,237 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import io
 import os
+import shutil
+import logging
 import fnmatch
+import hashlib
+import tempfile
 
-from pelican.settings import read_settings
-from pelican import Pelican
-
-from mailpy.contrib.git import Git, GitError
+from mailpy.contrib.git import Git, GitError, GitPusher
 from .exceptions import PelicanAPIError, FileNotFound, MultipleFilesFound, UnknownFileFormat
-from .content import ARTICLE_CLASSES, PelicanContentFile, pelican_article
+from .content import ARTICLE_CLASSES, TEMP_FILE_PREFIX, PelicanContentFile, pelican_article
+from .index import StaticFileNamespace, ArticleIndex, SearchIndex
+from .deploy import OutputDeployer
+from .worker import BuildWorker
+from .settings import SettingsCache, read_settings, resolve_settings
 
 __all__ = ('PelicanAPI',)
 
+logger = logging.getLogger(__name__)
+
+
+_writer_classes = None
+_active_writers = {}  # id(Pelican object) -> writer class used by the running build
+
+
+def _get_writer(pelican):
+    """Receiver of the pelican get_writer signal"""
+    return _active_writers.get(id(pelican))
+
+
+class _DigestFile(io.FileIO):
+    """
+    Output file, which computes the digest of the written content and stores [size, mtime, digest] of the file
+    into the written dict (key is the full path) when it is closed.
+    """
+    def __init__(self, filename, written):
+        super(_DigestFile, self).__init__(filename, 'w')
+        self._written = written
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        size = super(_DigestFile, self).write(data)
+        self._hash.update(memoryview(data)[:size])
+
+        return size
+
+    def close(self):
+        if not self.closed:
+            stat = os.fstat(self.fileno())
+            self._written[os.path.abspath(self.name)] = [stat.st_size, stat.st_mtime, self._hash.hexdigest()]
+
+        super(_DigestFile, self).close()
+
+
+def _get_digest_copy_file(written):
+    """Return replacement of pelican.utils.copy_file(), which computes digests of static files while copying them"""
+    def copy_file(source, destination):
+        try:
+            with open(source, 'rb') as src:
+                with io.BufferedWriter(_DigestFile(destination, written)) as dst:
+                    shutil.copyfileobj(src, dst)
+        except (IOError, OSError) as exc:
+            logger.warning('A problem occurred copying file %s to %s; %s', source, destination, exc)
+
+    return copy_file
+
+
+class _StaticContentLookup(dict):
+    """
+    static_content of the preview context, which resolves links to static files existing in the content path
+    on demand, so single articles can be read without listing all static files.
+    """
+    def __init__(self, content_path, settings, context):
+        super(_StaticContentLookup, self).__init__()
+        self._content_path = content_path
+        self._settings = settings
+        self._context = context
+
+    def get(self, path, default=None):
+        full_path = os.path.join(self._content_path, path)
+
+        if not os.path.isfile(full_path):
+            return default
+
+        from pelican.contents import Static
+
+        return Static('', settings=self._settings, source_path=full_path, context=self._context)
+
+
+def get_writer_classes():
+    """Return (DigestWriter, SelectiveWriter) pelican writer classes (pelican is imported on first use)"""
+    global _writer_classes
+
+    if _writer_classes is None:
+        from pelican import signals
+        from pelican.writers import Writer
+
+        class DigestWriter(Writer):
+            """
+            Pelican writer, which computes content digests of output files while writing them (see _DigestFile),
+            so the deployer does not have to read them again.
+            """
+            written = None  # Set per build
+
+            def _open_w(self, filename, encoding, override=False):
+                fp = super(DigestWriter, self)._open_w(filename, encoding, override=override)
+
+                if fp.name == os.devnull:
+                    return fp
+
+                fp.close()  # Opened by pelican after its overwrite checks
+
+                return io.TextIOWrapper(io.BufferedWriter(_DigestFile(filename, self.written)), encoding=encoding)
+
+        class SelectiveWriter(DigestWriter):
+            """
+            Pelican writer, which writes only output files of selected articles and files listing them:
+            article pages (selected_files; full paths), feeds and index, archive, tag, category and author pages
+            containing any selected article (selected_sources; full source paths).
+            """
+            selected_files = frozenset()
+            selected_sources = frozenset()
+
+            def _lists_selected(self, elements):
+                return any(getattr(i, 'source_path', None) in self.selected_sources for i in elements or ())
+
+            def write_file(self, name, template, context, *args, **kwargs):
+                if (os.path.abspath(os.path.join(self.output_path, name)) in self.selected_files or
+                        self._lists_selected(kwargs.get('articles'))):
+                    return super(SelectiveWriter, self).write_file(name, template, context, *args, **kwargs)
+
+            def write_feed(self, elements, context, path=None, *args, **kwargs):
+                if path is None or self._lists_selected(elements[:self.settings.get('FEED_MAX_ITEMS')]):
+                    return super(SelectiveWriter, self).write_feed(elements, context, path, *args, **kwargs)
+
+        signals.get_writer.connect(_get_writer)
+        _writer_classes = (DigestWriter, SelectiveWriter)
+
+    return _writer_classes
+
 
 class PelicanAPI(object):
     """
     Pelican blog management API.
     repo_path is used by the commit() method (git)
+    push_remotes is a list of git remotes, which will receive new commits in background (see GitPusher).
     images_dir and files_dir are directory names inside content path.
+    index_path is a directory for mailpy indexes (default: CACHE_PATH/mailpy).
+    deploy_path is a web root, which receives only changed output files after every publish (see OutputDeployer).
+    build_worker=True runs pelican in a dedicated, periodically recycled process (see BuildWorker).
+    Settings are read from a snapshot in settings_cache_dir (see SettingsCache; set to False to disable the cache)
+    and pelican itself is imported only when it is needed for a build or for parsing of an article.
     """
     article_classes = ARTICLE_CLASSES
     static_file_class = PelicanContentFile
-
-    def __init__(self, settings_file, repo_path=None, images_dir='images', files_dir='files'):
+    static_namespace_class = StaticFileNamespace
+    article_index_class = ArticleIndex
+    search_index_class = SearchIndex
+    pusher_class = GitPusher
+    deployer_class = OutputDeployer
+    build_worker_class = BuildWorker
+    settings_cache_class = SettingsCache
+
+    def __init__(self, settings_file, repo_path=None, images_dir='images', files_dir='files', push_remotes=(),
+                 push_delay=2, push_retries=3, index_path=None, deploy_path=None, deploy_mode='rename',
+                 build_worker=False, build_timeout=600, build_worker_max_builds=50, build_worker_max_rss=None,
+                 settings_cache_dir=None):
         if repo_path is True:
             repo_path = os.path.abspath(os.path.dirname(settings_file))
 
+        if repo_path and push_remotes:
+            self.pusher = self.pusher_class(repo_path, push_remotes, delay=push_delay, retries=push_retries)
+        else:
+            self.pusher = None
+
         self.repo_path = repo_path
         self.images_dir = images_dir
         self.files_dir = files_dir
-        self.settings = read_settings(settings_file)
-        self.pelican = Pelican(self.settings)
+        self._index_path = index_path
+        self._article_index = None
+        self._search_index = None
+        self._preview_generator = None
+        self._pelican = None
+
+        if settings_cache_dir is False:
+            self.settings = read_settings(settings_file)
+        else:
+            self.settings = self.settings_cache_class(cache_dir=settings_cache_dir).read_settings(settings_file)
+
+        if deploy_path:
+            self.deployer = self.deployer_class(self.output_path, os.path.abspath(deploy_path),
+                                                os.path.join(self.index_path, 'deploy.json'), mode=deploy_mode)
+        else:
+            self.deployer = None
+
+        if build_worker:
+            self.build_worker = self.build_worker_class(self, max_builds=build_worker_max_builds,
+                                                        max_rss=build_worker_max_rss, timeout=build_timeout)
+        else:
+            self.build_worker = None
+
         self.article_extensions = tuple([ext for cls in self.article_classes for ext in cls.file_extensions])
 
+        if self.build_worker:
+            self.build_worker.start()  # Pre-fork the worker with loaded settings
+
+    def close(self):
+        """Stop the build worker and close indexes; Queued git pushes are finished in background"""
+        if self.build_worker:
+            self.build_worker.stop()
+
+        if self._search_index is not None:
+            self._search_index.close()
+
+        self._preview_generator = None
+
     def article_class(self, content_path, filename, **kwargs):
         """Chooses PelicanArticle class according to file extension and returns article instance"""
         kwargs['supported_classes'] = self.article_classes
 
         return pelican_article(content_path, filename, **kwargs)
 
+    @property
+    def pelican(self):
+        """Pelican object (created on first use)"""
+        if self._pelican is None:
+            from pelican import Pelican
+            self._pelican = Pelican(resolve_settings(self.settings))
+
+        return self._pelican
+
     @property
     def content_path(self):
         """Pelican content directory"""
@@ -55,12 +247,33 @@ class PelicanAPI(object):
         """Pelican site URL"""
         return self.settings['SITEURL']
 
+    @property
+    def index_path(self):
+        """Directory with mailpy indexes"""
+        return self._index_path or os.path.join(self.settings['CACHE_PATH'], 'mailpy')
+
+    @property
+    def article_index(self):
+        """Article metadata index"""
+        if self._article_index is None:
+            self._article_index = self.article_index_class(self, os.path.join(self.index_path, 'articles.json'))
+
+        return self._article_index
+
+    @property
+    def search_index(self):
+        """Full-text search index"""
+        if self._search_index is None:
+            self._search_index = self.search_index_class(self, os.path.join(self.index_path, 'search.sqlite'))
+
+        return self._search_index
+
     def _include_path(self, path, extensions):
         """Inclusion logic for .get_files() - based on pelican.generators.Generator._include_path()"""
         basename = os.path.basename(path)
         ignores = self.settings['IGNORE_FILES']
 
-        if any(fnmatch.fnmatch(basename, ignore) for ignore in ignores):
+        if basename.startswith(TEMP_FILE_PREFIX) or any(fnmatch.fnmatch(basename, ignore) for ignore in ignores):
             return False
 
         if extensions is False or basename.endswith(extensions):
@@ -107,7 +320,8 @@ class PelicanAPI(object):
         return files
 
     def commit(self, msg, add=(), remove=()):
-        """Run git add <files> or git rm <files> and git commit -m <msg> inside content path"""
+        """Run git add <files> or git rm <files> and git commit -m <msg> inside content path;
+        The new commit is queued for replication if push_remotes are set"""
         if not self.repo_path:
             raise PelicanAPIError('git support is disabled (repo_path is not set)')
 
@@ -123,7 +337,7 @@ class PelicanAPI(object):
                 # noinspection PyArgumentList
                 git.rm(*remove)
 
-            return git.commit(msg)
+            res = git.commit(msg)
         except GitError as exc:
             try:
                 git.reset()
@@ -132,9 +346,126 @@ class PelicanAPI(object):
 
             raise exc  # Re-raise the original error
 
-    def publish(self):
-        """Update pelican output folder"""
-        self.pelican.run()
+        if self.pusher:
+            self.pusher.push(git.rev_parse())
+
+        return res
+
+    def get_output_file(self, article):
+        """Return full path of the HTML file generated from article"""
+        return os.path.abspath(os.path.join(self.output_path, self.read_article(article).save_as))
+
+    def deploy(self, written=None):
+        """Copy changed output files into deploy_path and return (added, changed, removed) tuple;
+        written are output files reported by the last build (see _build())"""
+        if not self.deployer:
+            raise PelicanAPIError('Deployment is disabled (deploy_path is not set)')
+
+        added, changed, removed = res = self.deployer.deploy(written=written)
+        logger.info('Deployed %d new, %d changed and %d removed files into %s', len(added), len(changed),
+                    len(removed), self.deployer.deploy_path)
+
+        return res
+
+    def publish(self, articles=None):
+        """Update pelican output folder and deploy changed files (if deploy_path is set);
+        Write only output files of articles if specified"""
+        if self.build_worker:
+            res = self.build_worker.build(articles=articles)
+            logger.info('Build finished in %.2f seconds in worker %d (RSS: %d kB, %+d kB during the build; '
+                        'lifetime peak RSS: %d kB)', res.duration, res.pid, res.rss // 1024, res.rss_delta // 1024,
+                        res.peak_rss // 1024)
+            written = res.written
+        else:
+            res = written = self._build(articles=articles)
+
+        if self.deployer:
+            self.deploy(written=written)
+
+        return res
+
+    def _build(self, articles=None):
+        """Run pelican; Write only output files of articles and pages listing them if specified (see SelectiveWriter).
+        Only rendering and writing of the other pages is skipped; Pelican still reads all content, so the cost of
+        the build grows with the size of the site (set CACHE_CONTENT and LOAD_CONTENT_CACHE to avoid parsing
+        of unchanged files).
+        Return dict of written and copied output files {relative path: [size, mtime, digest]} (see DigestWriter)"""
+        from pelican import utils as pelican_utils
+        pelican = self.pelican
+        digest_writer_class, selective_writer_class = get_writer_classes()
+        written = {}
+        delete_outputdir = pelican.delete_outputdir
+        copy_file = pelican_utils.copy_file
+        pelican_utils.copy_file = _get_digest_copy_file(written)  # Static files are copied by every build
+
+        if articles:
+            _active_writers[id(pelican)] = type(selective_writer_class.__name__, (selective_writer_class,), {
+                'written': written,
+                'selected_files': frozenset(self.get_output_file(article) for article in articles),
+                'selected_sources': frozenset(article.full_path for article in articles),
+            })
+            pelican.delete_outputdir = False
+        else:
+            _active_writers[id(pelican)] = type(digest_writer_class.__name__, (digest_writer_class,), {
+                'written': written,
+            })
+
+        try:
+            pelican.run()
+        finally:
+            del _active_writers[id(pelican)]
+            pelican.delete_outputdir = delete_outputdir
+            pelican_utils.copy_file = copy_file
+
+        output_path = os.path.abspath(self.output_path)
+
+        return {os.path.relpath(path, output_path): entry for path, entry in written.items()}
+
+    def _get_preview_generator(self):
+        """Return articles generator used only for reading and rendering of single articles"""
+        if self._preview_generator is None:
+            from pelican.generators import ArticlesGenerator
+            pelican = self.pelican
+            context = self.settings.copy()
+            context['generated_content'] = {}
+            context['static_links'] = set()
+            context['static_content'] = _StaticContentLookup(self.content_path, self.settings, context)
+            context['localsiteurl'] = self.settings['SITEURL']
+            self._preview_generator = ArticlesGenerator(context=context, settings=self.settings, path=pelican.path,
+                                                        theme=pelican.theme, output_path=pelican.output_path)
+
+        return self._preview_generator
+
+    def read_article(self, article, saved=False):
+        """Parse article content (the file does not have to exist) and return pelican Article object;
+        Use saved=True if the article file in content path has the same content (it is read directly)"""
+        from pelican.contents import Article
+        generator = self._get_preview_generator()
+
+        if saved:
+            return generator.readers.read_file(base_path=self.content_path, path=article.filename,
+                                               content_class=Article, context=generator.context)
+
+        temp_dir = tempfile.mkdtemp(prefix='mailpy-')
+
+        try:
+            file_path = os.path.join(temp_dir, os.path.basename(article.filename))
+            article.write_to(file_path)
+
+            return generator.readers.read_file(base_path=temp_dir, path=os.path.basename(article.filename),
+                                               content_class=Article, context=generator.context)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def render_article(self, article):
+        """Render article content into HTML with the article template without touching content or output path"""
+        generator = self._get_preview_generator()
+        pelican_article = self.read_article(article)
+        context = generator.context.copy()
+        context.update(article=pelican_article, category=getattr(pelican_article, 'category', None),
+                       output_file=pelican_article.save_as, url=pelican_article.url, blog=True)
+
+        return generator.get_template(pelican_article.template).render(context)
 
     def get_article(self, filename, **kwargs):
         """Return pelican article object according to filename extension"""
@@ -150,6 +481,11 @@ class PelicanAPI(object):
         return self._get_files(self.settings['ARTICLE_PATHS'], exclude=self.settings['ARTICLE_EXCLUDES'],
                                extensions=self.article_extensions, file_class=self.article_class)
 
+    def get_pages(self):
+        """Return list of available pages filtered by file extensions"""
+        return self._get_files(self.settings['PAGE_PATHS'], exclude=self.settings['PAGE_EXCLUDES'],
+                               extensions=self.article_extensions, file_class=self.article_class)
+
     def get_static_file(self, filename, **kwargs):
         """Return pelican content file object"""
         return self.static_file_class(self.content_path, filename, **kwargs)
@@ -158,6 +494,10 @@ class PelicanAPI(object):
         """Return list of static files inside directories specified as parameter"""
         return self._get_files(directories, extensions=False, file_class=self.static_file_class)
 
+    def get_static_namespace(self):
+        """Return new index of static file names used for batch allocation of new static files"""
+        return self.static_namespace_class(self)
+
     @property
     def articles(self):
         """Return list of available articles"""
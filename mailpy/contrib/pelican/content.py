@@ -3,13 +3,36 @@ from __future__ import absolute_import
 
 import re
 import os
+import errno
 import codecs
 
-from pelican.readers import parse_path_metadata
-
+from mailpy.contrib.filetransaction import FileTransaction
 from .exceptions import FileNotFound, FileAlreadyExists, UnknownFileFormat
 
-__all__ = ('PelicanContentFile', 'PelicanArticle', 'RstArticle', 'MarkdownArticle')
+__all__ = ('PelicanContentFile', 'PelicanArticle', 'RstArticle', 'MarkdownArticle', 'write_temp_file')
+
+TEMP_FILE_PREFIX = FileTransaction.temp_prefix
+
+
+def write_temp_file(directory, chunks, digest=None):
+    """Write chunks of bytes into a new temporary file inside directory and return (file path, file size) tuple;
+    Optional digest (hashlib object) is updated with all chunks"""
+    fd, temp_path = FileTransaction.mkstemp(directory)
+    size = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+                size += len(chunk)
+
+                if digest is not None:
+                    digest.update(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    return temp_path, size
 
 
 class PelicanContentFile(object):
@@ -17,15 +40,18 @@ class PelicanContentFile(object):
     Base container for any pelican content file.
     This is basically a filename with some advanced attributes.
     The content attribute should always be stored as byte str.
+    Instead of content, the file can be created from an already written temp_file (see write_temp_file()),
+    which is moved into place when the file is staged in a FileTransaction (see stage() and save()).
     """
     encoding = None
 
-    def __init__(self, content_path, filename, content=None, encoding=None):
+    def __init__(self, content_path, filename, content=None, encoding=None, temp_file=None):
         self.content_path = content_path
         self.filename = filename
         self.extension = os.path.splitext(filename)[1]
         self._content = content
         self.encoding = encoding or self.encoding
+        self.temp_file = temp_file
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, self.filename.encode('ascii', errors='backslashreplace'))
@@ -99,12 +125,47 @@ class PelicanContentFile(object):
         with codecs.open(file_path, mode='wb', encoding=self.encoding) as fp:
             fp.write(content)
 
-    def save(self):
-        """Write file content to disk"""
-        if self.exists():
+    def _encode(self, content):
+        """Return content as byte str"""
+        if self.encoding and not isinstance(content, bytes):
+            return content.encode(self.encoding)
+
+        return content
+
+    def stage(self, transaction, replace=False):
+        """Add file to a FileTransaction instead of writing it immediately"""
+        if not replace and self.exists():
             raise FileAlreadyExists(self)
 
-        self._save(self.full_path, self.content)
+        if self.temp_file:
+            transaction.add(self.full_path, temp_file=self.temp_file, replace=replace)
+            self.temp_file = None
+        else:
+            transaction.add(self.full_path, content=self._encode(self.content), replace=replace)
+
+    def write_to(self, file_path):
+        """Write file content to another location (e.g. a temporary directory)"""
+        self._save(file_path, self.content)
+
+    def save(self, fsync=True):
+        """Write file content to disk in its own FileTransaction"""
+        try:
+            with FileTransaction(fsync=fsync) as transaction:
+                self.stage(transaction)
+        except OSError as exc:
+            if exc.errno == errno.EEXIST:
+                raise FileAlreadyExists(self)
+            raise
+
+    def discard(self):
+        """Remove temporary file, which was not saved"""
+        if self.temp_file:
+            try:
+                os.remove(self.temp_file)
+            except OSError:
+                pass
+
+            self.temp_file = None
 
 
 class PelicanArticle(PelicanContentFile):
@@ -127,6 +188,8 @@ class PelicanArticle(PelicanContentFile):
 
     def get_path_metadata(self, settings):
         """Parse file metadata from file's path"""
+        from pelican.readers import parse_path_metadata  # pelican is imported only when needed
+
         return parse_path_metadata(self.filename, settings=settings)
 
     def _parse_metadata(self, metadata, line):
@@ -146,6 +209,10 @@ class PelicanArticle(PelicanContentFile):
 
         return new_text, metadata
 
+    def get_title(self, text, metadata):
+        """Return article title from text and metadata parsed by get_text_metadata()"""
+        return metadata.get('title')
+
     def _compose(self, title, text, metadata):
         """Return new content from supplied parameters"""
         raise NotImplementedError
@@ -159,7 +226,7 @@ class PelicanArticle(PelicanContentFile):
     def internal_link(self, text, uri):
         raise NotImplementedError
 
-    def image(self, alt, uri):
+    def image(self, alt, uri, target=None):
         raise NotImplementedError
 
 
@@ -170,6 +237,15 @@ class RstArticle(PelicanArticle):
     extension = '.rst'
     file_extensions = ('rst',)
     re_metadata = re.compile(r'^:(\w+):\s+(.+)$')
+    re_title_underline = re.compile(r'^([=\-`:\'"~^_*+#<>])\1+\s*$')
+
+    def get_title(self, text, metadata):
+        lines = text.lstrip().splitlines()
+
+        if len(lines) > 1 and self.re_title_underline.match(lines[1]):
+            return lines[0].strip()
+
+        return super(RstArticle, self).get_title(text, metadata)
 
     def _compose(self, title, text, metadata):
         return '%(title)s\n%(title_underscore)s\n\n%(metadata)s\n\n%(text)s\n' % {
@@ -182,8 +258,13 @@ class RstArticle(PelicanArticle):
     def internal_link(self, text, uri):
         return '`%s <%s>`_' % (text, uri)
 
-    def image(self, alt, uri):
-        return '.. image:: %s\n    :alt: %s' % (uri, alt)
+    def image(self, alt, uri, target=None):
+        res = '.. image:: %s\n    :alt: %s' % (uri, alt)
+
+        if target:
+            res += '\n    :target: %s' % target
+
+        return res
 
 
 class MarkdownArticle(PelicanArticle):
@@ -193,6 +274,18 @@ class MarkdownArticle(PelicanArticle):
     extension = '.md'
     file_extensions = ('md', 'markdown', 'mkd', 'mdown')
     re_metadata = re.compile(r'^  ([A-Z]\w*):\s+(.+)$')
+    re_title = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+    def get_title(self, text, metadata):
+        title = super(MarkdownArticle, self).get_title(text, metadata)
+
+        if not title:
+            found = self.re_title.search(text)
+
+            if found:
+                return found.group(1).strip()
+
+        return title
 
     def _compose(self, title, text, metadata):
         metadata['title'] = title
@@ -206,8 +299,13 @@ class MarkdownArticle(PelicanArticle):
     def internal_link(self, text, uri):
         return '[%s](%s)' % (text, uri)
 
-    def image(self, alt, uri):
-        return '![%s](%s)' % (alt, uri)
+    def image(self, alt, uri, target=None):
+        res = '![%s](%s)' % (alt, uri)
+
+        if target:
+            res = '[%s](%s)' % (res, target)
+
+        return res
 
 
 ARTICLE_CLASSES = (RstArticle, MarkdownArticle)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import errno
+import shutil
+
+from mailpy.contrib.filetransaction import FileTransaction
+from .index import file_digest
+
+__all__ = ('OutputDeployer', 'DeployError')
+
+
+class DeployError(Exception):
+    pass
+
+
+class OutputDeployer(object):
+    """
+    Incremental deployment of the pelican output directory into a deploy directory (web root).
+    A manifest with size, modification time and content digest of every deployed file is kept in manifest_file.
+    Digests of files written or copied by the build are computed while writing them (written; see
+    PelicanAPI._build()), other files are hashed only if their size or modification time has changed (e.g. files
+    modified by plugins after the build) and only files with a new digest are copied, so the deploy I/O depends
+    on the size of the change and not on the size of the site.
+
+    mode='rename': changed files are replaced atomically one by one (see FileTransaction) inside deploy_path.
+    mode='symlink': deploy_path is a symlink to a release directory. A new release is created from hard links
+    to unchanged files of the current release and copies of changed files and the symlink is swapped atomically.
+    """
+    version = 1
+    modes = ('rename', 'symlink')
+    releases_suffix = '.releases'
+
+    def __init__(self, output_path, deploy_path, manifest_file, mode='rename', keep_releases=2, fsync=True):
+        if mode not in self.modes:
+            raise ValueError('Invalid deploy mode: %s' % mode)
+
+        self.output_path = output_path
+        self.deploy_path = deploy_path
+        self.manifest_file = manifest_file
+        self.mode = mode
+        self.keep_releases = keep_releases
+        self.fsync = fsync
+
+    def __repr__(self):
+        return '%s(%s -> %s, mode=%s)' % (self.__class__.__name__, self.output_path, self.deploy_path, self.mode)
+
+    def _load_manifest(self):
+        """Read manifest file and return dict {relative path: [size, mtime, digest]}"""
+        try:
+            with open(self.manifest_file, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if data.get('version') != self.version or data.get('deploy_path') != self.deploy_path:
+            return {}
+
+        return data['files']
+
+    def _save_manifest(self, files):
+        """Atomically replace the manifest file"""
+        fd, temp_file = FileTransaction.mkstemp(os.path.dirname(self.manifest_file))
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'version': self.version, 'deploy_path': self.deploy_path, 'files': files}, fp,
+                          separators=(',', ':'))
+
+            os.rename(temp_file, self.manifest_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+    def _walk_output(self):
+        """Yield relative paths of all files in output directory"""
+        for dirpath, dirs, filenames in os.walk(self.output_path):
+            reldir = os.path.relpath(dirpath, self.output_path)
+
+            for f in filenames:
+                if reldir == '.':
+                    yield f
+                else:
+                    yield os.path.join(reldir, f)
+
+    def scan(self, manifest, written=None):
+        """Return new manifest of the output directory; Only files with changed size or mtime, which were not
+        reported in written ({relative path: [size, mtime, digest]}), are hashed"""
+        files = {}
+        written = written or {}
+
+        for path in self._walk_output():
+            stat = os.stat(os.path.join(self.output_path, path))
+            old = manifest.get(path)
+            new = written.get(path)
+
+            if old and old[0] == stat.st_size and old[1] == stat.st_mtime:
+                files[path] = old
+            elif new and new[0] == stat.st_size and new[1] == stat.st_mtime:  # Not modified after the build
+                files[path] = list(new)
+            else:
+                files[path] = [stat.st_size, stat.st_mtime, file_digest(os.path.join(self.output_path, path))]
+
+        return files
+
+    @staticmethod
+    def diff(old, new):
+        """Return (added, changed, removed) lists of relative paths"""
+        added = sorted(path for path in new if path not in old)
+        changed = sorted(path for path in new if path in old and new[path][2] != old[path][2])
+        removed = sorted(path for path in old if path not in new)
+
+        return added, changed, removed
+
+    def _copy_to_temp(self, path, directory):
+        """Copy output file into a new temporary file inside directory and return its path"""
+        fd, temp_file = FileTransaction.mkstemp(directory)
+
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                with open(os.path.join(self.output_path, path), 'rb') as src:
+                    shutil.copyfileobj(src, dst)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+        return temp_file
+
+    @staticmethod
+    def _remove_empty_dirs(root, paths):
+        """Remove directories left empty after removal of paths"""
+        for directory in sorted(set(os.path.dirname(path) for path in paths), reverse=True):
+            while directory:
+                try:
+                    os.rmdir(os.path.join(root, directory))
+                except OSError:
+                    break  # Not empty
+
+                directory = os.path.dirname(directory)
+
+    def _deploy_rename(self, added, changed, removed):
+        """Replace changed files inside deploy directory one by one"""
+        copy = added + changed
+
+        if copy:
+            transaction = FileTransaction(fsync=self.fsync)
+
+            try:
+                for path in copy:
+                    target = os.path.join(self.deploy_path, path)
+                    transaction.add(target, temp_file=self._copy_to_temp(path, os.path.dirname(target)),
+                                    replace=True)
+            except Exception:
+                transaction.rollback()
+                raise
+
+            transaction.commit()
+
+        for path in removed:
+            try:
+                os.remove(os.path.join(self.deploy_path, path))
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+
+        self._remove_empty_dirs(self.deploy_path, removed)
+
+    def _get_releases(self):
+        releases_dir = self.deploy_path + self.releases_suffix
+
+        try:
+            return releases_dir, sorted(os.listdir(releases_dir))
+        except OSError:
+            return releases_dir, []
+
+    def _deploy_symlink(self, manifest, copy):
+        """Create new release directory and atomically switch the deploy_path symlink to it"""
+        if os.path.exists(self.deploy_path) and not os.path.islink(self.deploy_path):
+            raise DeployError('%s exists and is not a symlink' % self.deploy_path)
+
+        if os.path.islink(self.deploy_path):
+            current = os.path.realpath(self.deploy_path)
+        else:
+            current = None
+
+        releases_dir, releases = self._get_releases()
+        release = os.path.join(releases_dir, '%.6f' % time.time())
+        os.makedirs(release)
+
+        try:
+            for path in manifest:
+                target = os.path.join(release, path)
+                directory = os.path.dirname(target)
+
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+
+                if current and path not in copy:
+                    try:
+                        os.link(os.path.join(current, path), target)  # Unchanged files cost no data I/O
+                        continue
+                    except OSError:
+                        pass  # Missing in current release; copy it
+
+                os.rename(self._copy_to_temp(path, directory), target)
+
+            temp_link = '%s.%d.tmp' % (self.deploy_path, os.getpid())
+            os.symlink(release, temp_link)
+            os.rename(temp_link, self.deploy_path)  # Atomic switch
+        except Exception:
+            shutil.rmtree(release, ignore_errors=True)
+            raise
+
+        for old_release in releases[:max(0, len(releases) + 1 - self.keep_releases)]:
+            old_release = os.path.join(releases_dir, old_release)
+
+            if old_release != current:
+                shutil.rmtree(old_release, ignore_errors=True)
+
+    def deploy(self, written=None):
+        """Apply changes in output directory to the deploy directory and return (added, changed, removed) tuple;
+        written are output files with digests reported by the last build"""
+        old = self._load_manifest()
+
+        if self.mode == 'symlink' and not os.path.islink(self.deploy_path) or not os.path.exists(self.deploy_path):
+            old = {}  # Nothing deployed yet
+
+        new = self.scan(old, written=written)
+        added, changed, removed = self.diff(old, new)
+
+        if self.mode == 'symlink':
+            if added or changed or removed or not old:
+                self._deploy_symlink(new, set(added + changed))
+        else:
+            self._deploy_rename(added, changed, removed)
+
+        if new != old:
+            self._save_manifest(new)
+
+        return added, changed, removed
@@ -4,7 +4,8 @@ from __future__ import absolute_import
 import os
 import errno as err
 
-__all__ = ('PelicanAPIError', 'FileNotFound', 'FileAlreadyExists', 'MultipleFilesFound', 'UnknownFileFormat')
+__all__ = ('PelicanAPIError', 'FileNotFound', 'FileAlreadyExists', 'MultipleFilesFound', 'UnknownFileFormat',
+           'BuildError', 'BuildTimeout', 'ImageTooLarge')
 
 
 class PelicanAPIError(Exception):
@@ -42,3 +43,24 @@ class UnknownFileFormat(PelicanAPIError):
     Invalid pelican content file.
     """
     pass
+
+
+class BuildError(PelicanAPIError):
+    """
+    Pelican build failed in a build worker process.
+    """
+    pass
+
+
+class BuildTimeout(BuildError):
+    """
+    Pelican build did not finish in time.
+    """
+    pass
+
+
+class ImageTooLarge(PelicanAPIError):
+    """
+    Image has more pixels than allowed by Pillow (decompression bomb).
+    """
+    pass
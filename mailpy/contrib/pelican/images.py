@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+from multiprocessing import Pool, cpu_count
+
+from mailpy.contrib.filetransaction import FileTransaction
+from .index import file_digest
+from .exceptions import ImageTooLarge
+
+__all__ = ('ImageProcessor', 'process_image')
+
+OPTIMIZED_FORMATS = frozenset(('JPEG', 'PNG', 'WEBP'))
+
+
+def _import_pil():
+    """Return (Image, ImageOps) modules; Pillow is imported only when image processing is used"""
+    from PIL import Image, ImageOps
+
+    return Image, ImageOps
+
+
+def _save_image(img, directory, img_format, quality):
+    """Save image into new temporary file and return its path"""
+    fd, temp_path = FileTransaction.mkstemp(directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            if img_format == 'JPEG':
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                img.save(fp, img_format, quality=quality, optimize=True, progressive=True)
+            elif img_format == 'PNG':
+                img.save(fp, img_format, optimize=True)
+            else:
+                img.save(fp, img_format, quality=quality)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    return temp_path
+
+
+def process_image(file_path, max_size=None, quality=85, thumbnail_size=None):
+    """Strip EXIF, downscale and recompress the image file in place and optionally create a thumbnail.
+    Return (size, digest, thumbnail file path or None, thumbnail size, thumbnail digest) tuple;
+    ImageTooLarge is raised for images exceeding the pixel limit of Pillow (Image.MAX_IMAGE_PIXELS)"""
+    Image, ImageOps = _import_pil()
+    thumbnail = None, None, None
+
+    try:
+        img = Image.open(file_path)
+    except Image.DecompressionBombError as exc:
+        raise ImageTooLarge(str(exc))
+    except (IOError, OSError):
+        img = None  # Unknown or broken image file is stored as is
+
+    if img is None or img.format not in OPTIMIZED_FORMATS or getattr(img, 'is_animated', False):
+        return (os.path.getsize(file_path), file_digest(file_path)) + thumbnail
+
+    img_format = img.format
+    directory = os.path.dirname(file_path)
+    img = ImageOps.exif_transpose(img)  # Keep orientation after EXIF data is removed
+
+    if thumbnail_size:
+        thumb = img.copy()
+        thumb.thumbnail(thumbnail_size, Image.LANCZOS)
+        thumb_path = _save_image(thumb, directory, img_format, quality)
+        thumbnail = thumb_path, os.path.getsize(thumb_path), file_digest(thumb_path)
+
+    if max_size:
+        img.thumbnail(max_size, Image.LANCZOS)  # Downscale only
+
+    new_path = _save_image(img, directory, img_format, quality)  # New file has no EXIF data
+    os.rename(new_path, file_path)
+
+    return (os.path.getsize(file_path), file_digest(file_path)) + thumbnail
+
+
+def _process_image(args):
+    """Pool.map() helper"""
+    return process_image(*args)
+
+
+class ImageProcessor(object):
+    """
+    Process image files on a pool of worker processes (see process_image()).
+    The pool is created on first use in every process and reused by all requests. Requires Pillow.
+    """
+    def __init__(self, max_size=None, quality=85, thumbnail_size=None, processes=None):
+        try:
+            _import_pil()
+        except ImportError:
+            raise ImportError('Image processing requires Pillow')
+
+        self.max_size = max_size
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.processes = processes
+        self._pool = None
+        self._pool_pid = None
+
+    def __repr__(self):
+        return '%s(max_size=%s, thumbnail_size=%s)' % (self.__class__.__name__, self.max_size, self.thumbnail_size)
+
+    def process(self, file_paths):
+        """Process all images in parallel and return list of process_image() results"""
+        args = [(file_path, self.max_size, self.quality, self.thumbnail_size) for file_path in file_paths]
+
+        if len(args) < 2 or self.processes == 1:
+            return [_process_image(i) for i in args]
+
+        return self._get_pool().map(_process_image, args)
+
+    def _get_pool(self):
+        """Return process pool of this process (a pool inherited by a forked process cannot be used)"""
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = Pool(processes=self.processes or cpu_count())
+            self._pool_pid = os.getpid()
+
+        return self._pool
+
+    def close(self):
+        """Stop the process pool"""
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.terminate()
+            self._pool.join()
+
+        self._pool = None
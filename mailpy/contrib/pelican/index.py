@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+
+from mailpy.contrib.filelock import FileLock
+from mailpy.contrib.filetransaction import FileTransaction
+
+__all__ = ('StaticFileNamespace', 'ArticleIndex', 'SearchIndex', 'SearchQueryError', 'SearchNotAvailable',
+           'file_digest', 'get_static_refs', 'parse_date')
+
+_re_date = re.compile(r'^\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:(?:[Tt]|\s+)(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?')
+
+
+class SearchQueryError(ValueError):
+    """
+    Invalid full-text search query.
+    """
+    pass
+
+
+class SearchNotAvailable(Exception):
+    """
+    The SQLite library does not support FTS5.
+    """
+    pass
+
+
+def _makedirs(path):
+    """Create directory if it does not exist"""
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass  # Created by another process
+
+
+def parse_date(value):
+    """Return comparable (year, month, day) or (year, month, day, hour, minute, second) tuple of a date string
+    or None if the date is not recognized; Dates need not be zero-padded (e.g. 2015-1-5 9:30)"""
+    match = _re_date.match(value or '')
+
+    if not match:
+        return None
+
+    parts = match.groups()
+
+    if parts[3] is None:
+        return tuple(int(i) for i in parts[:3])
+
+    return tuple(int(i or 0) for i in parts)
+
+
+def file_digest(file_path, hash_fun=hashlib.sha256, chunk_size=65536):
+    """Return hex digest of file content"""
+    h = hash_fun()
+
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+_re_static_ref = re.compile(r'[{|](?:filename|static|attach)[}|]([^\s"\'<>()\[\]`|{}?#]+)')
+
+
+def get_static_refs(text, filename=''):
+    """Return sorted list of content files (paths relative to content path) linked from text of content file"""
+    refs = set()
+
+    for ref in _re_static_ref.findall(text):
+        ref = ref.rstrip('.,;:')
+
+        if ref.startswith('/'):
+            ref = ref.lstrip('/')
+        else:
+            ref = os.path.join(os.path.dirname(filename), ref)  # Relative to the content file
+
+        refs.add(os.path.normpath(ref))
+
+    return sorted(refs)
+
+
+class StaticFileNamespace(object):
+    """
+    Index of static file names inside content directories.
+    Each directory is walked only once and names returned by reserve() are treated as taken, so one instance
+    can allocate names for many attachments (and articles) without walking the directory again.
+    Content digests of existing files are computed lazily and only for files with a matching size.
+    """
+    def __init__(self, papi):
+        self.papi = papi
+        self._filenames = {}  # directory -> set of filenames
+        self._sizes = {}  # filename -> file size
+        self._digests = {}  # filename -> content digest
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(self._filenames.keys()))
+
+    def __contains__(self, filename):
+        return any(filename in filenames for filenames in self._filenames.values())
+
+    def get_filenames(self, directory):
+        """Return set of filenames inside directory"""
+        try:
+            return self._filenames[directory]
+        except KeyError:
+            filenames = self._filenames[directory] = set(f.filename for f in self.papi.get_static_files(directory))
+            return filenames
+
+    def reserve(self, directory, names, is_free=None):
+        """Reserve unique filenames inside directory for all names in one batch and return list of filenames.
+        Optional is_free(filename) callback can reject a name (e.g. when it is locked by another process)"""
+        taken = self.get_filenames(directory)
+        reserved = []
+
+        for name in names:
+            filename = os.path.join(directory, name)
+            base, ext = os.path.splitext(filename)
+            i = 1
+
+            while filename in taken or (is_free is not None and not is_free(filename)):
+                i += 1
+                filename = '%s-%d%s' % (base, i, ext)
+
+            taken.add(filename)
+            reserved.append(filename)
+
+        return reserved
+
+    def release(self, filenames):
+        """Forget reserved filenames (e.g. when saving of static files was rolled back)"""
+        for filename in filenames:
+            for taken in self._filenames.values():
+                taken.discard(filename)
+
+            self._sizes.pop(filename, None)
+            self._digests.pop(filename, None)
+
+    def add_digest(self, filename, size, digest):
+        """Remember content digest of a reserved file"""
+        self._sizes[filename] = size
+        self._digests[filename] = digest
+
+    def _get_size(self, filename):
+        try:
+            return self._sizes[filename]
+        except KeyError:
+            size = self._sizes[filename] = os.path.getsize(os.path.join(self.papi.content_path, filename))
+            return size
+
+    def _get_digest(self, filename):
+        try:
+            return self._digests[filename]
+        except KeyError:
+            digest = self._digests[filename] = file_digest(os.path.join(self.papi.content_path, filename))
+            return digest
+
+    def find_duplicate(self, directory, size, digest):
+        """Return filename of a file with the same content inside directory or None"""
+        for filename in sorted(self.get_filenames(directory)):
+            try:
+                if self._get_size(filename) == size and self._get_digest(filename) == digest:
+                    return filename
+            except (IOError, OSError):
+                continue  # Removed in the meantime
+
+        return None
+
+
+class ArticleIndex(object):
+    """
+    Compact metadata index of all articles stored in a JSON file.
+    Entries are refreshed according to file modification time and size, so only new or changed articles are read.
+    Every entry also holds the list of static files linked from the article and a digest of the article content
+    (used as an entity tag). Pages are indexed only for their links and are excluded from query results.
+    Static files, which lost their last link during a refresh, are recorded as orphans, so they can be removed
+    without scanning the static directories (these are listed only when the index is created).
+    """
+    version = 4
+    fields = ('title', 'date', 'authors', 'tags', 'category', 'status')
+    list_fields = frozenset(('authors', 'tags'))  # Comma separated values
+
+    def __init__(self, papi, index_file):
+        self.papi = papi
+        self.index_file = index_file
+        self._entries = None
+        self._orphans = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.index_file)
+
+    def _load(self):
+        """Read index file and return (entries, orphans) tuple or None if the index does not exist or is outdated"""
+        try:
+            with open(self.index_file, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if data.get('version') != self.version:
+            return None
+
+        return data['entries'], set(data['orphans'])
+
+    def _save(self, entries, orphans):
+        """Atomically replace the index file"""
+        fd, temp_file = FileTransaction.mkstemp(os.path.dirname(self.index_file))
+        data = {'version': self.version, 'entries': entries, 'orphans': sorted(orphans)}
+
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(data, fp, separators=(',', ':'))
+
+            os.rename(temp_file, self.index_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+
+    def _create_entry(self, article, stat, page=False):
+        """Read article metadata and links to static files and return new index entry"""
+        try:
+            content = article.load()
+            digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        except ValueError:  # Broken file encoding
+            content = ''
+            digest = file_digest(article.full_path)
+
+        text, metadata = article.get_text_metadata(content)
+        metadata['title'] = article.get_title(text, metadata)
+
+        entry = {field: metadata.get(field) for field in self.fields}
+        path_metadata = article.get_path_metadata(self.papi.settings)
+        entry['slug'] = path_metadata.get('slug')
+        entry['mtime'] = stat.st_mtime
+        entry['size'] = stat.st_size
+        entry['page'] = page
+        entry['refs'] = get_static_refs(content, article.filename)
+        entry['digest'] = digest
+
+        if not entry['date'] and path_metadata.get('date'):
+            entry['date'] = str(path_metadata['date'])
+
+        return entry
+
+    def _is_static_file(self, filename):
+        """Return True if filename is inside of the images or files directory"""
+        return filename.startswith((self.papi.images_dir + os.sep, self.papi.files_dir + os.sep))
+
+    def _lock(self):
+        """Acquire and return exclusive lock of the index file"""
+        _makedirs(os.path.dirname(self.index_file))
+        flock = FileLock(self.index_file + '.lock')
+        flock.acquire()
+
+        return flock
+
+    def refresh(self):
+        """Update index according to articles and pages on disk and return (changed, removed) filenames tuple"""
+        flock = self._lock()
+
+        try:
+            data = self._load()
+
+            if data is None:
+                entries, orphans = {}, None
+            else:
+                entries, orphans = data
+
+            dropped = set()  # Links removed from changed or deleted articles
+            changed = []
+            found = set()
+            articles = self.papi.get_articles()
+            article_filenames = set(article.filename for article in articles)
+            pages = [page for page in self.papi.get_pages() if page.filename not in article_filenames]
+
+            for article, page in [(i, False) for i in articles] + [(i, True) for i in pages]:
+                filename = article.filename
+                found.add(filename)
+
+                try:
+                    stat = os.stat(article.full_path)
+                    entry = entries.get(filename)
+
+                    if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                        entries[filename] = self._create_entry(article, stat, page=page)
+                        changed.append(filename)
+
+                        if entry:
+                            dropped.update(entry.get('refs', ()))
+                except (IOError, OSError):
+                    found.discard(filename)  # Removed in the meantime
+
+            removed = [filename for filename in entries if filename not in found]
+
+            for filename in removed:
+                dropped.update(entries.pop(filename).get('refs', ()))
+
+            if orphans is None:  # New index -> find files orphaned before the index existed
+                orphans = set(i.filename for i in self.papi.get_static_files(self.papi.images_dir,
+                                                                             self.papi.files_dir))
+            else:
+                orphans.update(ref for ref in dropped if self._is_static_file(ref))
+
+            if changed or removed or data is None:
+                orphans.difference_update(ref for entry in entries.values() for ref in entry.get('refs', ()))
+                self._save(entries, orphans)
+        finally:
+            flock.release()
+
+        self._entries = entries
+        self._orphans = orphans
+
+        return changed, removed
+
+    def get_entry(self, article):
+        """Return index entry of one article; Only this article is checked and re-read if it has changed"""
+        stat = os.stat(article.full_path)
+        data = self._load()
+
+        if data is None:
+            self.refresh()  # Creates the index
+
+            return self._entries.get(article.filename)
+
+        entry = data[0].get(article.filename)
+
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry
+
+        flock = self._lock()
+
+        try:
+            entries, orphans = self._load() or data
+            old_entry = entries.get(article.filename)
+            entry = self._create_entry(article, stat, page=bool(old_entry and old_entry.get('page')))
+            entries[article.filename] = entry
+
+            if old_entry:
+                orphans.update(ref for ref in old_entry.get('refs', ()) if self._is_static_file(ref))
+                orphans.difference_update(ref for i in entries.values() for ref in i.get('refs', ()))
+
+            self._save(entries, orphans)
+        finally:
+            flock.release()
+
+        self._entries = entries
+        self._orphans = orphans
+
+        return entry
+
+    @property
+    def entries(self):
+        """Dict of index entries {filename: entry}"""
+        if self._entries is None:
+            self.refresh()
+
+        return self._entries
+
+    @classmethod
+    def _match(cls, entry, field, value):
+        """Filter helper (case insensitive)"""
+        if field in ('since', 'until'):
+            entry_date = parse_date(entry.get('date'))
+            date = parse_date(value)
+
+            if entry_date is None or date is None:
+                return False
+            elif field == 'since':
+                return entry_date >= date
+            else:
+                return entry_date[:len(date)] <= date  # Include whole day if only date is specified
+
+        entry_value = (entry.get(field) or '').lower()
+        value = value.lower()
+
+        if field in cls.list_fields:
+            return value in [i.strip() for i in entry_value.split(',')]
+        elif field == 'title':
+            return value in entry_value
+        else:
+            return entry_value == value
+
+    def get_orphans(self):
+        """Return sorted list of static files, which are not linked from any article or page since the last refresh
+        (the files may not exist anymore)"""
+        data = self._load()
+
+        if data is None:
+            self.refresh()  # Creates the index
+        else:
+            self._orphans = data[1]
+
+        return sorted(self._orphans)
+
+    def discard_orphans(self, filenames):
+        """Remove filenames from the list of orphaned static files"""
+        flock = self._lock()
+
+        try:
+            data = self._load()
+
+            if data is not None:
+                entries, orphans = data
+                orphans.difference_update(filenames)
+                self._save(entries, orphans)
+                self._orphans = orphans
+        finally:
+            flock.release()
+
+    def get_referenced(self, exclude=()):
+        """Return set of static files linked from any indexed article or page (except filenames in exclude)"""
+        return set(ref for filename, entry in self.entries.items() if filename not in exclude
+                   for ref in entry.get('refs', ()))
+
+    def query(self, filters=(), sort='-date', offset=0, limit=None):
+        """Return (total count, list of (filename, entry) tuples) matching filters.
+        filters are (field, value) tuples and sort is a field name optionally prefixed with '-' (descending)"""
+        items = [(filename, entry) for filename, entry in self.entries.items() if not entry.get('page') and
+                 all(self._match(entry, field, value) for field, value in filters)]
+        reverse = sort.startswith('-')
+        sort_field = sort.lstrip('-')
+
+        if sort_field == 'filename':
+            items.sort(key=lambda i: i[0], reverse=reverse)
+        elif sort_field == 'date':
+            items.sort(key=lambda i: (parse_date(i[1].get('date')) or (), i[0]), reverse=reverse)
+        else:
+            items.sort(key=lambda i: ((i[1].get(sort_field) or ''), i[0]), reverse=reverse)
+
+        if limit is None:
+            return len(items), items[offset:]
+        else:
+            return len(items), items[offset:offset + limit]
+
+
+class SearchIndex(object):
+    """
+    Full-text index of article text and metadata stored in an SQLite FTS5 database.
+    Supports FTS5 query syntax (phrase queries in double quotes, AND/OR/NOT, prefix*) and bm25 ranking.
+    Use update() and remove() for incremental changes and sync() for (re)building the index from disk.
+    """
+    columns = ('title', 'tags', 'authors', 'category', 'text')
+    weights = (10.0, 5.0, 2.0, 2.0, 1.0)  # bm25 column weights
+    tokenizer = 'unicode61 remove_diacritics 1'
+    snippet_tokens = 12
+
+    def __init__(self, papi, db_file, timeout=30):
+        self.papi = papi
+        self.db_file = db_file
+        self.timeout = timeout
+        self._db = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.db_file)
+
+    @property
+    def db(self):
+        """SQLite connection (the database is created on first use)"""
+        if self._db is None:
+            _makedirs(os.path.dirname(self.db_file))
+            db = sqlite3.connect(self.db_file, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode=WAL')  # Readers do not block the writer
+
+            try:
+                db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS articles USING fts5(filename UNINDEXED, %s, '
+                           'tokenize="%s")' % (', '.join(self.columns), self.tokenizer))
+            except sqlite3.OperationalError as exc:
+                db.close()
+
+                if 'fts5' in str(exc):
+                    raise SearchNotAvailable('SQLite %s was built without the FTS5 extension required by full-text '
+                                             'search' % sqlite3.sqlite_version)
+                raise
+
+            db.execute('CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, mtime REAL, size INTEGER)')
+            db.commit()
+            self._db = db
+
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remove(self, filename):
+        self.db.execute('DELETE FROM articles WHERE filename = ?', (filename,))
+        self.db.execute('DELETE FROM files WHERE filename = ?', (filename,))
+
+    def _update(self, article):
+        text, metadata = article.get_text_metadata(article.load())
+        metadata['title'] = article.get_title(text, metadata)
+        stat = os.stat(article.full_path)
+        values = [metadata.get(column) or '' for column in self.columns[:-1]] + [text]
+        self._remove(article.filename)
+        self.db.execute('INSERT INTO articles (filename, %s) VALUES (?, %s)' % (', '.join(self.columns),
+                                                                               ', '.join('?' * len(self.columns))),
+                        [article.filename] + values)
+        self.db.execute('INSERT INTO files (filename, mtime, size) VALUES (?, ?, ?)',
+                        (article.filename, stat.st_mtime, stat.st_size))
+
+    def update(self, *articles):
+        """Add or re-index articles"""
+        with self.db:
+            for article in articles:
+                self._update(article)
+
+    def remove(self, *filenames):
+        """Remove articles from the index"""
+        with self.db:
+            for filename in filenames:
+                self._remove(filename)
+
+    def is_empty(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 0
+
+    def sync(self):
+        """Index new and modified articles, remove deleted articles and return (changed, removed) filenames;
+        Only modification times and sizes of unchanged articles are checked"""
+        indexed = dict((f, (mtime, size)) for f, mtime, size in self.db.execute('SELECT * FROM files'))
+        changed = []
+
+        with self.db:
+            for article in self.papi.get_articles():
+                try:
+                    stat = os.stat(article.full_path)
+
+                    if indexed.pop(article.filename, None) != (stat.st_mtime, stat.st_size):
+                        self._update(article)
+                        changed.append(article.filename)
+                except (IOError, OSError, ValueError):
+                    continue  # Removed in the meantime or broken file encoding
+
+            removed = list(indexed.keys())
+
+            for filename in removed:
+                self._remove(filename)
+
+        return changed, removed
+
+    def search(self, query, offset=0, limit=20):
+        """Return (total count, list of (filename, title, snippet) tuples) ordered by relevance"""
+        try:
+            total = self.db.execute('SELECT COUNT(*) FROM articles WHERE articles MATCH ?', (query,)).fetchone()[0]
+            rows = self.db.execute('SELECT filename, title, snippet(articles, %d, \'[\', \']\', \'...\', %d) '
+                                   'FROM articles WHERE articles MATCH ? ORDER BY bm25(articles, 0, %s) '
+                                   'LIMIT ? OFFSET ?' % (len(self.columns), self.snippet_tokens,
+                                                        ', '.join(map(str, self.weights))),
+                                   (query, limit, offset)).fetchall()
+        except sqlite3.OperationalError as exc:
+            raise SearchQueryError(str(exc))
+
+        return total, rows
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import sysconfig
+import pickle
+import hashlib
+import logging
+
+from mailpy.utils import get_cache_dir
+from mailpy.contrib.filetransaction import FileTransaction
+from .index import file_digest
+
+__all__ = ('SettingsCache', 'read_settings', 'resolve_settings')
+
+logger = logging.getLogger(__name__)
+
+
+def read_settings(settings_file):
+    """Read pelican settings file (imports pelican)"""
+    from pelican.settings import read_settings as _read_settings
+
+    return _read_settings(settings_file)
+
+
+def _is_system_file(path):
+    """Return True if path is inside the Python installation (standard library or site-packages)"""
+    paths = sysconfig.get_paths()
+
+    return any(path.startswith(os.path.join(paths[i], '')) for i in ('stdlib', 'platstdlib', 'purelib', 'platlib')
+               if paths.get(i))
+
+
+def read_settings_with_imports(settings_file):
+    """Read pelican settings file and return (settings, list of source files of modules imported by the settings
+    file); Modules already imported by the current process and modules of the Python installation are not listed"""
+    from pelican.settings import read_settings as _read_settings
+    modules = set(sys.modules)
+    settings = _read_settings(settings_file)
+    files = set()
+
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+
+        if name in modules or not path:
+            continue
+
+        path = os.path.abspath(path)
+
+        if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+            path = path[:-1]  # Python 2
+
+        if path != settings_file and not _is_system_file(path):
+            files.add(path)
+
+    return settings, sorted(files)
+
+
+def _get_snapshot_settings(settings):
+    """Return copy of settings without objects of pelican classes (unpickling them would import pelican)"""
+    settings = settings.copy()
+
+    if 'PAGINATION_PATTERNS' in settings:
+        settings['PAGINATION_PATTERNS'] = [tuple(rule) for rule in settings['PAGINATION_PATTERNS']]
+
+    return settings
+
+
+def resolve_settings(settings):
+    """Restore pelican objects in settings loaded from a snapshot before they are used by pelican (imports pelican)"""
+    from pelican.paginator import PaginationRule
+
+    if 'PAGINATION_PATTERNS' in settings:
+        settings['PAGINATION_PATTERNS'] = [PaginationRule(*rule) for rule in settings['PAGINATION_PATTERNS']]
+
+    return settings
+
+
+class SettingsCache(object):
+    """
+    Snapshot of resolved pelican settings stored in a pickle file, so pelican does not have to be imported
+    and the settings file does not have to be executed in every process.
+    The snapshot is keyed on path, modification time, size and content digest of the settings file and of modules
+    imported by it (e.g. publishconf.py importing pelicanconf.py). Settings, which cannot be pickled, are never cached.
+    """
+    version = 2
+    required_settings = ('PATH', 'OUTPUT_PATH', 'CACHE_PATH', 'SITEURL', 'ARTICLE_PATHS', 'ARTICLE_EXCLUDES',
+                         'PAGE_PATHS', 'PAGE_EXCLUDES', 'IGNORE_FILES')
+    mtime_resolution = 2  # Files modified shortly before the snapshot was taken are always verified by digest
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+
+        self.cache_dir = cache_dir
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.cache_dir)
+
+    def _get_cache_file(self, settings_file):
+        name = hashlib.md5(settings_file.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.cache_dir, 'settings-%s.pickle' % name)
+
+    def _is_valid(self, snapshot, settings_file):
+        """Check snapshot structure"""
+        return (isinstance(snapshot, dict) and snapshot.get('version') == self.version and
+                snapshot.get('python') == sys.version_info[:2] and snapshot.get('settings_file') == settings_file and
+                isinstance(snapshot.get('files'), list) and isinstance(snapshot.get('settings'), dict) and
+                all(i in snapshot['settings'] for i in self.required_settings))
+
+    def _load(self, cache_file, settings_file):
+        """Return valid snapshot or None"""
+        try:
+            with open(cache_file, 'rb') as fp:
+                snapshot = pickle.load(fp)
+        except Exception:  # Missing, broken or incompatible file
+            return None
+
+        if self._is_valid(snapshot, settings_file):
+            return snapshot
+
+        return None
+
+    def _save(self, cache_file, snapshot):
+        """Atomically replace the snapshot file"""
+        try:
+            data = pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)
+        except Exception as exc:
+            logger.debug('Pelican settings cannot be cached: %s', exc)
+            return
+
+        try:
+            fd, temp_file = FileTransaction.mkstemp(self.cache_dir)
+        except OSError as exc:
+            logger.warning('Could not save pelican settings snapshot: %s', exc)
+            return
+
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError) as exc:
+            logger.warning('Could not save pelican settings snapshot: %s', exc)
+            os.remove(temp_file)
+
+    def _check_file(self, entry, created):
+        """Return current [path, mtime, size, digest] of a file recorded in a snapshot or None if it has changed"""
+        path, mtime, size, digest = entry
+
+        try:
+            stat = os.stat(path)
+
+            if stat.st_mtime == mtime and stat.st_size == size and created - mtime > self.mtime_resolution:
+                return entry
+
+            if file_digest(path) == digest:
+                return [path, stat.st_mtime, stat.st_size, digest]  # Touched, but not modified
+        except (IOError, OSError):
+            pass  # Removed
+
+        return None
+
+    def _get_files(self, paths, created):
+        """Return list of [path, mtime, size, digest] or None if any file was modified while the settings were read"""
+        files = []
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                digest = file_digest(path)
+            except (IOError, OSError):
+                return None
+
+            if stat.st_mtime >= created:
+                return None
+
+            files.append([path, stat.st_mtime, stat.st_size, digest])
+
+        return files
+
+    def read_settings(self, settings_file):
+        """Return settings from snapshot if the settings file and modules imported by it did not change or read it
+        and take a new snapshot"""
+        settings_file = os.path.abspath(settings_file)
+        cache_file = self._get_cache_file(settings_file)
+        snapshot = self._load(cache_file, settings_file)
+
+        if snapshot:
+            files = []
+
+            for entry in snapshot['files']:
+                entry = self._check_file(entry, snapshot['created'])
+
+                if entry is None:
+                    break
+
+                files.append(entry)
+            else:
+                if files != snapshot['files']:
+                    snapshot.update(files=files, created=time.time())
+                    self._save(cache_file, snapshot)
+
+                return snapshot['settings']
+
+        created = time.time()
+        settings, imported = read_settings_with_imports(settings_file)
+        files = self._get_files([settings_file] + imported, created)
+
+        if files is None:
+            logger.info('Pelican settings were modified while they were read; The snapshot was not saved')
+        else:
+            self._save(cache_file, {
+                'version': self.version,
+                'python': sys.version_info[:2],
+                'settings_file': settings_file,
+                'files': files,
+                'created': created,
+                'settings': _get_snapshot_settings(settings),
+            })
+
+        return settings
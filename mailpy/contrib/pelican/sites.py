@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+__all__ = ('SiteRegistry',)
+
+logger = logging.getLogger(__name__)
+
+
+class SiteRegistry(object):
+    """
+    LRU cache of PelicanAPI objects (settings and Pelican object) shared by mail views of many sites.
+    Objects are created on demand by a factory function and keyed by mail resource. At most max_size objects are
+    kept and objects not used for more than idle_timeout seconds are evicted. Hit/miss statistics are collected
+    for every site (see stats()).
+    The registry lives only as long as its process, so it has no effect in the default mode of bin/mail.py, which
+    runs one process per message; It pays off in long-running processes serving many sites (see MailSupervisor).
+    """
+    def __init__(self, max_size=8, idle_timeout=3600):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._sites = OrderedDict()  # resource -> (PelicanAPI, last access time); the last item is the newest
+        self._stats = {}  # resource -> {'hits', 'misses', 'evictions', 'load_time'}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '%s(%d/%d)' % (self.__class__.__name__, len(self._sites), self.max_size)
+
+    def __len__(self):
+        return len(self._sites)
+
+    def __contains__(self, resource):
+        return resource in self._sites
+
+    def _get_stats(self, resource):
+        try:
+            return self._stats[resource]
+        except KeyError:
+            stats = self._stats[resource] = {'hits': 0, 'misses': 0, 'evictions': 0, 'load_time': 0.0}
+            return stats
+
+    @staticmethod
+    def _close(papi):
+        try:
+            papi.close()
+        except Exception as exc:
+            logger.exception('Could not close %r: %s', papi, exc)
+
+    def _evict(self, resource):
+        papi, _ = self._sites.pop(resource)
+        self._get_stats(resource)['evictions'] += 1
+        logger.info('Evicted site %s from %r', resource, self)
+        self._close(papi)
+
+    def evict_idle(self):
+        """Remove objects not used for more than idle_timeout seconds and return their number"""
+        if not self.idle_timeout:
+            return 0
+
+        deadline = time.time() - self.idle_timeout
+        evicted = 0
+
+        with self._lock:
+            for resource, (_, last_access) in list(self._sites.items()):
+                if last_access >= deadline:
+                    break  # Items are ordered by access time
+
+                self._evict(resource)
+                evicted += 1
+
+        return evicted
+
+    def get(self, resource, factory):
+        """Return cached object for resource or create a new one by calling factory()"""
+        self.evict_idle()
+
+        with self._lock:
+            stats = self._get_stats(resource)
+
+            try:
+                papi, _ = self._sites.pop(resource)
+            except KeyError:
+                stats['misses'] += 1
+                start_time = time.time()
+                papi = factory()
+                stats['load_time'] += time.time() - start_time
+            else:
+                stats['hits'] += 1
+
+            self._sites[resource] = (papi, time.time())  # Move to the end
+
+            while len(self._sites) > self.max_size:
+                self._evict(next(iter(self._sites)))
+
+        return papi
+
+    def remove(self, resource):
+        """Drop cached object for resource (e.g. after its settings file has changed)"""
+        with self._lock:
+            if resource in self._sites:
+                self._evict(resource)
+
+    def clear(self):
+        with self._lock:
+            for resource in list(self._sites.keys()):
+                self._evict(resource)
+
+    def stats(self):
+        """Return dict {resource: {'hits', 'misses', 'evictions', 'load_time', 'cached'}}"""
+        with self._lock:
+            return {resource: dict(stats, cached=resource in self._sites) for resource, stats in self._stats.items()}
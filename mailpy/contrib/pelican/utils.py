@@ -20,3 +20,109 @@ def slugify(value):
     value = re.sub('[^\w\s-]', '', stringify(value)).strip().lower()
 
     return re.sub('[-\s]+', '-', value)
+
+
+_re_hunk = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def is_unified_diff(text):
+    """Return True if text looks like a unified diff"""
+    lines = text.splitlines()
+
+    return (any(line.startswith('--- ') for line in lines) and any(line.startswith('+++ ') for line in lines) and
+            any(_re_hunk.match(line) for line in lines))
+
+
+def _parse_hunks(diff):
+    """Return list of (expected position, old lines, new lines) tuples from unified diff"""
+    hunks = []
+    lines = iter(diff.splitlines())
+
+    for line in lines:
+        found = _re_hunk.match(line)
+
+        if not found:
+            continue  # File headers and garbage around hunks
+
+        old_start, old_count = int(found.group(1)), int(found.group(2) or 1)
+        new_count = int(found.group(4) or 1)
+        old_lines = []
+        new_lines = []
+
+        while old_count > 0 or new_count > 0:
+            try:
+                line = next(lines)
+            except StopIteration:
+                raise ValueError('Unexpected end of hunk @@ -%d' % old_start)
+
+            if line.startswith('\\'):
+                continue  # \ No newline at end of file
+
+            op, line = line[:1], line[1:]
+
+            if op in (' ', ''):  # Mail clients like to strip trailing whitespace
+                old_lines.append(line)
+                new_lines.append(line)
+                old_count -= 1
+                new_count -= 1
+            elif op == '-':
+                old_lines.append(line)
+                old_count -= 1
+            elif op == '+':
+                new_lines.append(line)
+                new_count -= 1
+            else:
+                raise ValueError('Invalid line in hunk @@ -%d: %s' % (old_start, op + line))
+
+        if old_lines:
+            position = old_start - 1
+        else:
+            position = old_start  # Insert after line old_start
+
+        hunks.append((position, old_lines, new_lines))
+
+    return hunks
+
+
+def _find_lines(lines, search, position, minimum):
+    """Return index of search lines in lines nearest to position (ignoring trailing whitespace) or None"""
+    search = [i.rstrip() for i in search]
+    size = len(search)
+    maximum = len(lines) - size
+
+    for delta in range(len(lines) + 1):
+        for i in (position - delta, position + delta):
+            if minimum <= i <= maximum and [j.rstrip() for j in lines[i:i + size]] == search:
+                return i
+
+    return None
+
+
+def apply_patch(text, diff):
+    """Apply unified diff to text and return new text; Raise ValueError if the diff does not apply"""
+    hunks = _parse_hunks(diff)
+
+    if not hunks:
+        raise ValueError('No hunks found')
+
+    lines = text.splitlines()
+    new_lines = []
+    pos = 0
+
+    for position, old, new in hunks:
+        start = _find_lines(lines, old, position, pos)
+
+        if start is None:
+            raise ValueError('Hunk @@ -%d does not apply' % (position + 1))
+
+        new_lines.extend(lines[pos:start])
+        new_lines.extend(new)
+        pos = start + len(old)
+
+    new_lines.extend(lines[pos:])
+    new_text = '\n'.join(new_lines)
+
+    if text.endswith('\n'):
+        new_text += '\n'
+
+    return new_text
@@ -1,38 +1,92 @@
 # -*- coding: utf-8 -*-
 from functools import wraps
 from datetime import datetime
+from hashlib import md5, sha256
+from email.utils import formatdate, make_msgid, parseaddr
 import os
 import re
+import errno
+import shlex
+import logging
+import tarfile
+import zipfile
+import tempfile
+
+try:
+    from email import message_from_bytes
+except ImportError:
+    from email import message_from_string as message_from_bytes  # Python 2
 
 from mailpy.view import MailView
-from mailpy.response import TextMailResponse
+from mailpy.utils import iter_payload, decode_header
+from mailpy.response import (TextMailResponse, HtmlMailResponse, NotModifiedMailResponse, TemplateHtmlMailResponse,
+                             create_text_part)
 from mailpy.exceptions import MailViewError
 from mailpy.contrib.filelock import FileLock, FileLockTimeout
+from mailpy.contrib.filetransaction import FileTransaction
 from mailpy.contrib.pelican.api import PelicanAPI
-from mailpy.contrib.pelican.utils import stringify, slugify
-from mailpy.contrib.pelican.content import RstArticle
-from mailpy.contrib.pelican.exceptions import FileNotFound, FileAlreadyExists, MultipleFilesFound, UnknownFileFormat
+from mailpy.contrib.pelican.utils import stringify, slugify, is_unified_diff, apply_patch
+from mailpy.contrib.pelican.content import RstArticle, write_temp_file
+from mailpy.contrib.pelican.images import ImageProcessor
+from mailpy.contrib.pelican.index import SearchQueryError, SearchNotAvailable, get_static_refs, parse_date
+from mailpy.contrib.pelican.exceptions import (FileNotFound, FileAlreadyExists, MultipleFilesFound, UnknownFileFormat,
+                                               ImageTooLarge)
 
 __all__ = ('PelicanMailView',)
 
+logger = logging.getLogger(__name__)
 
-def lock(fun):
-    """Lock decorator"""
-    @wraps(fun)
-    def wrap(obj, request, *args, **kwargs):
-        flock = FileLock(obj.lock_file)
 
-        try:
-            flock.acquire()
-        except FileLockTimeout as exc:
-            raise MailViewError(request, 'Locked: %s' % exc, status_code=423)
+class Attachment(object):
+    """
+    File attached to a mail message, decoded into a temporary file inside its static directory.
+    """
+    __slots__ = ('orig_filename', 'directory', 'is_image', 'charset', 'temp_file', 'size', 'digest', 'thumbnail')
+
+    def __init__(self, orig_filename, directory, is_image, charset=None, temp_file=None, size=None, digest=None):
+        self.orig_filename = orig_filename
+        self.directory = directory
+        self.is_image = is_image
+        self.charset = charset
+        self.temp_file = temp_file
+        self.size = size
+        self.digest = digest
+        self.thumbnail = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.orig_filename)
+
+    def discard(self):
+        """Remove temporary files"""
+        for attachment in (self, self.thumbnail):
+            if attachment is not None and attachment.temp_file:
+                try:
+                    os.remove(attachment.temp_file)
+                except OSError:
+                    pass
 
-        try:
-            return fun(obj, request, *args, **kwargs)
-        finally:
-            flock.release()
+                attachment.temp_file = None
 
-    return wrap
+
+def lock(fun=None, shared=False):
+    """Site-wide lock decorator; Use @lock for an exclusive lock or @lock(shared=True) for a shared lock"""
+    def lock_decorator(fun):
+        @wraps(fun)
+        def wrap(obj, request, *args, **kwargs):
+            # noinspection PyProtectedMember
+            flock = obj._lock(request, obj.lock_file, shared=shared)
+
+            try:
+                return fun(obj, request, *args, **kwargs)
+            finally:
+                flock.release()
+
+        return wrap
+
+    if fun is None:
+        return lock_decorator
+    else:
+        return lock_decorator(fun)
 
 
 class PelicanMailView(MailView):
@@ -44,10 +98,36 @@ class PelicanMailView(MailView):
     article_file_name = '%Y-%m-%d-{slug}'  # Without extension; valid placeholders: {slug} and strftime() directives
     papi_class = PelicanAPI
     papi_settings = ()
+    site_registry = None  # SiteRegistry shared by views of many sites in one process (see MailSupervisor)
     site_url = None
+    response_template = None  # Jinja2 template for HTML responses (context: text, site_url); plain text by default
+    template_dirs = ()
     authors = ()
-    lock_file = None
+    lock_file = None  # Site-wide lock held by git commits and html output builds (default: settings_file + '.lock')
+    lock_dir = None  # Directory with per-article and per-static-file locks (default: lock_file + '.d')
+    lock_timeout = 30
+    _file_transaction_class = FileTransaction
+    fsync = True  # Flush new files to disk before they are committed
+    dedup_static_files = False  # Link to an existing static file with identical content instead of saving a copy
+    image_max_size = None  # (width, height) - downscale and recompress attached images (requires Pillow)
+    image_thumbnail_size = None  # (width, height) - insert a thumbnail linked to the full image (requires Pillow)
+    image_quality = 85
+    image_processes = None  # Size of the image processing pool (default: number of CPUs)
+    _image_processor_class = ImageProcessor
+    list_page_size = 50
+    list_max_page_size = 1000
+    search_enabled = True  # Keep the full-text search index up to date after post() and delete()
+    search_results_limit = 20
+    gc_max_files = 100  # Maximum number of orphaned static files removed by one gc() call
+    notifier = None  # mailpy.contrib.notify.Notifier mailing new articles to subscribers after post() and bulk_post()
+    subscribers_file = None  # Text file with one subscriber address per line (required by notifier)
+    notify_sender = None  # From address of notifications (default: recipient of the request)
+    bulk_max_articles = 500
+    bulk_max_message_size = 64 * 1024 * 1024  # Maximum size of one message extracted from an archive
+    bulk_archive_extensions = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
     detect_image_attachments = frozenset(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff'))
+    _list_filters = frozenset(('title', 'tags', 'authors', 'category', 'status', 'since', 'until'))
+    _list_sort_fields = frozenset(('date', 'title', 'filename', 'category', 'status', 'authors'))
     _valid_content_maintypes = frozenset(('text', 'image', 'audio', 'video', 'application'))
     _valid_text_content_type = frozenset(('text/plain',))
     _ignored_file_content_types = frozenset(('text/x-vcard', 'text/vcard',
@@ -61,9 +141,53 @@ class PelicanMailView(MailView):
 
     def __init__(self):
         super(PelicanMailView, self).__init__()
-        # Initialize the Pelican API
-        self.papi = self.papi_class(self.settings_file, **dict(self.papi_settings))
+
+        if self.site_registry is None:
+            self.papi = self._create_papi()  # Initialize the Pelican API
+        else:
+            self.papi = None  # Fetched from the site registry for every request
+
         self.lock_file = self.lock_file or self.settings_file + '.lock'
+        self.lock_dir = self.lock_dir or self.lock_file + '.d'
+
+        if self.image_max_size or self.image_thumbnail_size:
+            self.image_processor = self._image_processor_class(max_size=self.image_max_size,
+                                                              quality=self.image_quality,
+                                                              thumbnail_size=self.image_thumbnail_size,
+                                                              processes=self.image_processes)
+        else:
+            self.image_processor = None
+
+    def _create_papi(self):
+        """Initialize the Pelican API"""
+        return self.papi_class(self.settings_file, **dict(self.papi_settings))
+
+    def _preload(self):
+        """Import pelican and create the Pelican object, so forked workers share it"""
+        if self.site_registry is None:
+            papi = self.papi
+        else:
+            papi = self.site_registry.get(self.resource, self._create_papi)
+
+        # noinspection PyStatementEffect
+        papi.pelican
+        # noinspection PyStatementEffect
+        papi.article_index
+
+        if papi.build_worker:
+            papi.build_worker.stop()  # Every forked worker starts its own build worker on first publish
+
+    def _process_view(self, request, view_fun):
+        """Use cached Pelican API object from the site registry during the request"""
+        if self.site_registry is None:
+            return super(PelicanMailView, self)._process_view(request, view_fun)
+
+        self.papi = self.site_registry.get(self.resource, self._create_papi)
+
+        try:
+            return super(PelicanMailView, self)._process_view(request, view_fun)
+        finally:
+            self.papi = None  # Evicted objects must not be kept alive by the view
 
     @property
     def _site_url(self):
@@ -78,13 +202,94 @@ class PelicanMailView(MailView):
 
         return default
 
-    def _create_article_slug(self, title, articles):
+    def _lock(self, request, lock_file, shared=False, timeout=None):
+        """Acquire and return file lock or raise 423 error"""
+        flock = FileLock(lock_file, shared=shared)
+
+        if timeout is None:
+            timeout = self.lock_timeout
+
+        try:
+            flock.acquire(timeout=timeout)
+        except FileLockTimeout as exc:
+            raise MailViewError(request, 'Locked: %s' % exc, status_code=423)
+
+        return flock
+
+    def _get_name_lock_file(self, kind, name):
+        """Return path to lock file used for locking one article or static file name"""
+        if not os.path.isdir(self.lock_dir):
+            try:
+                os.makedirs(self.lock_dir)
+            except OSError:
+                pass  # Created by another process
+
+        return os.path.join(self.lock_dir, '%s-%s.lock' % (kind, md5(name.encode('utf-8')).hexdigest()))
+
+    def _lock_name(self, request, locks, kind, name, shared=False):
+        """Wait for an exclusive (or shared) lock of one article or static file name"""
+        locks.append(self._lock(request, self._get_name_lock_file(kind, name), shared=shared))
+
+    def _reserve_name(self, locks, kind, name):
+        """Try to lock one article or static file name; Return False if it is locked by another process"""
+        lock_file = self._get_name_lock_file(kind, name)
+
+        if any(i.lockfile == lock_file for i in locks):
+            return True  # Already reserved by us
+
+        flock = FileLock(lock_file)
+
+        try:
+            flock.acquire(timeout=0)
+        except FileLockTimeout:
+            return False
+
+        locks.append(flock)
+
+        return True
+
+    @staticmethod
+    def _release_locks(locks):
+        """Release all locks acquired by _lock_name() or _reserve_name()"""
+        while locks:
+            locks.pop().release()
+
+    def _cleanup_lock_files(self):
+        """Remove per-name lock files, which are not locked by any process, and return their count"""
+        try:
+            lock_files = os.listdir(self.lock_dir)
+        except OSError:
+            return 0
+
+        removed = 0
+
+        for lock_file in lock_files:
+            if not lock_file.endswith('.lock'):
+                continue
+
+            flock = FileLock(os.path.join(self.lock_dir, lock_file))
+
+            try:
+                flock.acquire(timeout=0)
+            except (FileLockTimeout, OSError):
+                continue  # In use
+
+            try:
+                flock.unlink()
+            except OSError:
+                flock.release()
+            else:
+                removed += 1
+
+        return removed
+
+    def _create_article_slug(self, title, articles, locks):
         """Create unique article slug from title"""
         slug = orig_slug = slugify(title)
         slugs = self.papi.get_article_slugs(articles=articles)  # dict {slug: article}
         i = 1
 
-        while slug in slugs:
+        while slug in slugs or not self._reserve_name(locks, 'slug', slug):
             i += 1
             slug = '%s-%d' % (orig_slug, i)
 
@@ -97,48 +302,58 @@ class PelicanMailView(MailView):
 
         return '%s%s%s' % (filename, addon, self.article_class.extension)
 
-    def _create_article_filename(self, slug, articles):
+    def _create_article_filename(self, slug, articles, locks):
         """Create new unique filename from title"""
         filename = self.__create_article_filename(slug)
         filenames = set(a.filename for a in articles)
         i = 1
 
-        while filename in filenames:
+        while filename in filenames or not self._reserve_name(locks, 'article', filename):
             i += 1
             filename = self.__create_article_filename(slug, addon='-%d' % i)
 
         return filename
 
-    def _create_article(self, title):
-        """Create new PelicanArticle object"""
-        articles = self.papi.articles
-        slug = self._create_article_slug(title, articles)
-        filename = self._create_article_filename(slug, articles)
+    def _create_article(self, title, locks, articles=None):
+        """Create new PelicanArticle object; Pass a list of articles to allocate many articles against one snapshot"""
+        if articles is None:
+            articles = self.papi.articles
+
+        slug = self._create_article_slug(title, articles, locks)
+        filename = self._create_article_filename(slug, articles, locks)
 
         return self.article_class(self.papi.content_path, filename)
 
-    def _create_static_filename(self, maintype, orig_filename):
-        """Create proper filename for static file according to original filename"""
+    def _get_static_dir(self, maintype):
+        """Return content directory for static file according to its mime type"""
         if maintype == 'image':
-            directory = self.papi.images_dir
+            return self.papi.images_dir
         else:
-            directory = self.papi.files_dir
+            return self.papi.files_dir
 
-        orig_filename = stringify(orig_filename).strip()
+    @staticmethod
+    def _get_static_name(orig_filename):
+        """Return proper name for static file according to original filename"""
+        return stringify(orig_filename).strip() or 'noname'
 
-        if not orig_filename:
-            orig_filename = 'noname'
+    def _create_static_filenames(self, namespace, attachments, locks):
+        """Create unique filenames for a list of (directory, orig_filename) tuples in one batch per directory"""
+        filenames = [None] * len(attachments)
+        names_by_dir = {}
 
-        filename = os.path.join(directory, orig_filename)
-        static_files = set(self.papi.get_static_files(directory))
-        name, ext = os.path.splitext(filename)
-        i = 1
+        for i, (directory, orig_filename) in enumerate(attachments):
+            names_by_dir.setdefault(directory, []).append((i, self._get_static_name(orig_filename)))
 
-        while filename in static_files:
-            i += 1
-            filename = '%s-%d%s' % (name, i, ext)
+        def is_free(filename):
+            return self._reserve_name(locks, 'static', filename)
 
-        return filename
+        for directory, names in names_by_dir.items():
+            reserved = namespace.reserve(directory, [name for i, name in names], is_free=is_free)
+
+            for (i, name), filename in zip(names, reserved):
+                filenames[i] = filename
+
+        return filenames
 
     @staticmethod
     def _get_msg_text(msg_part, fallback_charset=None):
@@ -154,11 +369,46 @@ class PelicanMailView(MailView):
         # Fix automatic links injected by mail clients, e.g. "<www.google.com> <http://www.google.com>"
         return re.sub(r'([^\s]+) <([\w\+]+:/*)?\1/?>(?!`_)', r'\1', text)
 
-    def _get_msg_content(self, msg, article):
-        """Parse message and retrieve text content and additional file attachments"""
-        text = []
-        files = []
+    def _get_attachment(self, msg_part, maintype, orig_filename):
+        """Decode attachment into a temporary file inside its static directory and return Attachment object"""
+        ext = os.path.splitext(orig_filename)[1].lower()
+        is_image = maintype == 'image' or ext in self.detect_image_attachments
+        directory = self._get_static_dir(maintype)
+
+        if self.dedup_static_files:
+            digest = sha256()
+        else:
+            digest = None
+
+        temp_file, size = write_temp_file(os.path.join(self.papi.content_path, directory), iter_payload(msg_part),
+                                          digest=digest)
+
+        return Attachment(orig_filename, directory, is_image, charset=msg_part.get_content_charset(),
+                          temp_file=temp_file, size=size, digest=digest and digest.hexdigest())
+
+    def _process_attachments(self, attachments):
+        """Optimize images and create thumbnails on a process pool (if enabled)"""
+        if not self.image_processor:
+            return
+
+        images = [a for a in attachments if a.is_image]
+        results = self.image_processor.process([a.temp_file for a in images])
+
+        for attachment, (size, digest, thumb_file, thumb_size, thumb_digest) in zip(images, results):
+            attachment.size = size
+
+            if attachment.digest:
+                attachment.digest = digest  # Content has changed
+
+            if thumb_file:
+                name, ext = os.path.splitext(attachment.orig_filename)
+                attachment.thumbnail = Attachment('%s-thumbnail%s' % (name, ext), attachment.directory, True,
+                                                  temp_file=thumb_file, size=thumb_size,
+                                                  digest=attachment.digest and thumb_digest)
 
+    def _walk_msg(self, msg):
+        """Yield (part, maintype, orig_filename) for every article text part (orig_filename is None)
+        and every valid attachment in message"""
         for part in msg.walk():
             content_type = part.get_content_type()
             maintype = part.get_content_maintype()
@@ -170,71 +420,219 @@ class PelicanMailView(MailView):
                     if content_type in self._ignored_file_content_types:
                         continue  # Ignore vcard, digital signatures and stuff like this
 
-                    filename = self._create_static_filename(maintype, orig_filename)
-                    ext = os.path.splitext(orig_filename)[1].lower()
+                    yield part, maintype, orig_filename
 
-                    if maintype == 'image' or ext in self.detect_image_attachments:
-                        text_data = article.image(orig_filename, '{filename}/%s' % filename)
-                    else:
-                        text_data = article.internal_link(orig_filename, '{filename}/%s' % filename)
+                elif content_type in self._valid_text_content_type:  # Article text
+                    yield part, maintype, None
 
-                    text.append(text_data)
-                    files.append(self.papi.get_static_file(filename, content=part.get_payload(decode=True),
-                                                           encoding=part.get_content_charset()))  # Store raw
+    def _get_msg_content(self, msg, article, locks, namespace=None):
+        """Parse message and retrieve text content and additional file attachments"""
+        text = []
+        attachments = []  # (text index, Attachment)
 
-                elif content_type in self._valid_text_content_type:  # Article text
+        try:
+            for part, maintype, orig_filename in self._walk_msg(msg):
+                if orig_filename:
+                    attachments.append((len(text), self._get_attachment(part, maintype, orig_filename)))
+                    text.append(None)  # Link to the static file is added below
+                else:
                     msg_text = self._get_msg_text(part, msg.get_charset())  # Decode using content charset
                     text.append(self._edit_msg_text(msg_text))
 
+            self._process_attachments([a for i, a in attachments])
+            files = self._get_static_files(article, attachments, text, locks, namespace=namespace)
+        except Exception as exc:
+            for i, attachment in attachments:
+                attachment.discard()
+
+            raise exc  # Re-raise original exception
+
         return '\n\n'.join(text), files
 
-    def _get_article_metadata(self, request, article, text):
-        """Create article metadata"""
+    def _get_static_files(self, article, attachments, text, locks, namespace=None):
+        """Allocate filenames for attachments collected by _get_msg_content(), put links to static files into text
+        and return list of new static file objects"""
+        if namespace is None:
+            namespace = self.papi.get_static_namespace()
+
+        files = []
+        new_attachments = []
+        filenames = {}  # Attachment -> static filename
+        duplicates = {}  # Attachment -> identical Attachment from this message
+        digests = {}  # (directory, size, digest) -> Attachment from this message
+
+        for i, attachment in attachments:
+            for a in (attachment, attachment.thumbnail):
+                if a is None:
+                    continue
+
+                if a.digest:
+                    key = (a.directory, a.size, a.digest)
+
+                    if key in digests:
+                        a.discard()
+                        duplicates[a] = digests[key]
+                        continue
+
+                    duplicate = namespace.find_duplicate(a.directory, a.size, a.digest)
+
+                    # The existing file must not be removed by delete() or gc() until this article is saved
+                    if duplicate and self._reserve_name(locks, 'static', duplicate):
+                        a.discard()
+                        filenames[a] = duplicate
+                        continue
+
+                    digests[key] = a
+
+                new_attachments.append(a)
+
+        new_filenames = self._create_static_filenames(namespace, [(a.directory, a.orig_filename)
+                                                                  for a in new_attachments], locks)
+
+        try:
+            for a, filename in zip(new_attachments, new_filenames):
+                if a.digest:
+                    namespace.add_digest(filename, a.size, a.digest)  # Also deduplicate attachments in one message
+
+                filenames[a] = filename
+                files.append(self.papi.get_static_file(filename, temp_file=a.temp_file, encoding=a.charset))
+                a.temp_file = None  # Owned by the static file object now
+
+            for a, original in duplicates.items():
+                filenames[a] = filenames[original]
+
+            for i, a in attachments:
+                uri = '{filename}/%s' % filenames[a]
+
+                if a.thumbnail:
+                    text[i] = article.image(a.orig_filename, '{filename}/%s' % filenames[a.thumbnail], target=uri)
+                elif a.is_image:
+                    text[i] = article.image(a.orig_filename, uri)
+                else:
+                    text[i] = article.internal_link(a.orig_filename, uri)
+        except Exception:
+            for static_file in files:
+                static_file.discard()  # Temporary files of the remaining attachments are removed by the caller
+
+            raise
+
+        return files
+
+    def _get_msg_preview_content(self, msg, article):
+        """Like _get_msg_content(), but attachments are only mentioned by their original filenames"""
+        text = []
+
+        for part, maintype, orig_filename in self._walk_msg(msg):
+            if orig_filename:
+                text.append(article.internal_link('%s (attachment)' % orig_filename, '#'))
+            else:
+                text.append(self._edit_msg_text(self._get_msg_text(part, msg.get_charset())))
+
+        return '\n\n'.join(text)
+
+    def _get_article_metadata(self, request, article, text, sender=None):
+        """Create article metadata; The author is the request sender unless another sender is specified"""
+        sender = sender or request.sender
         metadata = {
             'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-            'authors': self._get_author_from_email(request.sender, request.sender),
+            'authors': self._get_author_from_email(sender, sender),
         }
         new_text, parsed_metadata = article.get_text_metadata(text)
         metadata.update(parsed_metadata)
 
         return new_text, metadata
 
-    @staticmethod
-    def _save_article(request, article, static_files):
-        """Save article file and all static files; Delete already created files in case of an error"""
-        created = []
+    def _prepare_article(self, request, msg, title, locks, articles=None, namespace=None, sender=None):
+        """Create new article from message and return (article, static files) tuple; Nothing is saved yet"""
+        article = self._create_article(title, locks, articles=articles)
+
+        try:
+            text, static_files = self._get_msg_content(msg, article, locks, namespace=namespace)
+        except ImageTooLarge as exc:
+            raise MailViewError(request, 'Attached image is too large: %s' % exc, status_code=413)
 
         try:
+            text, metadata = self._get_article_metadata(request, article, text, sender=sender)
+            article.compose(title, text, metadata)
+        except Exception:
             for static_file in static_files:
-                static_file.save()
-                created.append(static_file.full_path)
+                static_file.discard()
+
+            if namespace is not None:
+                namespace.release([i.filename for i in static_files])
+
+            raise
+
+        return article, static_files
+
+    def _save_articles(self, request, items, replace=False):
+        """Save list of (article, static files) tuples in one file transaction (all or nothing);
+        Use replace=True to overwrite existing articles"""
+        transaction = self._file_transaction_class(fsync=self.fsync)
+        article_paths = {article.full_path: article for article, static_files in items}
+
+        try:
+            for article, static_files in items:
+                for static_file in static_files:
+                    static_file.stage(transaction)
 
             try:
-                article.save()
-            except FileAlreadyExists:
-                raise MailViewError(request, 'Article "%s" already exists' % article, status_code=406)
-            else:
-                created.append(article.full_path)
+                for article, static_files in items:
+                    article.stage(transaction, replace=replace)
+
+                created = transaction.commit()
+            except FileAlreadyExists as exc:
+                raise MailViewError(request, 'Article "%s" already exists' % exc.args[0], status_code=406)
+            except OSError as exc:
+                if exc.errno == errno.EEXIST and exc.filename in article_paths:
+                    raise MailViewError(request, 'Article "%s" already exists' % article_paths[exc.filename],
+                                        status_code=406)
+                raise
         except Exception as exc:
-            for f in created:
-                # noinspection PyBroadException
-                try:
-                    os.remove(f)
-                except:
-                    pass
+            transaction.rollback()
+
+            for article, static_files in items:
+                for static_file in static_files:
+                    static_file.discard()  # Remove temporary files of static files, which were not staged
 
             raise exc  # Re-raise original exception
 
         return created
 
-    # noinspection PyUnusedLocal
-    @staticmethod
-    def _delete_article(request, article):
-        """Delete article"""
-        # TODO: delete related static files
+    def _save_article(self, request, article, static_files, replace=False):
+        """Save article file and all static files in one file transaction (all or nothing);
+        Use replace=True to overwrite existing article"""
+        return self._save_articles(request, [(article, static_files)], replace=replace)
+
+    def _is_static_file(self, filename):
+        """Return True if filename is inside of the images or files directory"""
+        return filename.startswith((self.papi.images_dir + os.sep, self.papi.files_dir + os.sep))
+
+    def _delete_article(self, request, article, locks):
+        """Delete article and its static files, which are not linked from any other article or page"""
+        try:
+            refs = [i for i in get_static_refs(article.load(), article.filename) if self._is_static_file(i)]
+        except ValueError:  # Broken file encoding
+            refs = []
+
+        for ref in refs:  # Sorted, so concurrent deletes cannot deadlock
+            self._lock_name(request, locks, 'static', ref)  # Wait for posts linking to the same file
+
+        index = self.papi.article_index
+        index.refresh()
+        referenced = index.get_referenced(exclude=(article.filename,))
         article.delete()
+        deleted = [article]
+
+        for ref in refs:
+            if ref not in referenced:
+                static_file = self.papi.get_static_file(ref)
 
-        return [article.full_path]
+                if static_file.exists():
+                    static_file.delete()
+                    deleted.append(static_file)
+
+        return deleted
 
     def _get_article(self, request, title_or_filename):
         """Fetch existing article according to title or filename"""
@@ -250,59 +648,523 @@ class PelicanMailView(MailView):
                   'Please use the filename to find specific article.' % title_or_filename
             raise MailViewError(request, err, status_code=406)
 
-    def _commit_and_publish(self, commit_msg, **commit_kwargs):
-        """Commit to git if repo_path is set and update html files"""
-        if commit_msg and self.papi.repo_path:
-            self.papi.commit(commit_msg, **commit_kwargs)
+    def _commit_and_publish(self, request, commit_msg, articles=None, notify=None, **commit_kwargs):
+        """Commit to git if repo_path is set and update html files (inside the site-wide lock);
+        Only output files of articles are written if articles are specified;
+        Notification of subscribers about new articles in notify is queued after the site-wide lock is released"""
+        flock = self._lock(request, self.lock_file)
+
+        try:
+            if commit_msg and self.papi.repo_path:
+                self.papi.commit(commit_msg, **commit_kwargs)
+
+            self.papi.publish(articles=articles)
+        finally:
+            flock.release()
+
+        if notify and self.notifier:
+            self._notify_subscribers(request, notify)
 
-        self.papi.publish()
+    def _get_subscribers(self):
+        """Return list of subscriber addresses from subscribers_file"""
+        with open(self.subscribers_file, 'r') as fp:
+            return [line.strip() for line in fp if line.strip() and not line.startswith('#')]
+
+    def _get_article_url(self, article):
+        try:
+            url = self.papi.read_article(article).url
+        except Exception as exc:
+            logger.warning('Could not get URL of article %s: %s', article.filename, exc)
+            return None
+
+        return '%s/%s' % ((self.site_url or self.papi.site_url or '').rstrip('/'), url)
+
+    def _create_notification(self, request, articles):
+        """Return new article(s) notification message"""
+        sender = self.notify_sender or request.recipient
+        lines = []
+
+        for article in articles:
+            title = self._get_listed_metadata(article, article.content)['title']
+            url = self._get_article_url(article)
+            lines.append('%s\n%s\n' % (title, url) if url else '%s\n' % title)
+
+        msg = create_text_part('\n'.join(lines))
+
+        if len(articles) == 1:
+            msg['Subject'] = 'New article: %s' % lines[0].splitlines()[0]
+        else:
+            msg['Subject'] = '%d new articles' % len(articles)
+
+        msg['From'] = sender
+        msg['To'] = sender  # Subscribers are only in the SMTP envelope
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-Id'] = make_msgid('mailpy')
+
+        return sender, msg
+
+    def _notify_subscribers(self, request, articles):
+        """Queue mail about new articles to all subscribers, which is delivered in the background (the response does
+        not wait for it); Errors are logged, because the content was already published"""
+        try:
+            subscribers = self._get_subscribers()
+
+            if not subscribers:
+                return
+
+            sender, msg = self._create_notification(request, articles)
+            job_id = md5(('%s %s' % (request.message_id, ' '.join(a.filename for a in articles))).encode('utf-8'))
+            self.notifier.submit(job_id.hexdigest(), sender, subscribers, msg.as_string())
+        except Exception as exc:
+            logger.exception('Could not notify subscribers about %s: %s', articles, exc)
+        else:
+            logger.info('Queued notification of %d subscribers about %s', len(subscribers), articles)
+
+    def _update_search_index(self, added=(), removed=()):
+        """Update full-text search index; Errors are logged, because the content was already published"""
+        if not self.search_enabled:
+            return
+
+        index = self.papi.search_index
+
+        try:
+            if removed:
+                index.remove(*removed)
+            if added:
+                index.update(*added)
+        except SearchNotAvailable as exc:
+            logger.warning('Could not update search index %r: %s', index, exc)
+        except Exception as exc:
+            logger.exception('Could not update search index %r: %s', index, exc)
+
+    def _sync_search_index(self):
+        """Index articles changed outside of mailpy (e.g. by git pull) or before a failed index update and return
+        (changed, removed) filenames or None if the index is disabled or not available"""
+        if not self.search_enabled:
+            return None
+
+        index = self.papi.search_index
+
+        try:
+            return index.sync()
+        except SearchNotAvailable as exc:
+            logger.warning('Could not update search index %r: %s', index, exc)
+        except Exception as exc:
+            logger.exception('Could not update search index %r: %s', index, exc)
+
+        return None
+
+    def _is_archive(self, part):
+        """Return True if message part is a zip or tar attachment"""
+        filename = (part.get_filename() or '').lower()
+
+        return part.get_content_type() in ('application/zip', 'application/x-zip-compressed', 'application/x-tar',
+                                           'application/x-gtar') or filename.endswith(self.bulk_archive_extensions)
+
+    def _read_archive(self, request, fp, name, max_count):
+        """Return list of (member name, message) tuples for all .eml files inside a zip or tar archive"""
+        try:
+            if zipfile.is_zipfile(fp):
+                archive = zipfile.ZipFile(fp)
+                members = sorted([(i.filename, i.file_size, i) for i in archive.infolist()
+                                  if i.filename.lower().endswith('.eml')], key=lambda i: i[0])
+                read = archive.read
+            else:
+                fp.seek(0)
+                archive = tarfile.open(fileobj=fp, mode='r:*')
+                members = sorted([(i.name, i.size, i) for i in archive.getmembers()
+                                  if i.isfile() and i.name.lower().endswith('.eml')], key=lambda i: i[0])
+
+                def read(member):
+                    return archive.extractfile(member).read()
+        except (zipfile.BadZipfile, tarfile.TarError, EOFError, IOError) as exc:
+            raise MailViewError(request, 'Could not read archive "%s": %s' % (name, exc))
+
+        messages = []
+
+        try:
+            if len(members) > max_count:
+                raise MailViewError(request, 'Too many articles (maximum is %d)' % self.bulk_max_articles,
+                                    status_code=413)
+
+            for member_name, size, member in members:
+                if size > self.bulk_max_message_size:
+                    raise MailViewError(request, 'Message "%s" in archive "%s" is too large' % (member_name, name),
+                                        status_code=413)
+
+                messages.append((member_name, message_from_bytes(read(member))))
+        except (zipfile.BadZipfile, tarfile.TarError, EOFError, IOError) as exc:
+            raise MailViewError(request, 'Could not read archive "%s": %s' % (name, exc))
+        finally:
+            archive.close()
+
+        return messages
+
+    def _get_bulk_messages(self, request, msg=None, messages=None):
+        """Return list of (name, message) tuples from message/rfc822 parts and from zip/tar attachments;
+        Messages from nested multipart parts are appended to the same list"""
+        if messages is None:
+            messages = []
+
+        if msg is None:
+            msg = request
+
+        if not msg.is_multipart():
+            return messages
+
+        for part in msg.get_payload():
+            max_count = self.bulk_max_articles - len(messages)
+
+            if part.get_content_type() == 'message/rfc822':
+                if max_count < 1:
+                    raise MailViewError(request, 'Too many articles (maximum is %d)' % self.bulk_max_articles,
+                                        status_code=413)
+
+                messages.append(('message %d' % (len(messages) + 1), part.get_payload(0)))
+            elif part.is_multipart():
+                self._get_bulk_messages(request, msg=part, messages=messages)
+            elif self._is_archive(part):
+                name = part.get_filename() or 'noname'
+
+                with tempfile.TemporaryFile() as fp:
+                    for chunk in iter_payload(part):
+                        fp.write(chunk)
+
+                    fp.seek(0)
+                    messages.extend(self._read_archive(request, fp, name, max_count))
+
+            if len(messages) > self.bulk_max_articles:
+                raise MailViewError(request, 'Too many articles (maximum is %d)' % self.bulk_max_articles,
+                                    status_code=413)
+
+        return messages
+
+    def _get_bulk_sender(self, request, msg):
+        """Return sender of an imported message, if it is the request sender or one of the authors,
+        or the request sender"""
+        sender = parseaddr(msg.get('From', ''))[1]
+
+        if sender and (sender == request.sender or self._get_author_from_email(sender) is not None):
+            return sender
+
+        return request.sender
 
     def _response(self, request, msg, **kwargs):
         """Create nice mail response"""
         site_url = self.site_url
 
+        context = {'text': msg, 'site_url': site_url}
+
         if site_url and site_url.startswith('http'):
             msg += '\n\n--\n%s\n' % site_url
 
+        if self.response_template:
+            return TemplateHtmlMailResponse(request, self.response_template, context, text=msg,
+                                            template_dirs=self.template_dirs, **kwargs)
+
         return TextMailResponse(request, msg, **kwargs)
 
+    def _parse_list_query(self, request, query):
+        """Parse list query, e.g. 'tag=python author="John Doe" since=2015-01-01 sort=-date page=2 limit=20'
+        and return (filters, sort, page, limit) tuple"""
+        filters = []
+        sort = '-date'
+        page = 1
+        limit = self.list_page_size
+
+        try:
+            tokens = shlex.split(query)
+        except ValueError as exc:
+            raise MailViewError(request, 'Invalid list query: %s' % exc)
+
+        for token in tokens:
+            key, sep, value = token.partition('=')
+            key = key.lower()
+
+            if key in ('tag', 'author'):
+                key += 's'
+
+            try:
+                if not sep or not value:
+                    raise ValueError
+                elif key == 'sort':
+                    if value.lstrip('-') not in self._list_sort_fields:
+                        raise ValueError
+                    sort = value
+                elif key == 'page':
+                    page = int(value)
+                    if page < 1:
+                        raise ValueError
+                elif key == 'limit':
+                    limit = int(value)
+                    if not 0 < limit <= self.list_max_page_size:
+                        raise ValueError
+                elif key in ('since', 'until') and parse_date(value) is None:
+                    raise ValueError
+                elif key in self._list_filters:
+                    filters.append((key, value))
+                else:
+                    raise ValueError
+            except ValueError:
+                raise MailViewError(request, 'Invalid list parameter "%s"' % token)
+
+        return filters, sort, page, limit
+
+    @staticmethod
+    def _get_list_etag(query, total, items):
+        """Return entity tag of one page of article list"""
+        h = sha256(('%s\n%d\n' % (query, total)).encode('utf-8'))
+
+        for filename, entry in items:
+            h.update(('%s %s\n' % (filename, entry.get('digest'))).encode('utf-8'))
+
+        return h.hexdigest()
+
+    @lock(shared=True)
+    def _list_articles(self, request, query):
+        """Return one page of article list served from the article index"""
+        filters, sort, page, limit = self._parse_list_query(request, query)
+        offset = (page - 1) * limit
+        index = self.papi.article_index
+        index.refresh()  # Only new or modified articles are read
+        total, items = index.query(filters=filters, sort=sort, offset=offset, limit=limit)
+        etag = self._get_list_etag(query, total, items)
+
+        if etag in request.if_none_match:
+            return NotModifiedMailResponse(request, etag)
+
+        pages = max(1, (total + limit - 1) // limit)
+
+        if items:
+            lines = ['Articles %d-%d of %d (page %d of %d)\n' % (offset + 1, offset + len(items), total, page, pages)]
+        else:
+            lines = ['No articles found (page %d of %d, %d matching articles)' % (page, pages, total)]
+
+        lines.extend('%s | %s | %s' % (filename, entry.get('date') or '', entry.get('title') or '')
+                     for filename, entry in items)
+
+        return self._response(request, '\n'.join(lines), etag=etag)
+
     def get(self, request):
-        """Return list of blog posts or content of one blog post depending on the subject"""
+        """Return list of blog posts or content of one blog post depending on the subject;
+        Unchanged content is not sent again if the request has a matching X-mailpy-if-none-match header"""
         filename = request.subject.strip()
 
-        if filename:
+        if not filename:
+            return self._list_articles(request, '')
+
+        locks = []
+
+        try:
             article = self._get_article(request, filename)
+            self._lock_name(request, locks, 'article', article.filename, shared=True)  # Wait for update() and delete()
+            article = self._get_article(request, article.filename)  # Could be deleted while we were waiting
+            etag = (self.papi.article_index.get_entry(article) or {}).get('digest')  # Only this article is checked
+
+            if etag and etag in request.if_none_match:
+                return NotModifiedMailResponse(request, etag)
+
             res = article.load()
-        else:
-            res = '\n'.join(a.filename for a in self.papi.articles)
+        finally:
+            self._release_locks(locks)
 
-        return self._response(request, res)
+        return self._response(request, res, etag=etag)
 
-    @lock
-    def post(self, request):
-        """Create new blog post, commit and rebuild the html output"""
+    def preview(self, request):
+        """Render new blog post without saving it and return the HTML output"""
         title = request.subject.strip()
 
         if not title:
             raise MailViewError(request, 'Subject (title) is required')
 
-        article = self._create_article(title)
-        text, static_files = self._get_msg_content(request, article)
+        article = self.article_class(self.papi.content_path, self.__create_article_filename(slugify(title)))
+        text = self._get_msg_preview_content(request, article)
         text, metadata = self._get_article_metadata(request, article, text)
         article.compose(title, text, metadata)
-        created = self._save_article(request, article, static_files)
-        commit_msg = 'Added article %s' % article.filename
+        html = self.papi.render_article(article)
 
-        if static_files:
-            commit_msg += ' + static files:\n\t+ %s' % '\n\t+ '.join(i.filename for i in static_files)
+        return HtmlMailResponse(request, html, text=article.content)
+
+    # noinspection PyShadowingBuiltins
+    def list(self, request):
+        """Return list of blog posts filtered, sorted and paginated according to the subject"""
+        return self._list_articles(request, request.subject.strip())
+
+    def post(self, request):
+        """Create new blog post, commit and rebuild the html output"""
+        title = request.subject.strip()
+
+        if not title:
+            raise MailViewError(request, 'Subject (title) is required')
+
+        locks = []  # Article and static file names are locked until the commit is done
+
+        try:
+            article, static_files = self._prepare_article(request, request, title, locks)
+            created = self._save_article(request, article, static_files)
+            commit_msg = 'Added article %s' % article.filename
+
+            if static_files:
+                commit_msg += ' + static files:\n\t+ %s' % '\n\t+ '.join(i.filename for i in static_files)
+
+            self._commit_and_publish(request, commit_msg, notify=[article], add=created)
+        finally:
+            self._release_locks(locks)
+
+        self._update_search_index(added=[article])
 
-        self._commit_and_publish(commit_msg, add=created)
         sep = '*' * 40
         out = 'Article "%s" was successfully created\n\n%s\n%s\n%s' % (article.filename, sep, article.content, sep)
 
         return self._response(request, out)
 
-    @lock
+    def bulk_post(self, request):
+        """Create many blog posts from attached messages (message/rfc822 parts or .eml files in a zip/tar archive)
+        with one commit and one rebuild of the html output"""
+        messages = self._get_bulk_messages(request)
+
+        if not messages:
+            raise MailViewError(request, 'No articles found (attach messages or a zip/tar archive with .eml files)')
+
+        locks = []
+        articles = list(self.papi.articles)  # All slugs and filenames are allocated against one snapshot
+        namespace = self.papi.get_static_namespace()
+        items = []  # [(article, static files)]
+        report = []
+
+        try:
+            for name, msg in messages:
+                title = decode_header(msg.get('Subject', '')).strip()
+
+                try:
+                    if not title:
+                        raise MailViewError(request, 'Subject (title) is required')
+
+                    article, static_files = self._prepare_article(request, msg, title, locks, articles=articles,
+                                                                  namespace=namespace,
+                                                                  sender=self._get_bulk_sender(request, msg))
+                except MailViewError as exc:
+                    report.append('ERROR %s: %s' % (name, exc.text))
+                    continue
+                except Exception as exc:
+                    logger.exception('Could not create article from %s: %s', name, exc)
+                    report.append('ERROR %s: %s' % (name, exc))
+                    continue
+
+                articles.append(article)
+                items.append((article, static_files))
+                report.append('OK %s: %s' % (name, article.filename))
+
+            if not items:
+                raise MailViewError(request, 'No articles were created\n\n%s' % '\n'.join(report))
+
+            created = self._save_articles(request, items)
+            commit_msg = 'Added %d articles:\n\t+ %s' % (len(items), '\n\t+ '.join(a.filename for a, f in items))
+            static_files = [i for a, files in items for i in files]
+
+            if static_files:
+                commit_msg += '\n+ static files:\n\t+ %s' % '\n\t+ '.join(i.filename for i in static_files)
+
+            self._commit_and_publish(request, commit_msg, notify=[a for a, f in items], add=created)
+        finally:
+            self._release_locks(locks)
+
+        self._update_search_index(added=[a for a, f in items])
+        out = 'Created %d of %d articles\n\n%s' % (len(items), len(messages), '\n'.join(report))
+
+        return self._response(request, out)
+
+    @staticmethod
+    def _get_listed_metadata(article, content):
+        """Return article metadata, which are visible outside of the article page (indexes, tags, feeds)"""
+        text, metadata = article.get_text_metadata(content)
+        metadata['title'] = article.get_title(text, metadata)
+
+        return metadata
+
+    def _get_saved_summary(self, article):
+        """Return summary of article read from its file in content path or None if it cannot be read"""
+        try:
+            return self.papi.read_article(article, saved=True).summary
+        except Exception as exc:
+            logger.warning('Could not read summary of article %s: %s', article.filename, exc)
+            return None
+
+    def _is_listing_changed(self, old_article, article, old_summary):
+        """Return True if title, metadata or summary shown outside of the article page have changed;
+        Called after the article was saved (old_summary was read before)"""
+        if old_summary is None or self._get_listed_metadata(old_article, old_article.content) != \
+                self._get_listed_metadata(article, article.content):
+            return True
+
+        summary = self._get_saved_summary(article)
+
+        return summary is None or summary != old_summary
+
+    def _update_article_content(self, request, article, old_content, text):
+        """Apply unified diff or replace article text; Metadata and title are kept unless overridden in text"""
+        if is_unified_diff(text):
+            try:
+                article.content = apply_patch(old_content, text)
+            except ValueError as exc:
+                raise MailViewError(request, 'Patch does not apply: %s' % exc, status_code=409)
+        else:
+            old_text, metadata = article.get_text_metadata(old_content)
+            title = metadata.pop('title', None) or article.get_title(old_text, metadata)
+            new_text, new_metadata = article.get_text_metadata(text)
+            metadata.update(new_metadata)
+            title = metadata.pop('title', None) or title
+            article.compose(title, new_text.strip(), metadata)
+
+    def update(self, request):
+        """Replace text of one blog post or apply a unified diff to it, commit and rebuild the html output"""
+        filename = request.subject.strip()
+
+        if not filename:
+            raise MailViewError(request, 'Subject (filename) is required')
+
+        locks = []
+
+        try:
+            article = self._get_article(request, filename)
+            self._lock_name(request, locks, 'article', article.filename)
+            article = self._get_article(request, article.filename)  # Could be deleted while we were waiting
+            old_content = article.load()
+            text, static_files = self._get_msg_content(request, article, locks)
+
+            try:
+                self._update_article_content(request, article, old_content, text)
+
+                if article.content == old_content and not static_files:
+                    raise MailViewError(request, 'Article "%s" was not changed' % article.filename)
+            except Exception:
+                for static_file in static_files:
+                    static_file.discard()
+                raise
+
+            old_article = self.papi.article_class(self.papi.content_path, article.filename, content=old_content)
+            old_summary = self._get_saved_summary(old_article)  # Read from the file before it is replaced
+            updated = self._save_article(request, article, static_files, replace=True)
+            commit_msg = 'Updated article %s' % article.filename
+
+            if static_files:
+                commit_msg += ' + static files:\n\t+ %s' % '\n\t+ '.join(i.filename for i in static_files)
+
+            if not self._is_listing_changed(old_article, article, old_summary):
+                articles = [article]  # Only the article page, feeds and pages listing the article have changed
+            else:
+                articles = None  # Full rebuild
+
+            self._commit_and_publish(request, commit_msg, articles=articles, add=updated)
+        finally:
+            self._release_locks(locks)
+
+        self._update_search_index(added=[article])
+        sep = '*' * 40
+        out = 'Article "%s" was successfully updated\n\n%s\n%s\n%s' % (article.filename, sep, article.content, sep)
+
+        return self._response(request, out)
+
     def delete(self, request):
         """Delete one blog post, commit and rebuild the html output"""
         filename = request.subject.strip()
@@ -310,9 +1172,116 @@ class PelicanMailView(MailView):
         if not filename:
             raise MailViewError(request, 'Subject (filename) is required')
 
-        article = self._get_article(request, filename)
-        deleted = self._delete_article(request, article)
+        locks = []
+
+        try:
+            article = self._get_article(request, filename)
+            self._lock_name(request, locks, 'article', article.filename)
+            article = self._get_article(request, article.filename)  # Could be deleted while we were waiting
+            deleted = self._delete_article(request, article, locks)
+            static_files = deleted[1:]
+            commit_msg = 'Deleted article %s' % article
+
+            if static_files:
+                commit_msg += ' + static files:\n\t- %s' % '\n\t- '.join(i.filename for i in static_files)
+
+            self._commit_and_publish(request, commit_msg, remove=[i.full_path for i in deleted])
+        finally:
+            self._release_locks(locks)
+
+        self._update_search_index(removed=[article.filename])
+        out = 'Article "%s" was successfully deleted' % article.filename
+
+        if static_files:
+            out += '\n\nRemoved static files:\n%s' % '\n'.join(i.filename for i in static_files)
+
+        return self._response(request, out)
+
+    def gc(self, request):
+        """Remove static files, which are not linked from any article or page (at most gc_max_files at once),
+        and temporary files left behind by crashed processes and update the search index;
+        Orphaned static files are taken from the article index, so the static directories are not scanned"""
+        index = self.papi.article_index
+        candidates = index.get_orphans()
+        orphans = []
+        removed = []
+        locks = []
+
+        try:
+            for filename in candidates:
+                if len(orphans) >= self.gc_max_files:
+                    break
+
+                if self._reserve_name(locks, 'static', filename):  # Skip files used by running posts
+                    orphans.append(filename)
+
+            if orphans:
+                index.refresh()  # Articles saved before we acquired the locks (only modification times are checked)
+                referenced = index.get_referenced()
+
+                for filename in orphans:
+                    static_file = self.papi.get_static_file(filename)
+
+                    if filename not in referenced and static_file.exists():
+                        static_file.delete()
+                        removed.append(static_file)
+
+                index.discard_orphans(orphans)
+
+            if removed:
+                commit_msg = 'Removed %d orphaned static files:\n\t- %s' % (
+                    len(removed), '\n\t- '.join(i.filename for i in removed))
+                self._commit_and_publish(request, commit_msg, remove=[i.full_path for i in removed])
+        finally:
+            self._release_locks(locks)
+
+        temp_files = self._file_transaction_class.cleanup(self.papi.content_path)
+        lock_files = self._cleanup_lock_files()
+        out = 'Removed %d orphaned static files, %d temporary files and %d lock files' % (len(removed), len(temp_files),
+                                                                                          lock_files)
+
+        synced = self._sync_search_index()
+
+        if synced and any(synced):
+            out += '\nRe-indexed %d changed and removed %d deleted articles in the search index' % (
+                len(synced[0]), len(synced[1]))
+
+        if self.notifier:
+            resumed = self.notifier.resume()  # Notifications interrupted by a crash
+
+            if resumed:
+                out += '\nFinished %d interrupted subscriber notifications' % len(resumed)
+
+        if removed:
+            out += '\n\n%s' % '\n'.join(i.filename for i in removed)
+
+        if len(candidates) > len(orphans):
+            out += '\n\n%d orphaned static files are left for the next run' % (len(candidates) - len(orphans))
+
+        return self._response(request, out)
+
+    def search(self, request):
+        """Full-text search in blog posts; The subject is the search query (phrases in double quotes)"""
+        query = request.subject.strip()
+
+        if not query:
+            raise MailViewError(request, 'Subject (search query) is required')
+
+        index = self.papi.search_index
+
+        try:
+            if index.is_empty():
+                index.sync()  # New index; Later changes made outside of mailpy are indexed by gc()
+
+            total, results = index.search(query, limit=self.search_results_limit)
+        except SearchQueryError as exc:
+            raise MailViewError(request, 'Invalid search query: %s' % exc)
+        except SearchNotAvailable as exc:
+            raise MailViewError(request, str(exc), status_code=501)
+
+        lines = ['Found %d articles matching: %s' % (total, query)]
 
-        self._commit_and_publish('Deleted article %s' % article, remove=deleted)
+        for filename, title, snippet in results:
+            lines.append('\n%s | %s\n    %s' % (filename, title, ' '.join(snippet.split())))
 
-        return self._response(request, 'Article "%s" was successfully deleted' % article.filename)
+        return self._response(request, '\n'.join(lines))
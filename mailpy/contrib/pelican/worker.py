@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import time
+import traceback
+import multiprocessing
+from collections import namedtuple
+
+from mailpy.utils import get_rss, get_peak_rss
+from .exceptions import BuildError, BuildTimeout
+
+__all__ = ('BuildWorker', 'BuildStats', 'get_rss', 'get_peak_rss')
+
+try:
+    _mp = multiprocessing.get_context('fork')  # The worker must inherit the PelicanAPI object
+except AttributeError:
+    _mp = multiprocessing  # Python 2 always forks
+
+# rss and rss_delta are the worker RSS after the build and its growth during the build; peak_rss is the lifetime
+# peak of the worker process (ru_maxrss), which includes memory inherited from the parent process
+BuildStats = namedtuple('BuildStats', ('duration', 'rss', 'rss_delta', 'peak_rss', 'builds', 'pid', 'written'))
+
+
+def _worker_main(conn, parent_conn, papi):
+    """Build worker process loop; Messages are ('build', list of article filenames or None) or None (exit)"""
+    parent_conn.close()  # Inherited by fork; The loop must get EOF when the parent process is gone
+    builds = 0
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, IOError, OSError):
+            break  # Parent process is gone
+
+        if msg is None:
+            break
+
+        filenames = msg[1]
+        start_time = time.time()
+        start_rss = get_rss()
+
+        try:
+            if filenames:
+                articles = [papi.get_article(filename) for filename in filenames]
+
+                for article in articles:
+                    article.load()  # Saved by the parent process
+            else:
+                articles = None
+
+            # noinspection PyProtectedMember
+            written = papi._build(articles=articles)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+        else:
+            builds += 1
+            rss = get_rss()
+            conn.send(('ok', BuildStats(time.time() - start_time, rss, rss - start_rss, get_peak_rss(), builds,
+                                        os.getpid(), written)))
+
+    conn.close()
+
+
+class BuildWorker(object):
+    """
+    Run pelican builds in a dedicated forked process, which keeps the request process small and safe from
+    crashing plugins. The worker inherits already loaded settings of the PelicanAPI object and it is started
+    by PelicanAPI right after the settings are loaded, so it is ready before the first build. It is recycled
+    (and a new one is forked right away) after max_builds builds, when its RSS grows above max_rss bytes or
+    after a failed build. A build running longer than timeout seconds is killed.
+    A process forked from the owner of the worker (e.g. a MailSupervisor worker) does not use the inherited worker
+    process; It starts its own worker on first use.
+    """
+    def __init__(self, papi, max_builds=50, max_rss=None, timeout=600):
+        self.papi = papi
+        self.max_builds = max_builds
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self.last_stats = None
+        self._process = None
+        self._conn = None
+        self._builds = 0
+        self._owner_pid = None
+
+    def __repr__(self):
+        return '%s(pid=%s, builds=%d)' % (self.__class__.__name__, self.pid, self._builds)
+
+    def _forget_inherited(self):
+        """Drop worker process and pipe inherited from the parent process, which are not ours to use"""
+        if self._process is not None and self._owner_pid != os.getpid():
+            self._close()
+            self._builds = 0
+
+    @property
+    def pid(self):
+        self._forget_inherited()
+
+        if self._process is None:
+            return None
+
+        return self._process.pid
+
+    def is_alive(self):
+        self._forget_inherited()
+
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        """Fork new worker process (if not running)"""
+        if self.is_alive():
+            return
+
+        self._close()
+        parent_conn, child_conn = _mp.Pipe()
+        process = _mp.Process(target=_worker_main, args=(child_conn, parent_conn, self.papi), name='mailpy-build-worker')
+        process.daemon = True  # Terminated together with the parent process
+        process.start()
+        child_conn.close()
+        self._process = process
+        self._conn = parent_conn
+        self._builds = 0
+        self._owner_pid = os.getpid()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+        self._process = None
+        self._conn = None
+
+    def _kill(self):
+        """Terminate worker process immediately and return its exit code"""
+        process = self._process
+
+        if process is None:
+            return None
+
+        if process.is_alive():
+            process.terminate()
+
+        process.join()
+        self._close()
+
+        return process.exitcode
+
+    def stop(self, timeout=5):
+        """Ask worker process to exit and kill it if it does not exit in time"""
+        self._forget_inherited()
+
+        if self._process is None:
+            return
+
+        try:
+            self._conn.send(None)
+        except (IOError, OSError):
+            pass
+
+        self._process.join(timeout)
+        self._kill()
+
+    def _needs_recycle(self, stats):
+        return self._builds >= self.max_builds or (self.max_rss and stats.rss > self.max_rss)
+
+    def build(self, articles=None):
+        """Run pelican in worker process and return BuildStats; Write only output files of articles if specified"""
+        self.start()
+
+        if articles:
+            filenames = [article.filename for article in articles]
+        else:
+            filenames = None
+
+        try:
+            self._conn.send(('build', filenames))
+
+            if not self._conn.poll(self.timeout):
+                self._kill()
+                raise BuildTimeout('Build did not finish within %s seconds' % self.timeout)
+
+            status, res = self._conn.recv()
+        except (EOFError, IOError, OSError):
+            raise BuildError('Build worker died (exit code %s)' % self._kill())
+
+        self._builds += 1
+
+        if status != 'ok':
+            self.stop()  # Plugins may be left in an inconsistent state
+            self.start()
+            raise BuildError(res)
+
+        self.last_stats = res
+
+        if self._needs_recycle(res):
+            self.stop()
+            self.start()  # Pre-fork the next worker before it is needed
+
+        return res
@@ -58,4 +58,5 @@ class MailViewError(TextMailError):
     def __init__(self, request, text='', **kwargs):
         text = text or self.message
         status_code = kwargs.get('status_code', self.status_code)
+        self.text = text
         super(MailViewError, self).__init__(request, 'ERROR [%s]: %s' % (status_code, text), **kwargs)
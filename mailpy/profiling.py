@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-request profiling of MailViewRouter.dispatch_request() and MailResponse.send().
+
+Enable with environment variables (read on import):
+
+    MAILPY_PROFILE=cpu,memory            # cProfile (.prof) and/or tracemalloc (.snapshot) output
+    MAILPY_PROFILE_DIR=/tmp/mailpy-prof  # Output directory (default: ~/.cache/mailpy/profiles)
+    MAILPY_PROFILE_RATE=0.01             # Fraction of requests to profile (default: 1)
+    MAILPY_PROFILE_MAX_FILES=200         # Oldest output files are removed above this limit (default: 100)
+
+or from code: set_profiler(RequestProfiler(...)). Disabled profiling costs one attribute lookup per call.
+"""
+import os
+import re
+import random
+import logging
+from datetime import datetime
+
+from .utils import get_cache_dir
+
+__all__ = ('RequestProfiler', 'get_profiler', 'set_profiler')
+
+logger = logging.getLogger(__name__)
+
+profiler = None  # Active RequestProfiler
+
+
+class RequestProfiler(object):
+    """
+    Write cProfile statistics and/or tracemalloc snapshots of sampled requests into output_dir.
+    File names are tagged with time, resource, method, Message-Id and the profiled stage (dispatch or send).
+    """
+    modes = ('cpu', 'memory')
+
+    def __init__(self, output_dir=None, cpu=True, memory=False, sample_rate=1.0, max_files=100):
+        self.output_dir = output_dir or os.path.join(get_cache_dir(), 'profiles')
+        self.cpu = cpu
+        self.memory = memory
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+
+    def __repr__(self):
+        return '%s(%s, cpu=%s, memory=%s, sample_rate=%s)' % (self.__class__.__name__, self.output_dir, self.cpu,
+                                                            self.memory, self.sample_rate)
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """Return profiler configured by MAILPY_PROFILE* environment variables or None"""
+        modes = [i.strip() for i in environ.get('MAILPY_PROFILE', '').lower().split(',') if i.strip()]
+
+        if not modes or modes == ['0']:
+            return None
+
+        if modes in (['1'], ['all']):
+            modes = cls.modes
+
+        return cls(output_dir=environ.get('MAILPY_PROFILE_DIR') or None, cpu='cpu' in modes,
+                   memory='memory' in modes, sample_rate=float(environ.get('MAILPY_PROFILE_RATE', 1)),
+                   max_files=int(environ.get('MAILPY_PROFILE_MAX_FILES', 100)))
+
+    def is_sampled(self, request):
+        """Decide once per request whether it will be profiled"""
+        try:
+            return request.profiled
+        except AttributeError:
+            request.profiled = self.sample_rate >= 1 or random.random() < self.sample_rate
+            return request.profiled
+
+    def _get_file_prefix(self, request, stage):
+        tag = '-'.join((request.resource or '', request.method or '', (request.message_id or '').strip('<>')))
+
+        return os.path.join(self.output_dir, '%s-%d-%s-%s' % (datetime.now().strftime('%Y%m%d%H%M%S.%f'), os.getpid(),
+                                                              re.sub(r'[^\w.@-]+', '_', tag)[:150], stage))
+
+    def _cleanup(self):
+        """Remove oldest output files above max_files"""
+        try:
+            files = [os.path.join(self.output_dir, f) for f in os.listdir(self.output_dir)]
+            files.sort(key=os.path.getmtime)
+        except OSError:
+            return
+
+        for f in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def run(self, request, stage, fun, *args, **kwargs):
+        """Call fun(*args, **kwargs) under the profiler and write the results"""
+        prof = tracemalloc = None
+        started_tracing = False
+
+        if self.memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+
+        if self.cpu:
+            import cProfile
+
+            prof = cProfile.Profile()
+            prof.enable()
+
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            if prof:
+                prof.disable()
+
+            snapshot = tracemalloc.take_snapshot() if tracemalloc else None
+
+            if started_tracing:
+                tracemalloc.stop()
+
+            try:
+                self._write(request, stage, prof, snapshot)
+            except (IOError, OSError) as exc:
+                logger.warning('Could not save profile of %s: %s', request.message_id, exc)
+
+    def _write(self, request, stage, prof, snapshot):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        prefix = self._get_file_prefix(request, stage)
+
+        if prof:
+            prof.dump_stats(prefix + '.prof')
+
+        if snapshot:
+            snapshot.dump(prefix + '.snapshot')
+
+        self._cleanup()
+
+
+def get_profiler():
+    return profiler
+
+
+def set_profiler(new_profiler):
+    """Enable (RequestProfiler) or disable (None) per-request profiling in this process"""
+    global profiler
+    profiler = new_profiler
+
+
+try:
+    profiler = RequestProfiler.from_env()
+except ValueError as exc:
+    logger.error('Invalid MAILPY_PROFILE settings: %s', exc)
@@ -1,9 +1,30 @@
 # -*- coding: utf-8 -*-
 from email.message import Message
 
-from .utils import decode_header
+from .utils import decode_header, parse_message_bytes, parse_headers_bytes
 
-__all__ = ('MailRequest',)
+__all__ = ('MailRequest', 'MailEnvelope')
+
+
+def parse_recipient(recipient):
+    """Return (method, resource) tuple from recipient address"""
+    method, resource = recipient.split('@', 1)
+
+    return method.replace('-', '_').lower(), '.'.join(reversed(resource.replace('-', '_').lower().split('.')))
+
+
+def _get_header_block(raw, chunk_size=8192):
+    """Return the beginning of a raw message (bytes or memoryview) including all headers without copying the body"""
+    data = b''
+
+    for start in range(0, len(raw), chunk_size):
+        data += bytes(raw[start:start + chunk_size])
+        search_from = max(0, start - 2)
+
+        if data.find(b'\n\n', search_from) >= 0 or data.find(b'\n\r\n', search_from) >= 0:
+            break  # The blank line after headers
+
+    return data
 
 
 class MailRequest(Message):
@@ -14,9 +35,7 @@ class MailRequest(Message):
         Message.__init__(self)
         self.sender = sender
         self.recipient = recipient
-        method, resource = recipient.split('@', 1)
-        self.method = method.replace('-', '_').lower()
-        self.resource = '.'.join(reversed(resource.replace('-', '_').lower().split('.')))
+        self.method, self.resource = parse_recipient(recipient)
 
     def __repr__(self):
         return '%s(from="%s", to="%s", subject="%s")' % (self.__class__.__name__, self.sender,
@@ -29,3 +48,62 @@ class MailRequest(Message):
     @property
     def message_id(self):
         return self.get('Message-Id', '')
+
+    @property
+    def if_none_match(self):
+        """List of entity tags from the X-mailpy-if-none-match header (conditional request)"""
+        return [i.strip().strip('"') for i in self.get('X-mailpy-if-none-match', '').split(',') if i.strip()]
+
+
+class MailEnvelope(object):
+    """
+    Compact picklable form of a mail request for passing it to another process.
+    Holds the SMTP envelope, routing information, decoded Subject and Message-Id and the raw message
+    (bytes or memoryview). The MIME tree is parsed only when the request attribute is accessed.
+    """
+    __slots__ = ('sender', 'recipient', 'method', 'resource', 'subject', 'message_id', 'raw', '_request')
+
+    def __init__(self, sender, recipient, raw, subject=None, message_id=None):
+        self.sender = sender
+        self.recipient = recipient
+        self.method, self.resource = parse_recipient(recipient)
+        self.raw = raw
+        self._request = None
+
+        if subject is None or message_id is None:
+            headers = parse_headers_bytes(_get_header_block(raw))
+
+            if subject is None:
+                subject = decode_header(headers.get('Subject', ''))
+
+            if message_id is None:
+                message_id = headers.get('Message-Id', '')
+
+        self.subject = subject
+        self.message_id = message_id
+
+    def __repr__(self):
+        return '%s(from="%s", to="%s", subject="%s", size=%d)' % (self.__class__.__name__, self.sender,
+                                                                  self.recipient, self.subject, len(self.raw))
+
+    def __reduce__(self):
+        return self.__class__, (self.sender, self.recipient, bytes(self.raw), self.subject, self.message_id)
+
+    @classmethod
+    def from_request(cls, request):
+        try:
+            raw = request.as_bytes()  # 8-bit bytes of a message parsed from bytes are kept as they are
+        except AttributeError:  # Python 2
+            raw = request.as_string()
+        except UnicodeError:  # Non-ASCII text of a message parsed from text
+            raw = request.as_string().encode('utf-8', 'surrogateescape')
+
+        return cls(request.sender, request.recipient, raw, subject=request.subject, message_id=request.message_id)
+
+    @property
+    def request(self):
+        """MailRequest parsed from the raw message on first access"""
+        if self._request is None:
+            self._request = parse_message_bytes(bytes(self.raw), self.sender, self.recipient)
+
+        return self._request
@@ -1,21 +1,89 @@
 # -*- coding: utf-8 -*-
+from io import BytesIO
 from email.message import Message
+from email.charset import Charset, QP, BASE64
+from email.utils import make_msgid
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+import zipfile
+import gzip
 
 from .utils import send_mail, decode_header
 from .request import MailRequest
+from .template import render_template
+from . import profiling
 
-__all__ = ('MailResponse', 'TextMailResponse', 'HtmlMailResponse')
+__all__ = ('MailResponse', 'TextMailResponse', 'HtmlMailResponse', 'NotModifiedMailResponse',
+           'TemplateTextMailResponse', 'TemplateHtmlMailResponse')
+
+MAX_LINE_LENGTH = 998  # RFC 5322
+
+
+def create_text_part(text, subtype='plain', charset='utf-8'):
+    """Create MIMEText part with the content-transfer-encoding producing the smallest message"""
+    data = bytearray(text.encode(charset))
+    cs = Charset(charset)
+
+    if all(i < 128 for i in data) and all(len(line) <= MAX_LINE_LENGTH for line in data.splitlines()):
+        cs.body_encoding = None  # 7bit
+    else:
+        escaped = sum(1 for i in data if i > 126 or i == 61)  # Non-ASCII characters and "=" are quoted
+        qp_size = len(data) + 2 * escaped + len(data) // 76  # + soft line breaks
+        b64_size = (len(data) + 2) // 3 * 4 * 77 // 76
+
+        if qp_size < b64_size:
+            cs.body_encoding = QP
+        else:
+            cs.body_encoding = BASE64
+
+    return MIMEText(text, subtype, cs)
+
+
+def split_text(text, max_size, charset='utf-8'):
+    """Split text on line boundaries into chunks of at most max_size bytes (longer lines are split too)"""
+    chunks = []
+    chunk = []
+    size = 0
+
+    for line in text.splitlines(True):
+        line_size = len(line.encode(charset))
+
+        if chunk and size + line_size > max_size:
+            chunks.append(''.join(chunk))
+            chunk = []
+            size = 0
+
+        while line_size > max_size:
+            i = max_size
+
+            while i > 1 and len(line[:i].encode(charset)) > max_size:  # A character is never split
+                i = max(1, min(i - 1, i * max_size // len(line[:i].encode(charset))))
+
+            chunks.append(line[:i])
+            line = line[i:]
+            line_size = len(line.encode(charset))
+
+        chunk.append(line)
+        size += line_size
+
+    if chunk or not chunks:
+        chunks.append(''.join(chunk))
+
+    return chunks
 
 
 class MailResponse(object):
     """
     Mail response (message wrapper).
+    Content larger than max_inline_size bytes is sent in a compressed attachment (large_response='gzip' or 'zip')
+    or split into numbered follow-up messages (large_response='split'; text responses only).
     """
     status_code = 200
+    max_inline_size = 2 * 1024 * 1024
+    large_response = 'gzip'
 
-    def __init__(self, request, message, sender=None, recipients=None, subject=None, status_code=None):
+    def __init__(self, request, message, sender=None, recipients=None, subject=None, status_code=None, etag=None):
         assert isinstance(request, MailRequest), 'request must be an instance of %s' % MailRequest
         assert isinstance(message, Message), 'message must be an instance of %s' % Message
 
@@ -35,6 +103,8 @@ class MailResponse(object):
         self.request = request
         self.message = message
         self.status_code = status_code or self.status_code
+        self.etag = etag
+        self.followups = []  # Additional messages with the rest of a large response
         # SMTP envelope headers
         self.sender = sender
         self.recipients = recipients
@@ -56,10 +126,67 @@ class MailResponse(object):
             message['To'] = ','.join(self.recipients)
 
         message['In-Reply-To'] = self.request.message_id
+        self._add_mailpy_headers(message)
+
+        if self.etag:
+            message['X-mailpy-etag'] = '"%s"' % self.etag
+
+    def _add_mailpy_headers(self, message):
         message['X-mailpy-resource'] = self.request.resource
         message['X-mailpy-method'] = self.request.method
         message['X-mailpy-status-code'] = str(self.status_code)
 
+    def _is_large(self, data):
+        return self.max_inline_size and len(data) > self.max_inline_size
+
+    def _create_compressed_message(self, data, filename, charset='utf-8'):
+        """Create message with a short text and content compressed in an attachment"""
+        buf = BytesIO()
+
+        if self.large_response == 'zip':
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(filename, data)
+            filename += '.zip'
+            subtype = 'zip'
+        else:
+            with gzip.GzipFile(filename=filename, mode='wb', fileobj=buf) as gz:
+                gz.write(data)
+            filename += '.gz'
+            subtype = 'gzip'
+
+        msg = MIMEMultipart()
+        msg.attach(create_text_part('The response is too large (%d bytes) and was sent as attachment %s.\n' % (
+            len(data), filename), charset=charset))
+        attachment = MIMEApplication(buf.getvalue(), subtype)
+        attachment.add_header('Content-Disposition', 'attachment', filename=filename)
+        msg.attach(attachment)
+
+        return msg
+
+    def _add_followups(self, messages):
+        """Add follow-up messages linked to the main message by In-Reply-To and References headers"""
+        main = self.message
+        total = len(messages) + 1
+
+        if 'Message-Id' not in main:
+            main['Message-Id'] = make_msgid('mailpy')
+
+        del main['Subject']
+        main['Subject'] = '%s (1/%d)' % (self._subject, total)
+        main['X-mailpy-part'] = '1/%d' % total
+        references = ' '.join(i for i in (self.request.message_id, main['Message-Id']) if i)
+
+        for i, message in enumerate(messages, 2):
+            message['Subject'] = '%s (%d/%d)' % (self._subject, i, total)
+            message['From'] = self.sender
+            message['To'] = ','.join(self.recipients)
+            message['Message-Id'] = make_msgid('mailpy')
+            message['In-Reply-To'] = main['Message-Id']
+            message['References'] = references
+            self._add_mailpy_headers(message)
+            message['X-mailpy-part'] = '%d/%d' % (i, total)
+            self.followups.append(message)
+
     def __repr__(self):
         return '%s(status=%s, from="%s", to="%s", subject="%s")' % (self.__class__.__name__, self.status_code,
                                                                     self.sender, self.recipient,
@@ -77,8 +204,21 @@ class MailResponse(object):
         return decode_header(self.message.get('Subject', ''))
 
     def send(self, sendmail_fun=send_mail):
+        profiler = profiling.profiler
+
+        if profiler is not None and profiler.is_sampled(self.request):
+            return profiler.run(self.request, 'send', self._send, sendmail_fun)
+
+        return self._send(sendmail_fun)
+
+    def _send(self, sendmail_fun):
         self._sent = True
-        return sendmail_fun(self.sender, self.recipients, self.message.as_string())
+        res = sendmail_fun(self.sender, self.recipients, self.message.as_string())
+
+        for message in self.followups:
+            sendmail_fun(self.sender, self.recipients, message.as_string())
+
+        return res
 
 
 class TextMailResponse(MailResponse):
@@ -86,7 +226,21 @@ class TextMailResponse(MailResponse):
     Text mail response.
     """
     def __init__(self, request, text, charset='utf-8', **kwargs):
-        super(TextMailResponse, self).__init__(request, MIMEText(text, _charset=charset), **kwargs)
+        data = text.encode(charset)
+        chunks = ()
+
+        if not self._is_large(data):
+            msg = create_text_part(text, charset=charset)
+        elif self.large_response == 'split':
+            chunks = split_text(text, self.max_inline_size, charset=charset)
+            msg = create_text_part(chunks[0], charset=charset)
+        else:
+            msg = self._create_compressed_message(data, '%s.txt' % request.method, charset=charset)
+
+        super(TextMailResponse, self).__init__(request, msg, **kwargs)
+
+        if len(chunks) > 1:
+            self._add_followups([create_text_part(chunk, charset=charset) for chunk in chunks[1:]])
 
 
 class HtmlMailResponse(MailResponse):
@@ -94,11 +248,61 @@ class HtmlMailResponse(MailResponse):
     HTML mail response.
     """
     def __init__(self, request, html, text=None, charset='utf-8', **kwargs):
-        msg = MIMEMultipart('alternative')
+        data = html.encode(charset)
 
-        if text is not None:
-            msg.attach(MIMEText(text, 'text', _charset=charset))
+        if self._is_large(data):
+            msg = self._create_compressed_message(data, '%s.html' % request.method, charset=charset)
+        else:
+            msg = MIMEMultipart('alternative')
 
-        msg.attach(MIMEText(html, 'html', _charset=charset))
+            if text is not None:
+                msg.attach(create_text_part(text, 'plain', charset=charset))
+
+            msg.attach(create_text_part(html, 'html', charset=charset))
 
         super(HtmlMailResponse, self).__init__(request, msg, **kwargs)
+
+
+class TemplateTextMailResponse(TextMailResponse):
+    """
+    Text mail response rendered from a Jinja2 template.
+    Templates are searched in template_dirs and compiled only once per process (see mailpy.template).
+    """
+    template_dirs = ()
+    template_cache_dir = None
+
+    def __init__(self, request, template, context=None, template_dirs=None, **kwargs):
+        context = dict(context or (), request=request)
+        text = render_template(template_dirs or self.template_dirs, template, context,
+                               cache_dir=self.template_cache_dir)
+        super(TemplateTextMailResponse, self).__init__(request, text, **kwargs)
+
+
+class TemplateHtmlMailResponse(HtmlMailResponse):
+    """
+    HTML mail response rendered from a Jinja2 template with an optional plain text alternative (text or text_template).
+    Templates are searched in template_dirs and compiled only once per process (see mailpy.template).
+    """
+    template_dirs = ()
+    template_cache_dir = None
+
+    def __init__(self, request, template, context=None, text_template=None, template_dirs=None, text=None,
+                 **kwargs):
+        template_dirs = template_dirs or self.template_dirs
+        context = dict(context or (), request=request)
+        html = render_template(template_dirs, template, context, cache_dir=self.template_cache_dir)
+
+        if text_template:
+            text = render_template(template_dirs, text_template, context, cache_dir=self.template_cache_dir)
+
+        super(TemplateHtmlMailResponse, self).__init__(request, html, text=text, **kwargs)
+
+
+class NotModifiedMailResponse(TextMailResponse):
+    """
+    Short response to a conditional request (X-mailpy-if-none-match) for content, which has not changed.
+    """
+    status_code = 304
+
+    def __init__(self, request, etag, text='Not Modified', **kwargs):
+        super(NotModifiedMailResponse, self).__init__(request, text, etag=etag, **kwargs)
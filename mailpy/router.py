@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from . import profiling
 from .response import MailResponse
 from .exceptions import MailViewAlreadyRegistered, MailMethodAlreadyRegistered, MailError, MailViewError
 
@@ -27,6 +28,14 @@ class MailViewRouter(dict):
 
     def dispatch_request(self, request):
         """Find and run the appropriate view method and return a MailResponse response object"""
+        profiler = profiling.profiler
+
+        if profiler is not None and profiler.is_sampled(request):
+            return profiler.run(request, 'dispatch', self._dispatch_request, request)
+
+        return self._dispatch_request(request)
+
+    def _dispatch_request(self, request):
         try:
             try:
                 view_fun = self[request.method]
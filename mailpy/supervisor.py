@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import gc
+import json
+import time
+import errno
+import fcntl
+import select
+import signal
+import socket
+import struct
+import logging
+import threading
+
+from .view import MailView
+from .router import router
+from .request import MailEnvelope
+from .utils import get_rss, get_private_memory
+
+__all__ = ('MailSupervisor', 'load_view_class', 'send_envelope', 'SupervisorError', 'SupervisorUnavailable')
+
+logger = logging.getLogger(__name__)
+
+# Messages are a JSON object and raw bytes (the mail message) prefixed by their sizes; Nothing received from
+# the socket is unpickled, so a peer allowed to connect cannot run code in the supervisor workers
+_header = struct.Struct('!II')
+_max_meta_size = 1048576
+
+
+class SupervisorError(Exception):
+    pass
+
+
+class SupervisorUnavailable(SupervisorError):
+    """Nothing was sent, because the supervisor socket does not accept connections (e.g. stale socket file)"""
+    pass
+
+
+def load_view_class(resource):
+    """Import mail view class for resource (e.g. resource "blog.blog_admin" -> blog.blog_admin.BlogAdmin)"""
+    viewname = resource.split('.')[-1]
+    clsname = viewname[0].upper() + re.sub(r'_+([a-zA-Z0-9])', lambda m: m.group(1).upper(), viewname[1:])
+    module = __import__(resource, fromlist=[clsname])
+    viewcls = getattr(module, clsname)
+
+    if not issubclass(viewcls, MailView):
+        raise TypeError('Mail view "%s" is not an instance of MailView' % viewcls.__name__)
+
+    return viewcls
+
+
+def _send_msg(sock, obj, data=b''):
+    """Send JSON serializable object and raw bytes"""
+    meta = json.dumps(obj).encode('utf-8')
+    sock.sendall(_header.pack(len(meta), len(data)) + meta)
+
+    if data:
+        sock.sendall(data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+
+    while size:
+        chunk = sock.recv(min(size, 1048576))
+
+        if not chunk:
+            raise SupervisorError('Connection closed')
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def _recv_msg(sock):
+    """Return (object, raw bytes) sent by _send_msg()"""
+    meta_size, data_size = _header.unpack(_recv_exact(sock, _header.size))
+
+    if meta_size > _max_meta_size:
+        raise SupervisorError('Invalid message')
+
+    try:
+        obj = json.loads(_recv_exact(sock, meta_size).decode('utf-8'))
+    except ValueError:
+        raise SupervisorError('Invalid message')
+
+    return obj, _recv_exact(sock, data_size)
+
+
+def _send_envelope(sock, envelope):
+    _send_msg(sock, {'sender': envelope.sender, 'recipient': envelope.recipient, 'subject': envelope.subject,
+                     'message_id': envelope.message_id}, envelope.raw)
+
+
+def _recv_envelope(sock):
+    meta, raw = _recv_msg(sock)
+
+    try:
+        return MailEnvelope(meta['sender'], meta['recipient'], raw, subject=meta['subject'],
+                            message_id=meta['message_id'])
+    except (TypeError, KeyError, ValueError, AttributeError):
+        raise SupervisorError('Invalid request')
+
+
+def send_envelope(socket_path, envelope, timeout=900):
+    """Pass MailEnvelope to a supervisor worker and return its reply dict {'status', 'response', 'error',
+    'unknown_resource'}; SupervisorUnavailable is raised if the supervisor is not running"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error as exc:
+            raise SupervisorUnavailable('Could not connect to supervisor %s: %s' % (socket_path, exc))
+
+        _send_envelope(sock, envelope)
+
+        return _recv_msg(sock)[0]
+    finally:
+        sock.close()
+
+
+class MailSupervisor(object):
+    """
+    Pre-forking server for mail requests passed by send_envelope() through a unix socket.
+
+    Mail views are instantiated (and warmed up by MailView._preload()) once in the supervisor process and the
+    forked workers share this state copy-on-write. Every worker accepts connections from the shared socket,
+    dispatches the request, sends the response and replies with the response status. A worker exits after
+    max_requests requests or when its private memory (USS, see get_private_memory()) grows above max_rss bytes
+    and the supervisor forks a new one. RSS is not used for the limit, because it includes the pages shared with
+    the supervisor. Per-worker load (requests, busy state, RSS, USS) is logged every report_interval seconds and
+    on SIGUSR1.
+    """
+    def __init__(self, views, socket_path, workers=None, max_requests=1000, max_rss=None, report_interval=300,
+                 socket_mode=0o660):
+        self.views = views  # (resource, MailView class) tuples
+        self.socket_path = socket_path
+        self.workers = workers or _cpu_count()
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.report_interval = report_interval
+        self.socket_mode = socket_mode
+        self._view_objects = []
+        self._listener = None
+        self._children = {}  # pid -> {'fd', 'buffer', 'requests', 'busy', 'rss', 'uss', 'started', 'last_request'}
+        self._stopping = False
+        self._report_requested = False
+
+    def __repr__(self):
+        return '%s(%s, workers=%d)' % (self.__class__.__name__, self.socket_path, self.workers)
+
+    def _load_views(self):
+        for resource, viewcls in self.views:
+            if viewcls.resource != resource:  # Requests are routed by their mail resource
+                viewcls = type(viewcls.__name__, (viewcls,), {'resource': resource})
+
+            view = viewcls()
+            # noinspection PyProtectedMember
+            view._preload()
+            self._view_objects.append(view)
+
+    def _bind(self):
+        try:
+            os.remove(self.socket_path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, self.socket_mode)
+        listener.listen(128)
+        self._listener = listener
+
+    # Worker process
+
+    @staticmethod
+    def _report(status_fd, **status):
+        try:
+            os.write(status_fd, (json.dumps(status) + '\n').encode('ascii'))
+        except OSError:
+            pass  # Supervisor is gone
+
+    @staticmethod
+    def _dispatch(envelope):
+        try:
+            view_router = router[envelope.resource]
+        except KeyError:
+            return {'status': None, 'response': None, 'error': 'Unknown resource "%s"' % envelope.resource,
+                    'unknown_resource': True}
+
+        request = envelope.request
+        logger.info('Processing mail request: %r', request)
+        response = view_router.dispatch_request(request)
+        logger.info('Sending mail response: %r', response)
+        response.send()
+
+        return {'status': response.status_code, 'response': repr(response), 'error': None, 'unknown_resource': False}
+
+    def _handle_connection(self, conn):
+        try:
+            envelope = _recv_envelope(conn)
+
+            try:
+                reply = self._dispatch(envelope)
+            except Exception as exc:
+                logger.exception('Could not process mail request %r: %s', envelope, exc)
+                reply = {'status': None, 'response': None, 'error': str(exc), 'unknown_resource': False}
+
+            _send_msg(conn, reply)
+        except (SupervisorError, socket.error) as exc:
+            logger.warning('Broken connection: %s', exc)
+        finally:
+            conn.close()
+
+    def _worker_main(self, status_fd):
+        state = {'busy': False, 'stop': False}
+
+        def stop(signum, frame):
+            if state['busy']:
+                state['stop'] = True  # Finish current request first
+            else:
+                os._exit(0)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        requests = 0
+
+        while not state['stop'] and requests < self.max_requests:
+            try:
+                conn, _ = self._listener.accept()
+            except socket.error as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                raise
+
+            state['busy'] = True
+            self._report(status_fd, busy=True, requests=requests)
+            self._handle_connection(conn)
+            requests += 1
+            state['busy'] = False
+            uss = get_private_memory()
+            self._report(status_fd, busy=False, requests=requests, rss=get_rss(), uss=uss)
+
+            if self.max_rss and uss > self.max_rss:
+                logger.info('Worker %d exceeded memory limit (%d > %d private bytes)', os.getpid(), uss,
+                            self.max_rss)
+                break
+
+    @staticmethod
+    def _join_threads():
+        """Wait for background threads of views (e.g. subscriber notifications), which would be killed by os._exit()"""
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and not thread.daemon:
+                thread.join()
+
+    # Supervisor process
+
+    def _spawn(self):
+        status_r, status_w = os.pipe()
+        # Processes forked by the worker (e.g. a pelican build worker) inherit status_w and keep the pipe open
+        # after the worker exits, so reads must not block
+        fcntl.fcntl(status_r, fcntl.F_SETFL, fcntl.fcntl(status_r, fcntl.F_GETFL) | os.O_NONBLOCK)
+        pid = os.fork()
+
+        if pid == 0:  # Worker
+            code = 0
+
+            try:
+                os.close(status_r)
+
+                for child in self._children.values():
+                    os.close(child['fd'])
+
+                self._worker_main(status_w)
+                self._join_threads()
+            except BaseException as exc:
+                if not isinstance(exc, SystemExit):
+                    logger.exception('Worker %d crashed: %s', os.getpid(), exc)
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(status_w)
+        self._children[pid] = {'fd': status_r, 'buffer': b'', 'requests': 0, 'busy': False, 'rss': None,
+                               'uss': None, 'started': time.time(), 'last_request': None}
+        logger.debug('Started worker %d', pid)
+
+        return pid
+
+    def _reap(self):
+        """Collect exited workers"""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.ECHILD:
+                    break
+                raise
+
+            if not pid:
+                break
+
+            child = self._children.pop(pid, None)
+
+            if child is not None:
+                self._read_status(child)
+                os.close(child['fd'])
+                logger.info('Worker %d exited (status %d) after %d requests', pid, status, child['requests'])
+
+    def _read_status(self, child):
+        try:
+            data = os.read(child['fd'], 65536)
+        except OSError:
+            return
+
+        lines = (child['buffer'] + data).split(b'\n')
+        child['buffer'] = lines.pop()
+
+        for line in lines:
+            try:
+                status = json.loads(line.decode('ascii'))
+            except ValueError:
+                continue
+
+            child.update(status)
+
+            if status.get('busy'):
+                child['last_request'] = time.time()
+
+    def stats(self):
+        """Return dict {pid: {'requests', 'busy', 'rss', 'uss', 'started', 'last_request'}}"""
+        return {pid: {k: v for k, v in child.items() if k not in ('fd', 'buffer')}
+                for pid, child in self._children.items()}
+
+    def report(self):
+        """Log per-worker load"""
+        stats = self.stats()
+        busy = sum(1 for i in stats.values() if i['busy'])
+        logger.info('%d workers (%d busy), %d requests', len(stats), busy, sum(i['requests'] for i in stats.values()))
+
+        for pid, i in sorted(stats.items()):
+            logger.info('\tworker %d: %s, %d requests, rss=%s, uss=%s, up %ds', pid, 'busy' if i['busy'] else 'idle',
+                        i['requests'], i['rss'], i['uss'], time.time() - i['started'])
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_report(self, signum, frame):
+        self._report_requested = True
+
+    def _stop_workers(self, timeout=30):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+        deadline = time.time() + timeout
+
+        while self._children and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        while self._children:
+            self._reap()
+            time.sleep(0.01)
+
+    def run(self):
+        """Load views, bind socket and keep the configured number of workers running until SIGTERM/SIGINT"""
+        self._load_views()
+        self._bind()
+
+        if hasattr(gc, 'freeze'):
+            gc.freeze()  # Keep objects of preloaded views out of collections, which would touch their pages
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGUSR1, self._on_report)
+        logger.info('%r started', self)
+        last_report = time.time()
+
+        try:
+            while not self._stopping:
+                self._reap()
+
+                while len(self._children) < self.workers and not self._stopping:
+                    self._spawn()
+
+                fds = {child['fd']: child for child in self._children.values()}
+
+                try:
+                    readable = select.select(list(fds), [], [], 1)[0]
+                except (select.error, OSError) as exc:
+                    if exc.args[0] != errno.EINTR:
+                        raise
+                    readable = []
+
+                for fd in readable:
+                    self._read_status(fds[fd])
+
+                if self._report_requested or (self.report_interval and
+                                              time.time() - last_report > self.report_interval):
+                    self._report_requested = False
+                    last_report = time.time()
+                    self.report()
+        finally:
+            self._stop_workers()
+            self._listener.close()
+
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+            logger.info('%r stopped', self)
+
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        import multiprocessing
+        return multiprocessing.cpu_count()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import os
+import errno
+import threading
+
+from .utils import get_cache_dir
+
+__all__ = ('get_template_environment', 'render_template')
+
+_environments = {}  # (template_dirs, cache_dir) -> jinja2.Environment
+_lock = threading.Lock()
+
+
+def _import_jinja2():
+    """Return jinja2 module; Jinja2 is imported only when templates are used"""
+    import jinja2
+
+    return jinja2
+
+
+def get_template_environment(template_dirs, cache_dir=None):
+    """Return Jinja2 environment for template directories; The environment is created once per process and keeps
+    compiled templates in memory. Compiled templates are also stored in cache_dir (bytecode cache) shared by
+    all processes, unless cache_dir is False. HTML and XML templates are autoescaped"""
+    if cache_dir is None:
+        cache_dir = os.path.join(get_cache_dir(), 'templates')
+
+    key = (tuple(template_dirs), cache_dir)
+
+    try:
+        return _environments[key]
+    except KeyError:
+        pass
+
+    jinja2 = _import_jinja2()
+
+    with _lock:
+        if key in _environments:
+            return _environments[key]
+
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        else:
+            bytecode_cache = None
+
+        env = _environments[key] = jinja2.Environment(loader=jinja2.FileSystemLoader(list(template_dirs)),
+                                                      bytecode_cache=bytecode_cache,
+                                                      autoescape=jinja2.select_autoescape(('html', 'htm', 'xml')),
+                                                      keep_trailing_newline=True)
+
+    return env
+
+
+def render_template(template_dirs, template_name, context, cache_dir=None):
+    """Render template from template directories with context"""
+    env = get_template_environment(template_dirs, cache_dir=cache_dir)
+
+    return env.get_template(template_name).render(context)
@@ -2,7 +2,21 @@
 from functools import partial
 from email.parser import FeedParser
 from email.header import decode_header as _decode_header
+import binascii
 import smtplib
+import quopri
+import sys
+import os
+import resource
+
+try:
+    from email.parser import BytesFeedParser, BytesHeaderParser
+except ImportError:  # Python 2 (str is bytes)
+    from email.parser import FeedParser as BytesFeedParser, HeaderParser as _HeaderParser
+
+    class BytesHeaderParser(_HeaderParser):
+        def parsebytes(self, text, headersonly=True):
+            return self.parsestr(text, headersonly=headersonly)
 
 
 def send_mail(from_addr, to_addrs, msg, host='localhost', port=25):
@@ -14,6 +28,11 @@ def send_mail(from_addr, to_addrs, msg, host='localhost', port=25):
     return ret
 
 
+def get_cache_dir():
+    """Return mailpy cache directory (~/.cache/mailpy or $XDG_CACHE_HOME/mailpy)"""
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'mailpy')
+
+
 def parse_message(file_input, sender, recipient):
     """Parse message from file input and create MailRequest"""
     from .request import MailRequest  # circular imports
@@ -25,6 +44,20 @@ def parse_message(file_input, sender, recipient):
     return parser.close()
 
 
+def parse_message_bytes(data, sender, recipient):
+    """Parse raw message (bytes) and create MailRequest"""
+    from .request import MailRequest  # circular imports
+    parser = BytesFeedParser(partial(MailRequest, sender, recipient))
+    parser.feed(data)
+
+    return parser.close()
+
+
+def parse_headers_bytes(data):
+    """Parse only headers of a raw message (bytes) and return email.message.Message"""
+    return BytesHeaderParser().parsebytes(data)
+
+
 def decode(string, encoding):
     """Helper for decode_header (in case it would return bytes str)"""
     try:
@@ -36,3 +69,91 @@ def decode(string, encoding):
 def decode_header(header):
     """Return decoded message header"""
     return ''.join(decode(value, charset or 'ascii') for value, charset in _decode_header(header))
+
+
+def _payload_to_bytes(payload):
+    """Convert undecoded text payload to bytes like Message.get_payload(decode=True)"""
+    if isinstance(payload, bytes):
+        return payload  # Python 2
+
+    try:
+        return payload.encode('ascii', 'surrogateescape')  # Bytes of a message parsed from bytes
+    except UnicodeError:
+        return payload.encode('raw-unicode-escape')  # Not RFC compliant, but must not fail
+
+
+def iter_payload(msg_part, chunk_size=65536):
+    """Decode message payload incrementally and yield chunks of bytes (like get_payload(decode=True))"""
+    cte = msg_part.get('Content-Transfer-Encoding', '').strip().lower()
+
+    if msg_part.is_multipart() or cte not in ('base64', 'quoted-printable'):
+        payload = msg_part.get_payload(decode=True)
+
+        if payload:
+            yield payload
+
+        return
+
+    payload = msg_part.get_payload()
+    payload_len = len(payload)
+
+    if cte == 'base64':
+        rest = ''
+
+        for start in range(0, payload_len, chunk_size):
+            chunk = rest + ''.join(payload[start:start + chunk_size].split())
+            end = len(chunk) - len(chunk) % 4
+            rest = chunk[end:]
+
+            if end:
+                yield binascii.a2b_base64(chunk[:end])
+
+        if len(rest) % 4 == 1:
+            rest = rest[:-1]  # One dangling character does not encode a whole byte
+
+        if rest:
+            yield binascii.a2b_base64(rest + '=' * (-len(rest) % 4))  # Be lenient like email.message
+    else:
+        start = 0
+
+        while start < payload_len:
+            end = payload.find('\n', start + chunk_size)  # Soft line breaks must not be split
+
+            if end < 0:
+                end = payload_len
+            else:
+                end += 1
+
+            yield quopri.decodestring(_payload_to_bytes(payload[start:end]))
+            start = end
+
+
+def get_peak_rss():
+    """Return peak resident set size of current process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == 'darwin':
+        return peak
+    else:
+        return peak * 1024  # kilobytes on Linux
+
+
+def get_rss():
+    """Return current resident set size of current process in bytes"""
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        return get_peak_rss()
+
+
+def get_private_memory():
+    """Return unique set size (USS) of current process in bytes - resident memory, which is not shared with other
+    processes (e.g. pages inherited copy-on-write from the parent process); RSS is returned on systems without
+    /proc/self/smaps_rollup (Linux < 4.14)"""
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as fp:
+            return sum(int(line.split()[1]) for line in fp if line.startswith(('Private_Clean:', 'Private_Dirty:'))
+                       ) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return get_rss()
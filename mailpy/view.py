@@ -10,7 +10,11 @@ class MailView(object):
     Base class for class-based mail views.
 
     Every public method will be a mail view accepting one request parameter.
+    The view is registered in the router under the resource attribute (mail resource, e.g. "blog.blog_admin"),
+    which is required only when several views live in one process (see MailSupervisor).
     """
+    resource = None
+    admission = None  # Admission control (mailpy.contrib.admission) applied by bin/mail.py before reading the message
     _debug = True
     _auto_registration = True
     _decorators_cache = None
@@ -18,7 +22,7 @@ class MailView(object):
 
     def __init__(self):
         """Register mail view and mail methods"""
-        self.router = router.register_view(__name__)
+        self.router = router.register_view(self.resource or __name__)
         self._register_methods()
 
     def _register_methods(self):
@@ -36,6 +40,10 @@ class MailView(object):
                     if method_name or self._auto_registration:
                         self.router.register_method(attr, name=method_name or name)
 
+    def _preload(self):
+        """Load everything needed by requests in advance (called by MailSupervisor before forking workers)"""
+        pass
+
     def _check_sender(self, request, view_fun):
         """Check sender requirements"""
         sender = request.sender
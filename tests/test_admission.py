@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+
+import pytest
+
+from mailpy.contrib.admission import AdmissionControl, TooManyRequests
+
+
+@pytest.fixture
+def admission(tmp_path):
+    admission = AdmissionControl(str(tmp_path / 'admission.json'), sender_limit=None, max_active=1, max_queued=4,
+                                 max_queued_writes=2, queue_timeout=5)
+    admission.doorbell_timeout = 10  # Waiting requests must be woken up by release()
+
+    return admission
+
+
+def _admit_in_thread(admission, method, admitted, hold=0.0):
+    def run():
+        try:
+            ticket = admission.admit('user@example.com', method, 'blog')
+        except TooManyRequests as exc:
+            admitted.append((method, exc))
+            return
+
+        admitted.append((method, time.time()))
+        time.sleep(hold)
+        admission.release(ticket)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+
+    return thread
+
+
+def _wait_for_queued(admission, count):
+    for _ in range(500):
+        if admission.stats()['queued'] == count:
+            return
+
+        time.sleep(0.01)
+
+    raise AssertionError('Requests were not queued')
+
+
+def test_rate_limit(tmp_path):
+    admission = AdmissionControl(str(tmp_path / 'admission.json'), sender_limit=(1, 0.01))
+    admission.release(admission.admit('user@example.com', 'get', 'blog'))
+    admission.release(admission.admit('other@example.com', 'get', 'blog'))
+
+    with pytest.raises(TooManyRequests) as exc_info:
+        admission.admit('user@example.com', 'get', 'blog')
+
+    assert exc_info.value.retry_after == 100
+
+
+def test_release_wakes_up_waiting_request(admission):
+    ticket = admission.admit('user@example.com', 'post', 'blog')
+    assert admission.stats()['active'] == 1
+    admitted = []
+    thread = _admit_in_thread(admission, 'get', admitted)
+    _wait_for_queued(admission, 1)
+
+    released = time.time()
+    admission.release(ticket)
+    thread.join()
+
+    assert admitted[0][1] - released < 1
+    assert admission.stats() == {'active': 0, 'queued': 0, 'buckets': 0}
+
+
+def test_read_requests_go_first(admission):
+    ticket = admission.admit('user@example.com', 'post', 'blog')
+    admitted = []
+    threads = [_admit_in_thread(admission, 'post', admitted, hold=0.05)]
+    _wait_for_queued(admission, 1)
+    threads.append(_admit_in_thread(admission, 'get', admitted, hold=0.05))
+    _wait_for_queued(admission, 2)
+
+    admission.release(ticket)
+
+    for thread in threads:
+        thread.join()
+
+    assert [method for method, _ in admitted] == ['get', 'post']
+
+
+def test_bounded_queue_and_timeout(admission):
+    admission.queue_timeout = 0.3
+    ticket = admission.admit('user@example.com', 'get', 'blog')
+    admitted = []
+    threads = [_admit_in_thread(admission, 'post', admitted) for _ in range(2)]
+    _wait_for_queued(admission, 2)
+
+    with pytest.raises(TooManyRequests) as exc_info:
+        admission.admit('user@example.com', 'post', 'blog')  # Write queue is full
+
+    assert 'Server busy' in str(exc_info.value)
+
+    for thread in threads:
+        thread.join()
+
+    assert [str(exc) for _, exc in admitted] == ['Request was queued for more than 0.3 seconds'] * 2
+    admission.release(ticket)
+
+
+def test_slot_of_dead_process_is_released(admission):
+    pid = os.fork()
+
+    if not pid:
+        admission.admit('user@example.com', 'get', 'blog')
+        os._exit(0)  # Without release()
+
+    os.waitpid(pid, 0)
+    admission.release(admission.admit('user@example.com', 'get', 'blog'))
@@ -0,0 +1,83 @@
+import os
+import io
+
+import pytest
+
+pytest.importorskip('pelican')
+
+from mailpy.contrib.pelican import deploy
+from mailpy.contrib.pelican.api import PelicanAPI
+from mailpy.contrib.pelican.index import file_digest
+
+SETTINGS = """
+PATH = %(path)r + '/content'
+OUTPUT_PATH = %(path)r + '/output'
+CACHE_PATH = %(path)r + '/cache'
+SITEURL = 'http://blog.example.com'
+TIMEZONE = 'UTC'
+FEED_ALL_ATOM = 'feeds/all.atom.xml'
+CATEGORY_FEED_ATOM = None
+TRANSLATION_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+STATIC_PATHS = ['images']
+"""
+
+
+@pytest.fixture
+def papi(tmp_path):
+    os.makedirs(str(tmp_path / 'content' / 'images'))
+    settings_file = str(tmp_path / 'pelicanconf.py')
+
+    with io.open(settings_file, 'w') as fp:
+        fp.write(SETTINGS % {'path': str(tmp_path)})
+
+    with io.open(str(tmp_path / 'content' / 'hello.rst'), 'w') as fp:
+        fp.write(u'Hello\n#####\n\n:date: 2015-01-05\n\nHello world\n')
+
+    with open(str(tmp_path / 'content' / 'images' / 'a.png'), 'wb') as fp:
+        fp.write(os.urandom(100))
+
+    papi = PelicanAPI(settings_file, deploy_path=str(tmp_path / 'www'), settings_cache_dir=False)
+
+    yield papi
+
+    papi.close()
+
+
+def test_build_reports_written_digests(papi):
+    written = papi._build()
+    assert 'feeds/all.atom.xml' in written
+    assert 'images/a.png' in written  # Copied by pelican
+
+    for path, (size, mtime, digest) in written.items():
+        full_path = os.path.join(papi.output_path, path)
+        assert os.path.getsize(full_path) == size
+        assert file_digest(full_path) == digest
+
+
+def test_deploy_hashes_only_files_not_reported_by_build(papi, monkeypatch):
+    hashed = []
+
+    def counting_digest(path):
+        hashed.append(os.path.relpath(path, papi.output_path))
+        return file_digest(path)
+
+    monkeypatch.setattr(deploy, 'file_digest', counting_digest)
+
+    papi.publish()
+    assert hashed == []
+    assert os.path.exists(os.path.join(papi.deployer.deploy_path, 'hello.html'))
+
+    del hashed[:]
+    papi.publish()  # Full rebuild rewrites all output files with the same content
+    assert hashed == []
+
+    written = papi._build()
+
+    with open(os.path.join(papi.output_path, 'hello.html'), 'a') as fp:
+        fp.write('<!-- modified after the build -->')  # E.g. by a plugin
+
+    added, changed, removed = papi.deploy(written=written)
+    assert hashed == ['hello.html']
+    assert (added, changed, removed) == ([], ['hello.html'], [])
@@ -0,0 +1,168 @@
+import os
+import time
+import signal
+import threading
+
+import pytest
+
+from mailpy.contrib.filelock import FileLock, FileLockTimeout, FileLockError
+
+
+def _hold_lock_in_child(lockfile, shared=False, seconds=0.5):
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        lock = FileLock(lockfile, shared=shared)
+        lock.acquire()
+        os.write(w, b'1')
+        time.sleep(seconds)
+        os._exit(0)
+
+    os.close(w)
+    os.read(r, 1)
+    os.close(r)
+
+    return pid
+
+
+def test_acquire_release(tmp_path):
+    lock = FileLock(str(tmp_path / 'lock'))
+    assert not lock
+
+    with lock:
+        assert lock
+        assert lock.exists()
+
+    assert not lock
+
+    with pytest.raises(FileLockError):
+        lock.release()
+
+
+def test_exclusive_lock_timeout(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, seconds=2)
+
+    try:
+        with pytest.raises(FileLockTimeout):
+            FileLock(lockfile).acquire(timeout=0)
+
+        start = time.time()
+
+        with pytest.raises(FileLockTimeout):
+            FileLock(lockfile).acquire(timeout=0.2)
+
+        assert time.time() - start < 1
+    finally:
+        os.waitpid(pid, 0)
+
+
+def test_waiter_wakes_up_after_release(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, seconds=0.3)
+
+    try:
+        start = time.time()
+        FileLock(lockfile).acquire(timeout=5)
+        assert time.time() - start < 1
+    finally:
+        os.waitpid(pid, 0)
+
+
+def test_lock_released_on_process_death(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, seconds=60)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+    with FileLock(lockfile) as lock:
+        assert lock
+
+
+def test_shared_locks(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, shared=True, seconds=1)
+
+    try:
+        with FileLock(lockfile, shared=True) as lock:
+            assert lock
+
+        with pytest.raises(FileLockTimeout):
+            FileLock(lockfile).acquire(timeout=0)
+    finally:
+        os.waitpid(pid, 0)
+
+
+def test_alarm_is_not_clobbered(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, seconds=1)
+    fired = []
+    old_handler = signal.signal(signal.SIGALRM, lambda signum, frame: fired.append(signum))
+    signal.setitimer(signal.ITIMER_REAL, 0.5)
+
+    try:
+        with pytest.raises(FileLockTimeout):
+            FileLock(lockfile).acquire(timeout=0.1)
+
+        assert signal.getitimer(signal.ITIMER_REAL)[0] > 0
+        time.sleep(0.6)
+        assert fired == [signal.SIGALRM]
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+        os.waitpid(pid, 0)
+
+
+def test_acquire_in_thread(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    pid = _hold_lock_in_child(lockfile, seconds=0.3)
+    res = []
+
+    def acquire():
+        lock = FileLock(lockfile)
+        lock.acquire(timeout=5, sleep_interval=0.01)
+        res.append(lock.is_locked())
+        lock.release()
+
+    try:
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join(5)
+    finally:
+        os.waitpid(pid, 0)
+
+    assert res == [True]
+
+
+def test_unlink_while_other_process_waits(tmp_path):
+    lockfile = str(tmp_path / 'lock')
+    lock = FileLock(lockfile)
+    lock.acquire()
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        waiter = FileLock(lockfile)
+        waiter.acquire(timeout=5)
+        # noinspection PyProtectedMember
+        os.write(w, b'1' if waiter._is_current_file() else b'0')
+        time.sleep(0.5)
+        os._exit(0)
+
+    os.close(w)
+    time.sleep(0.2)
+    lock.unlink()
+    assert os.read(r, 1) == b'1'
+    os.close(r)
+
+    try:
+        with pytest.raises(FileLockTimeout):
+            FileLock(lockfile).acquire(timeout=0)
+    finally:
+        os.waitpid(pid, 0)
+
+    with pytest.raises(FileLockError):
+        FileLock(lockfile, shared=True).unlink()
@@ -0,0 +1,140 @@
+import os
+import stat
+import time
+
+import pytest
+
+from mailpy.contrib.filetransaction import FileTransaction, FileTransactionError
+from mailpy.contrib.pelican.content import RstArticle, PelicanContentFile, write_temp_file
+from mailpy.contrib.pelican.exceptions import FileAlreadyExists
+
+
+def _read(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def _temp_files(directory):
+    return [f for f in os.listdir(directory) if f.startswith(FileTransaction.temp_prefix)]
+
+
+def test_commit(tmp_path):
+    a, b = str(tmp_path / 'a.txt'), str(tmp_path / 'sub' / 'b.txt')
+
+    with FileTransaction() as transaction:
+        transaction.add(a, content=b'A')
+        transaction.add(b, content=b'B')
+        assert not os.path.exists(a)
+        assert sorted(transaction.files) == [a, b]
+
+    assert _read(a) == b'A'
+    assert _read(b) == b'B'
+    assert not _temp_files(str(tmp_path))
+
+
+def test_file_mode(tmp_path):
+    fd, path = FileTransaction.mkstemp(str(tmp_path))
+    os.close(fd)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == FileTransaction.file_mode
+    assert FileTransaction.file_mode & stat.S_IRUSR
+
+
+def test_existing_file_is_not_overwritten(tmp_path):
+    a, b = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+
+    with open(b, 'wb') as fp:
+        fp.write(b'old')
+
+    transaction = FileTransaction(fsync=False)
+    transaction.add(a, content=b'A')
+    transaction.add(b, content=b'B')
+
+    with pytest.raises(OSError):
+        transaction.commit()
+
+    assert not os.path.exists(a)
+    assert _read(b) == b'old'
+    assert not _temp_files(str(tmp_path))
+
+
+def test_replace_and_rollback(tmp_path):
+    a, b = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+
+    with open(a, 'wb') as fp:
+        fp.write(b'old')
+
+    with open(b, 'wb') as fp:
+        fp.write(b'old')
+
+    transaction = FileTransaction(fsync=False)
+    transaction.add(a, content=b'new', replace=True)
+    transaction.add(b, content=b'B')  # Fails after a.txt was replaced
+
+    with pytest.raises(OSError):
+        transaction.commit()
+
+    assert _read(a) == b'old'
+    assert _read(b) == b'old'
+    assert not _temp_files(str(tmp_path))
+
+    transaction.add(a, content=b'new', replace=True)
+    assert transaction.commit() == [a]
+    assert _read(a) == b'new'
+    assert not _temp_files(str(tmp_path))
+
+
+def test_add_temp_file(tmp_path):
+    a = str(tmp_path / 'a.txt')
+    fd, temp_file = FileTransaction.mkstemp(str(tmp_path))
+
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(b'A')
+
+    with FileTransaction() as transaction:
+        transaction.add(a, temp_file=temp_file)
+
+    assert _read(a) == b'A'
+    assert not os.path.exists(temp_file)
+
+
+def test_context_manager_rollback(tmp_path):
+    a = str(tmp_path / 'a.txt')
+
+    with pytest.raises(RuntimeError):
+        with FileTransaction() as transaction:
+            transaction.add(a, content=b'A')
+            raise RuntimeError
+
+    assert not os.path.exists(a)
+    assert not _temp_files(str(tmp_path))
+
+    with pytest.raises(FileTransactionError):
+        FileTransaction().commit()
+
+
+def test_cleanup(tmp_path):
+    fd, old = FileTransaction.mkstemp(str(tmp_path / 'sub'))
+    os.close(fd)
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+    fd, new = FileTransaction.mkstemp(str(tmp_path))
+    os.close(fd)
+
+    assert FileTransaction.cleanup(str(tmp_path)) == [old]
+    assert os.path.exists(new)
+
+
+def test_content_file_save(tmp_path):
+    content_path = str(tmp_path)
+    article = RstArticle(content_path, 'a.rst')
+    article.compose(u'Café', u'Text', {})
+    article.save()
+    temp_file, _ = write_temp_file(str(tmp_path / 'images'), [b'GIF89a'])
+    PelicanContentFile(content_path, 'images/b.gif', temp_file=temp_file).save(fsync=False)
+
+    assert _read(str(tmp_path / 'a.rst')).startswith(u'Café\n'.encode('utf-8'))
+    assert _read(str(tmp_path / 'images' / 'b.gif')) == b'GIF89a'
+    assert not _temp_files(content_path)
+
+    with pytest.raises(FileAlreadyExists):
+        article.save()
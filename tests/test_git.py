@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import logging
+import threading
+import subprocess
+
+import pytest
+
+from mailpy.contrib.git import Git, GitCmdError, GitPusher
+
+
+def _run(cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=cwd).decode('ascii').strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    remote = str(tmp_path / 'remote.git')
+    path = str(tmp_path / 'repo')
+    os.makedirs(path)
+    _run(str(tmp_path), 'init', '-q', '--bare', remote)
+    _run(path, 'init', '-q')
+    _run(path, 'config', 'user.name', 'Test')
+    _run(path, 'config', 'user.email', 'test@example.com')
+    _run(path, 'remote', 'add', 'origin', remote)
+
+    return path
+
+
+def _commit(git, name):
+    with open(os.path.join(git.repo, name), 'w') as fp:
+        fp.write(name)
+
+    git.add(name)
+    git.commit('Added %s' % name)
+
+    return git.rev_parse()
+
+
+class CountingGit(Git):
+    pushes = []
+
+    def push(self, remote, *refspecs):
+        self.pushes.append(remote)
+        return super(CountingGit, self).push(remote, *refspecs)
+
+
+def test_commits_are_pushed_in_one_batch(repo, monkeypatch):
+    monkeypatch.setattr(CountingGit, 'pushes', [])
+    pusher = GitPusher(repo, ['origin'], refspecs=('HEAD:refs/heads/master',), delay=0.5, idle_timeout=0.1)
+    pusher.git_class = CountingGit
+    git = Git(repo)
+
+    pusher.push(_commit(git, 'a'))
+    head = _commit(git, 'b')
+    pusher.push(head)
+    pusher.join(10)
+
+    assert CountingGit.pushes == ['origin']  # Coalesced
+    assert _run(os.path.join(os.path.dirname(repo), 'remote.git'), 'rev-parse', 'master') == head
+    assert pusher.failed == {}
+
+
+class RecordingEvent(threading.Event):
+    """Event, which records wait() timeouts and does not sleep"""
+    def __init__(self):
+        super(RecordingEvent, self).__init__()
+        self.timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.is_set()
+
+
+def test_failed_push_is_retried_with_growing_interval(repo, tmp_path):
+    pusher = GitPusher(repo, [str(tmp_path / 'missing.git')], delay=1, retries=3, retry_interval=5, idle_timeout=0.1)
+    pusher._exiting = RecordingEvent()
+    pusher.push(_commit(Git(repo), 'a'))
+    pusher.join(10)
+
+    assert pusher._exiting.timeouts == [1, 5, 10, 15]  # Delay and then pauses between 4 attempts
+    assert isinstance(pusher.failed[str(tmp_path / 'missing.git')], GitCmdError)
+
+
+def test_shutdown_is_bounded_by_exit_timeout(repo, caplog):
+    release = threading.Event()
+
+    class HangingGit(Git):
+        def push(self, remote, *refspecs):
+            release.wait(30)  # Unreachable host
+
+    pusher = GitPusher(repo, ['origin'], delay=0, idle_timeout=0.1, exit_timeout=0.3)
+    pusher.git_class = HangingGit
+    pusher.push('abc')
+
+    try:
+        start = time.time()
+
+        with caplog.at_level(logging.ERROR):
+            pusher._shutdown()  # Registered with atexit
+
+        assert time.time() - start < 2
+        assert 'Giving up push to origin after 0.3 seconds at exit' in caplog.text
+    finally:
+        release.set()
+        pusher.join(10)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from mailpy.contrib.pelican.images import ImageProcessor
+from mailpy.contrib.pelican.exceptions import ImageTooLarge
+
+
+def _write_jpeg(path, size):
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera Maker'  # Make
+    Image.new('RGB', size, (200, 10, 10)).save(path, 'JPEG', exif=exif.tobytes())
+
+    return path
+
+
+def test_process_on_pool(tmp_path):
+    paths = [_write_jpeg(str(tmp_path / ('%d.jpg' % i)), (400, 300)) for i in range(3)]
+    assert Image.open(paths[0]).getexif()
+    processor = ImageProcessor(max_size=(100, 100), thumbnail_size=(20, 20), processes=2)
+
+    try:
+        results = processor.process(paths)
+        # noinspection PyProtectedMember
+        assert processor._pool is not None  # Processed by the pool
+    finally:
+        processor.close()
+
+    assert len(results) == 3
+
+    for path, (size, digest, thumb_path, thumb_size, thumb_digest) in zip(paths, results):
+        img = Image.open(path)
+        assert img.size == (100, 75)  # Downscaled
+        assert not img.getexif()  # Stripped
+        assert size == os.path.getsize(path)
+
+        thumb = Image.open(thumb_path)
+        assert thumb.size == (20, 15)
+        assert not thumb.getexif()
+        assert thumb_size == os.path.getsize(thumb_path)
+        assert digest != thumb_digest
+
+
+def test_decompression_bomb_is_rejected(tmp_path, monkeypatch):
+    path = _write_jpeg(str(tmp_path / 'bomb.jpg'), (400, 300))
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)  # Pillow rejects images with > 2 * MAX_IMAGE_PIXELS pixels
+    processor = ImageProcessor(max_size=(100, 100), processes=1)
+
+    with pytest.raises(ImageTooLarge):
+        processor.process([path])
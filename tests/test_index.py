@@ -0,0 +1,47 @@
+import pytest
+
+from mailpy.contrib.pelican.index import ArticleIndex, parse_date
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2015-1-5', (2015, 1, 5)),
+    ('2015-01-05 9:30', (2015, 1, 5, 9, 30, 0)),
+    ('2015/12/31T23:59:01', (2015, 12, 31, 23, 59, 1)),
+    ('2015-10-19 10:00:00+02:00', (2015, 10, 19, 10, 0, 0)),
+    ('yesterday', None),
+    (None, None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize('field, value, expected', [
+    ('since', '2015-1-5', True),
+    ('since', '2015-01-05T09:31', False),
+    ('until', '2015-1-5', True),  # Whole day
+    ('until', '2015-01-05 09:29', False),
+    ('until', '2015-1-4', False),
+    ('since', 'junk', False),
+])
+def test_match_date(field, value, expected):
+    # noinspection PyProtectedMember
+    assert ArticleIndex._match({'date': '2015-1-5 9:30'}, field, value) is expected
+
+
+def test_query_sort_by_date(tmp_path):
+    index = ArticleIndex(None, str(tmp_path / 'index.json'))
+    index._entries = {
+        'a.rst': {'date': '2015-1-5 9:30'},
+        'b.rst': {'date': '2015-01-10'},
+        'c.rst': {'date': '2015-12-1'},
+        'd.rst': {'date': None},
+        'page.rst': {'date': '2016-01-01', 'page': True},
+    }
+
+    total, items = index.query(sort='date')
+    assert total == 4
+    assert [filename for filename, _ in items] == ['d.rst', 'a.rst', 'b.rst', 'c.rst']
+
+    total, items = index.query(filters=[('since', '2015-1-6')], sort='-date', limit=1)
+    assert total == 2
+    assert [filename for filename, _ in items] == ['c.rst']
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver  # Python 2
+
+import pytest
+
+from mailpy.contrib.filelock import FileLock
+from mailpy.contrib.notify import Notifier
+
+MSG = 'From: blog@example.com\r\nSubject: New article\r\n\r\nHello\r\n'
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server; Recipients starting with "bad" are refused with 550 and recipients starting with "temp"
+    are refused with 451 on their first attempt"""
+    def reply(self, line):
+        self.wfile.write(('%s\r\n' % line).encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        rcpts = []
+        self.reply('220 sink')
+
+        while True:
+            line = self.rfile.readline().decode('ascii').strip()
+            cmd = line[:4].upper()
+
+            if not line or cmd == 'QUIT':
+                self.reply('221 bye')
+                break
+            elif cmd in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif cmd == 'MAIL':
+                rcpts = []
+                self.reply('250 OK')
+            elif cmd == 'RCPT':
+                rcpt = line.split(':', 1)[1].strip().strip('<>')
+
+                with server.lock:
+                    attempts = server.attempts[rcpt] = server.attempts.get(rcpt, 0) + 1
+
+                if rcpt.startswith('bad'):
+                    self.reply('550 No such user')
+                elif rcpt.startswith('temp') and attempts == 1:
+                    self.reply('451 Try again later')
+                else:
+                    rcpts.append(rcpt)
+                    self.reply('250 OK')
+            elif cmd == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+
+                with server.lock:
+                    server.transactions.append(rcpts)
+
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')  # RSET, NOOP
+
+
+class SMTPSink(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.attempts = {}
+        self.transactions = []
+
+    @property
+    def delivered(self):
+        return sorted(rcpt for rcpts in self.transactions for rcpt in rcpts)
+
+
+@pytest.fixture
+def sink():
+    server = SMTPSink()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def notifier(sink, tmp_path):
+    return Notifier(str(tmp_path / 'progress'), port=sink.server_address[1], sessions=2, batch_size=2, timeout=5)
+
+
+def test_batches_by_domain(notifier, sink):
+    recipients = ['a%d@one.example.com' % i for i in range(5)] + ['b@two.example.com', 'c@three.example.com']
+    res = notifier.notify('job', 'blog@example.com', recipients, MSG)
+
+    assert (res.delivered, res.failed, res.skipped) == (7, {}, 0)
+    assert sink.delivered == sorted(recipients)
+    assert sorted(len(rcpts) for rcpts in sink.transactions) == [1, 1, 1, 2, 2]
+    assert all(len(set(rcpt.split('@')[1] for rcpt in rcpts)) == 1 for rcpts in sink.transactions)
+    assert sink.connections <= 2  # Connections are reused
+    assert notifier.get_pending_jobs() == []
+    assert os.listdir(notifier.progress_dir) == []
+
+
+def test_temporary_and_permanent_errors(notifier, sink):
+    res = notifier.notify('job', 'blog@example.com', ['temp@example.com', 'bad@example.com', 'ok@example.com'], MSG)
+
+    assert res.delivered == 2
+    assert list(res.failed) == ['bad@example.com']
+    assert res.failed['bad@example.com'].startswith('550')
+    assert sink.attempts['temp@example.com'] == 2  # Retried
+    assert sink.delivered == ['ok@example.com', 'temp@example.com']
+
+
+def test_unexpected_error_keeps_job(notifier, sink, monkeypatch):
+    def send_batch(smtp, sender, batch, msg):
+        raise ValueError('boom')
+
+    monkeypatch.setattr(notifier, '_send_batch', send_batch)
+    res = notifier.notify('job', 'blog@example.com', ['a@example.com'], MSG)
+    assert 'boom' in res.failed['a@example.com']  # Recorded, not silently dropped
+
+    def record_nothing(batches, sender, msg, record):
+        pass  # Worker thread died without recording a result
+
+    monkeypatch.setattr(notifier, '_worker', record_nothing)
+    notifier.notify('job2', 'blog@example.com', ['a@example.com'], MSG)
+    assert notifier.get_pending_jobs() == ['job2']
+
+
+def test_resume(notifier, sink):
+    notifier.notify('job', 'blog@example.com', ['a@example.com'], MSG)  # Finished job is not resumed
+    recipients = ['a@example.com', 'b@example.com', 'c@example.com']
+    # noinspection PyProtectedMember
+    notifier._save_job('crashed', 'blog@example.com', recipients, MSG)
+
+    with open(os.path.join(notifier.progress_dir, 'crashed.progress'), 'w') as fp:
+        fp.write('["a@example.com", null]\n["b@exa')  # Crashed while writing
+
+    res = notifier.resume()
+    assert list(res) == ['crashed']
+    assert (res['crashed'].delivered, res['crashed'].skipped) == (2, 1)
+    assert sink.delivered == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert notifier.get_pending_jobs() == []
+
+
+def test_resume_skips_locked_job(notifier, sink):
+    # noinspection PyProtectedMember
+    notifier._save_job('live', 'blog@example.com', ['a@example.com'], MSG)
+
+    with FileLock(os.path.join(notifier.progress_dir, 'live.lock')):  # Being delivered by another process
+        assert notifier.resume() == {}
+
+    assert sink.delivered == []
+    assert list(notifier.resume()) == ['live']
+
+
+def test_submit(notifier, sink):
+    thread = notifier.submit('job', 'blog@example.com', ['a@example.com', 'b@example.com'], MSG)
+    assert notifier.resume() == {}  # Locked until the delivery is finished
+    thread.join()
+
+    assert sink.delivered == ['a@example.com', 'b@example.com']
+    assert notifier.get_pending_jobs() == []
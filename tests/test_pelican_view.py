@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import os
+import io
+from email.mime.text import MIMEText
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+
+import pytest
+
+pytest.importorskip('pelican')
+
+from mailpy.router import router
+from mailpy.utils import parse_message
+from mailpy.contrib.pelican.view import PelicanMailView
+
+SETTINGS = """
+PATH = %(path)r + '/content'
+OUTPUT_PATH = %(path)r + '/output'
+CACHE_PATH = %(path)r + '/cache'
+SITEURL = 'http://blog.example.com'
+TIMEZONE = 'UTC'
+FEED_ALL_ATOM = 'feeds/all.atom.xml'
+CATEGORY_FEED_ATOM = None
+TRANSLATION_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+FILENAME_METADATA = r'(?P<date>\\d{4}-\\d{2}-\\d{2})-(?P<slug>.*)'
+"""
+
+
+@pytest.fixture
+def view(tmp_path):
+    os.makedirs(str(tmp_path / 'content'))
+    settings_file = str(tmp_path / 'pelicanconf.py')
+
+    with io.open(settings_file, 'w') as fp:
+        fp.write(SETTINGS % {'path': str(tmp_path)})
+
+    class Blog(PelicanMailView):
+        resource = 'test_blog'
+        papi_settings = (('settings_cache_dir', False),)
+        authors = (('Jane Doe', ('jane@example.com',)),)
+
+    Blog.settings_file = settings_file
+    blog = Blog()
+    builds = blog.builds = []
+    publish = blog.papi.publish
+
+    def record_publish(articles=None):
+        builds.append(articles)
+        return publish(articles=articles)
+
+    blog.papi.publish = record_publish
+
+    yield blog
+
+    blog.papi.close()
+    router.clear()
+
+
+def request(view, method, subject, body='', msg=None):
+    if msg is None:
+        msg = MIMEText(body, _charset='utf-8')
+
+    msg['Subject'] = subject
+    msg['From'] = 'user@example.com'
+    msg['Message-Id'] = '<%s@example.com>' % os.urandom(4).hex()
+    req = parse_message(msg.as_string().splitlines(True), 'user@example.com', '%s@blog.example.com' % method)
+
+    return view.router.dispatch_request(req)
+
+
+def read_output(view, path):
+    with io.open(os.path.join(view.papi.output_path, path), encoding='utf-8') as fp:
+        return fp.read()
+
+
+def test_update_body_only_rewrites_feed(view):
+    res = request(view, 'post', 'Hello World', ':summary: Always the same\n:tags: news\n\nfirst version')
+    assert res.status_code == 200
+    assert 'first version' in read_output(view, 'feeds/all.atom.xml')
+
+    res = request(view, 'update', 'Hello World', 'second version')
+    assert res.status_code == 200
+    article = view.papi.get_article_by_slug('hello-world')
+    article.load()
+    assert [a.filename for a in view.builds[-1]] == [article.filename]  # Targeted build
+
+    feed = read_output(view, 'feeds/all.atom.xml')
+    assert 'second version' in feed
+    assert 'first version' not in feed
+    assert 'second version' in read_output(view, view.papi.read_article(article).save_as)
+
+
+def test_update_summary_triggers_full_rebuild(view):
+    request(view, 'post', 'Hello World', 'first version')
+    assert 'first version' in read_output(view, 'index.html')
+
+    res = request(view, 'update', 'Hello World', 'second version')
+    assert res.status_code == 200
+    assert view.builds[-1] is None  # Full rebuild
+    assert 'second version' in read_output(view, 'index.html')
+    assert 'second version' in read_output(view, 'feeds/all.atom.xml')
+
+
+def _article_message(title, text, sender):
+    msg = MIMEText(text, _charset='utf-8')
+    msg['Subject'] = title
+    msg['From'] = sender
+
+    return MIMEMessage(msg)
+
+
+def test_bulk_post_nested_messages(view):
+    inner = MIMEMultipart()
+    inner.attach(_article_message('Second', 'two', 'Jane <jane@example.com>'))
+    inner.attach(_article_message('Third', 'three', 'mallory@example.com'))
+    outer = MIMEMultipart()
+    outer.attach(_article_message('First', 'one', 'user@example.com'))
+    outer.attach(inner)
+
+    res = request(view, 'bulk_post', '', msg=outer)
+    assert res.status_code == 200
+    report = res.message.get_payload(decode=True).decode('utf-8')
+    assert 'Created 3 of 3 articles' in report
+    assert [line.split(':')[0] for line in report.splitlines() if line.startswith('OK')] == [
+        'OK message 1', 'OK message 2', 'OK message 3']
+
+    authors = {}
+
+    for slug in ('first', 'second', 'third'):
+        article = view.papi.get_article_by_slug(slug)
+        authors[slug] = article.get_text_metadata(article.load())[1]['authors']
+
+    assert authors == {'first': 'user@example.com', 'second': 'Jane Doe', 'third': 'user@example.com'}
+
+
+def test_bulk_post_limit_counts_nested_messages(view):
+    view.bulk_max_articles = 2
+    inner = MIMEMultipart()
+    inner.attach(_article_message('Second', 'two', 'user@example.com'))
+    inner.attach(_article_message('Third', 'three', 'user@example.com'))
+    outer = MIMEMultipart()
+    outer.attach(_article_message('First', 'one', 'user@example.com'))
+    outer.attach(inner)
+
+    assert request(view, 'bulk_post', '', msg=outer).status_code == 413
+
+
+def _write_content(view, filename, content):
+    path = os.path.join(view.papi.content_path, filename)
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with io.open(path, 'w', encoding='utf-8') as fp:
+        fp.write(content)
+
+    return path
+
+
+def test_gc_removes_orphaned_static_files(view):
+    old = _write_content(view, 'files/old.txt', u'old')  # Orphaned before the index was created
+    assert view.papi.article_index.get_orphans() == ['files/old.txt']
+
+    linked = _write_content(view, 'files/linked.txt', u'linked')
+    article = _write_content(view, '2015-01-05-links.rst', u'Links\n#####\n\n`x <{static}/files/linked.txt>`_\n')
+    view.papi.article_index.refresh()
+    assert view.papi.article_index.get_orphans() == ['files/old.txt']
+
+    os.remove(article)
+    view.papi.article_index.refresh()
+    assert view.papi.article_index.get_orphans() == ['files/linked.txt', 'files/old.txt']
+
+    view.papi.get_static_files = None  # Static directories must not be scanned
+    res = request(view, 'gc', '')
+    assert res.status_code == 200
+    assert 'Removed 2 orphaned static files' in res.message.get_payload(decode=True).decode('utf-8')
+    assert not os.path.exists(old)
+    assert not os.path.exists(linked)
+    assert view.builds == [None]
+    assert view.papi.article_index.get_orphans() == []
+
+
+def test_conditional_get_checks_only_requested_article(view, monkeypatch):
+    request(view, 'post', 'Hello World', 'first version')
+    request(view, 'post', 'Other', 'other article')
+    article = view.papi.get_article_by_slug('hello-world')
+    res = request(view, 'get', article.filename)
+    assert res.status_code == 200
+    assert res.etag
+
+    def get_conditional():
+        msg = MIMEText('')
+        msg['X-mailpy-if-none-match'] = '"%s"' % res.etag
+        return request(view, 'get', article.filename, msg=msg)
+
+    monkeypatch.setattr(view.papi, 'get_articles', None)  # No refresh of the whole index
+    assert get_conditional().status_code == 304
+
+    _write_content(view, article.filename, article.load().replace('first version', 'second version'))
+    res2 = get_conditional()
+    assert res2.status_code == 200
+    assert res2.etag != res.etag
+
+
+def test_class_attributes_are_not_mail_methods(view):
+    assert 'file_transaction_class' not in view.router
+    assert 'image_processor_class' not in view.router
+
+
+def test_post_rejects_decompression_bomb(view, monkeypatch):
+    from email.mime.image import MIMEImage
+    Image = pytest.importorskip('PIL.Image')
+    from mailpy.contrib.pelican.images import ImageProcessor
+
+    buf = io.BytesIO()
+    Image.new('RGB', (400, 300)).save(buf, 'PNG')
+    msg = MIMEMultipart()
+    msg.attach(MIMEText('Look', _charset='utf-8'))
+    image = MIMEImage(buf.getvalue(), 'png')
+    image.add_header('Content-Disposition', 'attachment', filename='bomb.png')
+    msg.attach(image)
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    view.image_processor = ImageProcessor(max_size=(100, 100), processes=1)
+
+    res = request(view, 'post', 'Bomb', msg=msg)
+    assert res.status_code == 413
+    assert os.listdir(os.path.join(view.papi.content_path, 'images')) == []  # Temporary file was removed
+
+
+def test_update_resolves_static_links_without_warnings(view, caplog):
+    _write_content(view, 'images/a.png', u'png')
+    text = u'.. image:: {static}/images/a.png\n    :alt: A\n\n%s'
+    request(view, 'post', 'Hello World', text % 'Summary paragraph.')
+    article = view.papi.get_article_by_slug('hello-world')
+    article.load()
+
+    assert '/images/a.png' in view.papi.read_article(article, saved=True).summary
+
+    caplog.clear()
+    res = request(view, 'update', article.filename, text % 'Summary paragraph.\n\nNew paragraph.')
+    assert res.status_code == 200
+    assert not [r for r in caplog.records if r.levelname == 'WARNING']
+
+
+def test_search_syncs_index_only_when_empty_and_from_gc(view, monkeypatch):
+    _write_content(view, '2015-01-05-old.rst', u'Old\n###\n\nWritten before the index existed\n')
+    res = request(view, 'search', 'written')
+    assert 'Found 1 articles' in res.message.get_payload(decode=True).decode('utf-8')  # New index is synced
+
+    request(view, 'post', 'Hello World', 'posted by mail')
+    _write_content(view, '2015-01-06-pulled.rst', u'Pulled\n######\n\nChanged outside of mailpy\n')
+    syncs = []
+    sync = view.papi.search_index.sync
+    monkeypatch.setattr(view.papi.search_index, 'sync', lambda: syncs.append(1) or sync())
+
+    assert 'Found 1 articles' in request(view, 'search', 'posted').message.get_payload(decode=True).decode('utf-8')
+    assert 'Found 0 articles' in request(view, 'search', 'outside').message.get_payload(decode=True).decode('utf-8')
+    assert syncs == []  # No directory walk per query
+
+    request(view, 'gc', '')
+    assert syncs == [1]
+    assert 'Found 1 articles' in request(view, 'search', 'outside').message.get_payload(decode=True).decode('utf-8')
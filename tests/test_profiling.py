@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import os
+import inspect
+import logging
+
+import pytest
+
+from mailpy import profiling
+from mailpy.view import MailView
+from mailpy.utils import parse_message_bytes
+from mailpy.router import router
+from mailpy.response import TextMailResponse
+from mailpy.profiling import RequestProfiler, get_profiler, set_profiler
+
+RAW = (b'From: user@example.com\n'
+       b'Subject: Hello\n'
+       b'Message-Id: <1@example.com>\n'
+       b'\n'
+       b'Hello\n')
+
+
+class Hello(MailView):
+    """
+    Record the modules of the call stack.
+    """
+    resource = 'test_profile'
+    stack = None
+
+    def hello(self, request):
+        self.stack = [frame[0].f_globals.get('__name__') for frame in inspect.stack()]
+        return TextMailResponse(request, 'Hello')
+
+
+@pytest.fixture
+def view():
+    yield Hello()
+    router.clear()
+    set_profiler(None)
+
+
+def _request(recipient='hello@test_profile'):
+    return parse_message_bytes(RAW, 'user@example.com', recipient)
+
+
+@pytest.mark.parametrize('environ, expected', [
+    ({}, None),
+    ({'MAILPY_PROFILE': '0'}, None),
+    ({'MAILPY_PROFILE': 'cpu'}, (True, False, 1.0, 100)),
+    ({'MAILPY_PROFILE': 'all'}, (True, True, 1.0, 100)),
+    ({'MAILPY_PROFILE': ' Memory, ', 'MAILPY_PROFILE_RATE': '0.25', 'MAILPY_PROFILE_MAX_FILES': '3'},
+     (False, True, 0.25, 3)),
+])
+def test_from_env(environ, expected):
+    prof = RequestProfiler.from_env(environ)
+
+    if expected is None:
+        assert prof is None
+    else:
+        assert (prof.cpu, prof.memory, prof.sample_rate, prof.max_files) == expected
+
+
+def test_from_env_invalid_rate(monkeypatch, caplog):
+    with pytest.raises(ValueError):
+        RequestProfiler.from_env({'MAILPY_PROFILE': 'cpu', 'MAILPY_PROFILE_RATE': '1%'})
+
+    monkeypatch.setenv('MAILPY_PROFILE', 'cpu')
+    monkeypatch.setenv('MAILPY_PROFILE_RATE', '1%')
+
+    try:
+        with caplog.at_level(logging.ERROR):
+            # noinspection PyCompatibility
+            from importlib import reload
+            reload(profiling)  # Profiler is created on import
+    finally:
+        set_profiler(None)
+
+    assert get_profiler() is None
+    assert 'Invalid MAILPY_PROFILE settings' in caplog.text
+
+
+def test_sampling_is_decided_once_per_request(monkeypatch):
+    prof = RequestProfiler(sample_rate=0.5)
+    numbers = iter([0.1, 0.9])
+    monkeypatch.setattr(profiling.random, 'random', lambda: next(numbers))
+    req1, req2 = _request(), _request()
+
+    assert [prof.is_sampled(req1), prof.is_sampled(req1)] == [True, True]
+    assert [prof.is_sampled(req2), prof.is_sampled(req2)] == [False, False]
+
+
+def test_dispatch_and_send_are_profiled(view, tmp_path):
+    set_profiler(RequestProfiler(str(tmp_path), cpu=True, memory=True))
+    response = view.router.dispatch_request(_request())
+    response.send(lambda sender, recipients, message: None)
+
+    assert 'mailpy.profiling' in view.stack
+    assert sorted(f.split('-', 2)[2] for f in os.listdir(str(tmp_path))) == [
+        'test_profile-hello-1@example.com-dispatch.prof',
+        'test_profile-hello-1@example.com-dispatch.snapshot',
+        'test_profile-hello-1@example.com-send.prof',
+        'test_profile-hello-1@example.com-send.snapshot',
+    ]
+
+
+def test_oldest_files_are_removed(tmp_path):
+    prof = RequestProfiler(str(tmp_path), max_files=2)
+
+    for i in range(4):
+        prof.run(_request(), 'stage%d' % i, lambda: None)
+
+    assert sorted(f.rsplit('-', 1)[1] for f in os.listdir(str(tmp_path))) == ['stage2.prof', 'stage3.prof']
+
+
+def test_dispatch_is_not_wrapped_without_profiler(view, monkeypatch):
+    def is_sampled(*args):
+        raise AssertionError('Profiler must not be used')
+
+    monkeypatch.setattr(RequestProfiler, 'is_sampled', is_sampled)
+    set_profiler(None)
+    response = view.router.dispatch_request(_request())
+
+    assert response.status_code == 200
+    assert 'mailpy.profiling' not in view.stack
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from mailpy.utils import parse_message, parse_message_bytes
+from mailpy.request import MailEnvelope, _get_header_block
+
+RAW = (b'From: user@example.com\n'
+       b'Subject: =?utf-8?q?Caf=C3=A9?=\n'
+       b'Message-Id: <1@example.com>\n'
+       b'Content-Type: text/plain; charset=latin-1\n'
+       b'Content-Transfer-Encoding: 8bit\n'
+       b'\n'
+       b'caf\xe9\n')
+
+
+def test_envelope_headers():
+    envelope = MailEnvelope('user@example.com', 'get@blog.example.com', memoryview(RAW))
+
+    assert envelope.subject == u'Café'
+    assert envelope.message_id == '<1@example.com>'
+    assert (envelope.method, envelope.resource) == ('get', 'com.example.blog')
+    assert envelope.request.get_payload(decode=True) == b'caf\xe9\n'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 8192])
+def test_header_block_does_not_copy_body(chunk_size):
+    raw = memoryview(RAW + b'x' * 100000)
+    header = _get_header_block(raw, chunk_size=chunk_size)
+
+    assert RAW.split(b'\n\n')[0] in header
+    assert len(header) <= RAW.index(b'\n\n') + 2 + chunk_size
+
+
+def test_from_request_keeps_8bit_bytes():
+    request = parse_message_bytes(RAW, 'user@example.com', 'get@blog.example.com')
+    envelope = MailEnvelope.from_request(request)
+
+    assert b'caf\xe9' in bytes(envelope.raw)
+    assert envelope.subject == u'Café'
+    assert envelope.request.get_payload(decode=True) == b'caf\xe9\n'
+
+
+def test_from_request_parsed_from_text():
+    text = u'Subject: Café\nContent-Type: text/plain; charset=utf-8\n\nžltý kôň\n'
+    request = parse_message(text.splitlines(True), 'user@example.com', 'get@blog.example.com')
+    envelope = MailEnvelope.from_request(request)
+
+    assert envelope.request.get_payload(decode=True).decode('utf-8') == u'žltý kôň\n'
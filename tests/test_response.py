@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import io
+import gzip
+import zipfile
+
+import pytest
+
+from mailpy.utils import parse_message_bytes
+from mailpy.response import TextMailResponse, create_text_part, split_text
+
+RAW = (b'From: user@example.com\n'
+       b'Subject: Hello\n'
+       b'Message-Id: <1@example.com>\n'
+       b'\n'
+       b'Hello\n')
+
+TEXT = u'Příliš žluťoučký kůň úpěl ďábelské ódy.\n' * 20  # Multibyte text
+
+
+@pytest.fixture
+def request_():
+    return parse_message_bytes(RAW, 'user@example.com', 'get@blog.example.com')
+
+
+def _response_class(**attrs):
+    return type('Response', (TextMailResponse,), attrs)
+
+
+@pytest.mark.parametrize('large_response', ['gzip', 'zip'])
+def test_large_response_is_compressed(request_, large_response):
+    response = _response_class(max_inline_size=100, large_response=large_response)(request_, TEXT)
+    text, attachment = response.message.get_payload()
+    data = attachment.get_payload(decode=True)
+
+    if large_response == 'zip':
+        assert attachment.get_filename() == 'get.txt.zip'
+        assert zipfile.ZipFile(io.BytesIO(data)).read('get.txt') == TEXT.encode('utf-8')
+    else:
+        assert attachment.get_filename() == 'get.txt.gz'
+        assert gzip.GzipFile(fileobj=io.BytesIO(data)).read() == TEXT.encode('utf-8')
+
+    assert attachment.get_content_type() == 'application/' + large_response
+    assert 'get.txt.' in text.get_payload(decode=True).decode('ascii')
+    assert response.followups == []
+
+
+def test_small_response_is_not_compressed(request_):
+    response = _response_class(max_inline_size=10000)(request_, TEXT)
+
+    assert response.message.get_payload(decode=True).decode('utf-8') == TEXT
+    assert 'X-mailpy-part' not in response.message
+
+
+def test_large_response_is_split(request_):
+    response = _response_class(max_inline_size=100, large_response='split')(request_, TEXT)
+    messages = [response.message] + response.followups
+    total = len(messages)
+    main_id = response.message['Message-Id']
+
+    assert total > 2
+    assert main_id
+    assert ''.join(i.get_payload(decode=True).decode('utf-8') for i in messages) == TEXT
+
+    for n, message in enumerate(messages, 1):
+        assert len(message.get_payload(decode=True)) <= 100
+        assert message['X-mailpy-part'] == '%d/%d' % (n, total)
+        assert message['Subject'] == 'Re: Hello (%d/%d)' % (n, total)
+        assert message['X-mailpy-method'] == 'get'
+
+        if n == 1:
+            assert message['In-Reply-To'] == '<1@example.com>'
+        else:
+            assert message['In-Reply-To'] == main_id
+            assert message['References'] == '<1@example.com> %s' % main_id
+            assert message['Message-Id'] not in (main_id, '<1@example.com>')
+
+
+def test_split_response_is_sent_in_order(request_):
+    response = _response_class(max_inline_size=100, large_response='split')(request_, TEXT)
+    sent = []
+    response.send(lambda sender, recipients, message: sent.append(message))
+
+    assert len(sent) == len(response.followups) + 1
+    assert 'X-mailpy-part: 1/' in sent[0]
+    assert 'X-mailpy-part: 2/' in sent[1]
+
+
+@pytest.mark.parametrize('max_size', [1, 2, 3, 7, 40, 1000])
+def test_split_text_chunk_size(max_size):
+    text = u'ab\n' + u'ž' * 50 + u'\n\n' + u'€x' * 30
+    chunks = split_text(text, max_size)
+
+    assert ''.join(chunks) == text
+    assert all(len(chunk.encode('utf-8')) <= max(max_size, 3) for chunk in chunks)  # "€" is 3 bytes
+    assert all(chunks)
+
+
+def test_split_text_on_line_boundaries():
+    assert split_text(u'aaa\nbbb\nccc\n', 8) == [u'aaa\nbbb\n', u'ccc\n']
+    assert split_text(u'', 8) == [u'']
+
+
+@pytest.mark.parametrize('text, encoding', [
+    (u'Hello\nworld\n', '7bit'),
+    (u'x' * 1000 + u'\n', 'quoted-printable'),  # Too long line for 7bit
+    (u'Hello wörld\n' * 10, 'quoted-printable'),
+    (u'ěščřžýáíé\n' * 10, 'base64'),
+])
+def test_create_text_part_encoding(text, encoding):
+    part = create_text_part(text)
+
+    assert part['Content-Transfer-Encoding'] == encoding
+    assert part.get_payload(decode=True).decode('utf-8') == text
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pytest
+
+from mailpy.contrib.pelican.content import RstArticle
+from mailpy.contrib.pelican.index import SearchIndex, SearchQueryError, SearchNotAvailable
+
+
+class Site(object):
+    def __init__(self, content_path):
+        self.content_path = content_path
+
+    def get_articles(self):
+        return [RstArticle(self.content_path, f) for f in sorted(os.listdir(self.content_path)) if f.endswith('.rst')]
+
+
+def _write(site, filename, title, text, **metadata):
+    article = RstArticle(site.content_path, filename)
+    article.compose(title, text, metadata)
+    article.save()
+
+    return article
+
+
+@pytest.fixture
+def site(tmp_path):
+    content_path = tmp_path / 'content'
+    content_path.mkdir()
+
+    return Site(str(content_path))
+
+
+@pytest.fixture
+def index(site, tmp_path):
+    index = SearchIndex(site, str(tmp_path / 'index' / 'search.sqlite'))
+
+    try:
+        # noinspection PyStatementEffect
+        index.db
+    except SearchNotAvailable:
+        pytest.skip('SQLite without FTS5')
+
+    yield index
+    index.close()
+
+
+def test_search(site, index):
+    _write(site, 'a.rst', 'Python tips', u'Use generators for large files. Čaj a káva.', tags='python, io')
+    _write(site, 'b.rst', 'Cooking', 'Generators are not used in the kitchen.')
+    assert index.sync() == (['a.rst', 'b.rst'], [])
+
+    total, results = index.search('python')
+    assert total == 1
+    assert results[0][:2] == ('a.rst', 'Python tips')
+
+    total, results = index.search('generators')
+    assert total == 2
+
+    assert index.search('kava')[0] == 1  # Diacritics are removed
+    assert index.search('"large files"')[0] == 1
+    assert index.search('"files large"')[0] == 0
+
+
+def test_sync_changes(site, index):
+    a = _write(site, 'a.rst', 'First', 'alpha')
+    _write(site, 'b.rst', 'Second', 'beta')
+    index.sync()
+    assert index.sync() == ([], [])
+
+    os.remove(a.full_path)
+    a = _write(site, 'a.rst', 'First', 'gamma')
+    st = os.stat(a.full_path)
+    os.utime(a.full_path, (st.st_atime, st.st_mtime + 10))
+    os.remove(os.path.join(site.content_path, 'b.rst'))
+
+    assert index.sync() == (['a.rst'], ['b.rst'])
+    assert index.search('alpha')[0] == 0
+    assert index.search('gamma')[0] == 1
+    assert index.search('beta')[0] == 0
+
+
+def test_update_remove(site, index):
+    a = _write(site, 'a.rst', 'First', 'alpha')
+    index.update(a)
+    assert index.search('alpha')[0] == 1
+
+    index.remove('a.rst')
+    assert index.search('alpha')[0] == 0
+    assert index.is_empty()
+
+
+def test_invalid_query(index):
+    with pytest.raises(SearchQueryError):
+        index.search('"unterminated')
+
+
+def test_fts5_not_available(site, tmp_path, monkeypatch):
+    class Connection(object):
+        def __init__(self, *args, **kwargs):
+            self.closed = False
+
+        def execute(self, sql, *args):
+            if 'fts5' in sql:
+                raise sqlite3.OperationalError('no such module: fts5')
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(sqlite3, 'connect', Connection)
+    index = SearchIndex(site, str(tmp_path / 'search.sqlite'))
+
+    with pytest.raises(SearchNotAvailable):
+        # noinspection PyStatementEffect
+        index.db
@@ -0,0 +1,51 @@
+import io
+import sys
+
+import pytest
+
+pytest.importorskip('pelican')
+
+from mailpy.contrib.pelican import settings as settings_module
+from mailpy.contrib.pelican.settings import SettingsCache
+
+BASE_SETTINGS = """
+PATH = %(path)r + '/content'
+OUTPUT_PATH = %(path)r + '/output'
+CACHE_PATH = %(path)r + '/cache'
+SITEURL = %(url)r
+"""
+
+
+def _write(path, content):
+    with io.open(str(path), 'w') as fp:
+        fp.write(content)
+
+
+def test_snapshot_tracks_imported_modules(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'content').mkdir()
+    base = tmp_path / 'mailpy_test_pelicanconf.py'
+    settings_file = str(tmp_path / 'publishconf.py')
+    _write(base, BASE_SETTINGS % {'path': str(tmp_path), 'url': 'http://old.example.com'})
+    _write(settings_file, u'from mailpy_test_pelicanconf import *\nRELATIVE_URLS = False\n')
+    reads = []
+    read_settings_with_imports = settings_module.read_settings_with_imports
+
+    def counting_read(*args):
+        sys.modules.pop('mailpy_test_pelicanconf', None)  # Every read is done by a new process
+        reads.append(args)
+        return read_settings_with_imports(*args)
+
+    monkeypatch.setattr(settings_module, 'read_settings_with_imports', counting_read)
+    cache = SettingsCache(cache_dir=str(tmp_path / 'snapshots'))
+
+    try:
+        assert cache.read_settings(settings_file)['SITEURL'] == 'http://old.example.com'
+        assert cache.read_settings(settings_file)['SITEURL'] == 'http://old.example.com'
+        assert len(reads) == 1
+
+        _write(base, BASE_SETTINGS % {'path': str(tmp_path), 'url': 'http://new.example.com'})
+        assert cache.read_settings(settings_file)['SITEURL'] == 'http://new.example.com'
+        assert len(reads) == 2
+    finally:
+        sys.modules.pop('mailpy_test_pelicanconf', None)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import os
+import io
+import time
+import pickle
+import signal
+import socket
+
+import pytest
+
+from mailpy.view import MailView
+from mailpy.request import MailEnvelope
+from mailpy.response import MailResponse, TextMailResponse
+# noinspection PyProtectedMember
+from mailpy.supervisor import (MailSupervisor, SupervisorError, SupervisorUnavailable, send_envelope, _header,
+                               _send_envelope, _recv_envelope, _recv_msg)
+
+RAW = b'From: user@example.com\nSubject: Hello\nContent-Type: text/plain; charset=latin-1\n\ncaf\xe9\n'
+
+
+class Echo(MailView):
+    """
+    Save the request body to output_file.
+    """
+    output_file = None
+
+    def echo(self, request):
+        with open(self.output_file, 'wb') as fp:
+            fp.write(request.get_payload(decode=True))
+
+        return TextMailResponse(request, 'OK')
+
+
+def test_envelope_framing():
+    sock1, sock2 = socket.socketpair()
+    envelope = MailEnvelope('user@example.com', 'echo@echo.example.com', memoryview(RAW))
+
+    try:
+        _send_envelope(sock1, envelope)
+        received = _recv_envelope(sock2)
+    finally:
+        sock1.close()
+        sock2.close()
+
+    assert (received.sender, received.recipient, received.subject) == ('user@example.com', 'echo@echo.example.com',
+                                                                       'Hello')
+    assert received.raw == RAW
+
+
+def test_pickle_is_not_loaded():
+    sock1, sock2 = socket.socketpair()
+    data = pickle.dumps(MailEnvelope('user@example.com', 'echo@echo.example.com', RAW))
+
+    try:
+        sock1.sendall(_header.pack(len(data), 0) + data)
+
+        with pytest.raises(SupervisorError):
+            _recv_msg(sock2)
+    finally:
+        sock1.close()
+        sock2.close()
+
+
+def test_stale_socket_is_unavailable(tmp_path):
+    socket_path = str(tmp_path / 'stale.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    sock.close()  # Socket file left behind by a killed supervisor
+
+    with pytest.raises(SupervisorUnavailable):
+        send_envelope(socket_path, MailEnvelope('user@example.com', 'echo@echo.example.com', RAW))
+
+
+def _run_supervisor(views, socket_path, **kwargs):
+    """Run MailSupervisor in a forked process and return its pid once the socket exists"""
+    pid = os.fork()
+
+    if pid == 0:
+        code = 0
+
+        try:
+            MailSupervisor(views, socket_path, report_interval=0, **kwargs).run()
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+
+    deadline = time.time() + 10
+
+    while not os.path.exists(socket_path) and time.time() < deadline:
+        time.sleep(0.01)
+
+    return pid
+
+
+def _stop_supervisor(pid):
+    os.kill(pid, signal.SIGTERM)
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+@pytest.fixture
+def supervisor(tmp_path, monkeypatch):
+    monkeypatch.setattr(MailResponse, 'send', lambda self: None)
+    monkeypatch.setattr(Echo, 'output_file', str(tmp_path / 'output'))
+    socket_path = str(tmp_path / 'supervisor.sock')
+    pid = _run_supervisor([('com.example.echo', Echo)], socket_path, workers=1)
+
+    yield socket_path
+
+    _stop_supervisor(pid)
+
+
+def test_dispatch(supervisor):
+    reply = send_envelope(supervisor, MailEnvelope('user@example.com', 'echo@echo.example.com', RAW))
+
+    assert (reply['status'], reply['error'], reply['unknown_resource']) == (200, None, False)
+
+    with open(Echo.output_file, 'rb') as fp:
+        assert fp.read() == b'caf\xe9\n'  # 8-bit bytes are passed as they are
+
+
+def test_unknown_resource(supervisor):
+    reply = send_envelope(supervisor, MailEnvelope('user@example.com', 'echo@other.example.com', RAW))
+
+    assert reply['unknown_resource'] is True
+    assert 'Unknown resource' in reply['error']
+
+
+PELICAN_SETTINGS = """
+PATH = %(path)r + '/content'
+OUTPUT_PATH = %(path)r + '/output'
+CACHE_PATH = %(path)r + '/cache'
+TIMEZONE = 'UTC'
+FEED_ALL_ATOM = None
+CATEGORY_FEED_ATOM = None
+TRANSLATION_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+FILENAME_METADATA = r'(?P<date>\\d{4}-\\d{2}-\\d{2})-(?P<slug>.*)'
+"""
+
+
+def test_pelican_view_with_build_worker(tmp_path, monkeypatch):
+    pytest.importorskip('pelican')
+    from mailpy.contrib.pelican.view import PelicanMailView
+
+    os.makedirs(str(tmp_path / 'content'))
+    settings_file = str(tmp_path / 'pelicanconf.py')
+
+    with io.open(settings_file, 'w') as fp:
+        fp.write(PELICAN_SETTINGS % {'path': str(tmp_path)})
+
+    class Blog(PelicanMailView):
+        papi_settings = (('build_worker', True), ('settings_cache_dir', False))
+
+    Blog.settings_file = settings_file
+    monkeypatch.setattr(MailResponse, 'send', lambda self: None)
+    socket_path = str(tmp_path / 'supervisor.sock')
+    pid = _run_supervisor([('com.example.blog', Blog)], socket_path, workers=2)
+    raw = b'From: user@example.com\nSubject: Hello World\nMessage-Id: <%d@example.com>\n\nHello\n'
+
+    try:
+        for i in range(3):
+            reply = send_envelope(socket_path, MailEnvelope('user@example.com', 'post@blog.example.com', raw % i))
+            assert (reply['status'], reply['error']) == (200, None)
+    finally:
+        _stop_supervisor(pid)
+
+    assert len([f for f in os.listdir(str(tmp_path / 'output')) if f.startswith('hello-world')]) == 3
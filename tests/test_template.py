@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from mailpy.utils import parse_message_bytes
+from mailpy.template import get_template_environment, render_template
+from mailpy.response import TemplateTextMailResponse, TemplateHtmlMailResponse
+
+RAW = (b'From: user@example.com\n'
+       b'Subject: Hello\n'
+       b'Message-Id: <1@example.com>\n'
+       b'\n'
+       b'Hello\n')
+
+CONTEXT = {'name': u'<b>Žluťoučký</b>'}
+
+
+@pytest.fixture
+def request_():
+    return parse_message_bytes(RAW, 'user@example.com', 'get@blog.example.com')
+
+
+@pytest.fixture
+def template_dirs(tmp_path):
+    path = tmp_path / 'templates'
+    path.mkdir()
+    (path / 'hello.html').write_text(u'<p>{{ request.method }} {{ name }}</p>\n', encoding='utf-8')
+    (path / 'hello.txt').write_text(u'{{ request.method }} {{ name }}\n', encoding='utf-8')
+
+    return (str(path),)
+
+
+def _parts(message):
+    return {part.get_content_type(): part.get_payload(decode=True).decode('utf-8')
+            for part in message.walk() if not part.is_multipart()}
+
+
+def test_text_template_is_not_escaped(request_, template_dirs):
+    response = TemplateTextMailResponse(request_, 'hello.txt', CONTEXT, template_dirs=template_dirs)
+
+    assert _parts(response.message) == {'text/plain': u'get <b>Žluťoučký</b>\n'}
+
+
+def test_html_template_is_autoescaped(request_, template_dirs):
+    response = TemplateHtmlMailResponse(request_, 'hello.html', CONTEXT, template_dirs=template_dirs)
+
+    assert _parts(response.message) == {'text/html': u'<p>get &lt;b&gt;Žluťoučký&lt;/b&gt;</p>\n'}
+
+
+def test_html_template_with_text_template(request_, template_dirs):
+    response = TemplateHtmlMailResponse(request_, 'hello.html', CONTEXT, text_template='hello.txt',
+                                        template_dirs=template_dirs)
+
+    assert response.message.get_content_type() == 'multipart/alternative'
+    assert _parts(response.message) == {
+        'text/plain': u'get <b>Žluťoučký</b>\n',
+        'text/html': u'<p>get &lt;b&gt;Žluťoučký&lt;/b&gt;</p>\n',
+    }
+
+
+def test_environment_is_created_once(template_dirs, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    env = get_template_environment(template_dirs, cache_dir=cache_dir)
+
+    assert get_template_environment(list(template_dirs), cache_dir=cache_dir) is env
+    assert get_template_environment(template_dirs, cache_dir=False) is not env
+
+
+def test_template_is_compiled_once(template_dirs, tmp_path, monkeypatch):
+    (tmp_path / 'templates' / 'name.txt').write_text(u'{{ name }}', encoding='utf-8')
+    cache_dir = str(tmp_path / 'cache')
+    env = get_template_environment(template_dirs, cache_dir=cache_dir)
+    compiled = []
+    compile_ = env.compile
+
+    def counting_compile(*args, **kwargs):
+        compiled.append(args)
+        return compile_(*args, **kwargs)
+
+    monkeypatch.setattr(env, 'compile', counting_compile)
+
+    for _ in range(3):
+        assert render_template(template_dirs, 'name.txt', CONTEXT, cache_dir=cache_dir) == CONTEXT['name']
+
+    assert len(compiled) == 1
+    assert len(list((tmp_path / 'cache').iterdir())) == 1  # Bytecode cache shared by other processes
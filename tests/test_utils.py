@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import os
+import base64
+import quopri
+from email.message import Message
+
+import pytest
+
+from mailpy.utils import iter_payload, get_rss, get_private_memory
+
+
+def _part(cte, payload):
+    msg = Message()
+    msg['Content-Transfer-Encoding'] = cte
+    msg.set_payload(payload)
+
+    return msg
+
+
+@pytest.mark.parametrize('chunk_size', [4, 5, 7, 64, 65536])
+def test_iter_payload_base64(chunk_size):
+    data = os.urandom(1000)
+    encoded = base64.encodebytes(data).decode('ascii')
+    part = _part('base64', encoded)
+
+    assert b''.join(iter_payload(part, chunk_size=chunk_size)) == data == part.get_payload(decode=True)
+
+
+@pytest.mark.parametrize('encoded, decoded', [
+    ('QUJDRA\n', b'ABCD'),  # Missing padding
+    ('QUJDREU=\n', b'ABCDE'),
+    ('QUJDR\n', b'ABC'),  # Remainder of one character
+    ('QUJD\nRA=\n=\n', b'ABCD'),
+])
+def test_iter_payload_base64_remainder(encoded, decoded):
+    assert b''.join(iter_payload(_part('base64', encoded), chunk_size=3)) == decoded
+
+
+@pytest.mark.parametrize('chunk_size', [1, 10, 65536])
+def test_iter_payload_quoted_printable(chunk_size):
+    data = (u'Žltučký kôň úpel ďábelské ódy\n' * 50).encode('utf-8')
+    part = _part('quoted-printable', quopri.encodestring(data).decode('ascii'))
+
+    assert b''.join(iter_payload(part, chunk_size=chunk_size)) == data == part.get_payload(decode=True)
+
+
+def test_iter_payload_quoted_printable_non_ascii():
+    part = _part('quoted-printable', u'café =C3=A9\n')
+
+    assert b''.join(iter_payload(part)) == part.get_payload(decode=True) == b'caf\xe9 \xc3\xa9\n'
+
+
+def test_iter_payload_other_encoding():
+    part = _part('8bit', u'plain text\n')
+
+    assert b''.join(iter_payload(part)) == part.get_payload(decode=True)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps_rollup'), reason='requires /proc/self/smaps_rollup')
+def test_private_memory_excludes_pages_shared_with_parent():
+    data = bytearray(64 * 1024 * 1024)  # Touched (zeroed) by the parent process
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.write(w, ('%d %d' % (get_rss(), get_private_memory())).encode('ascii'))
+        os._exit(0)
+
+    os.close(w)
+    rss, uss = map(int, os.read(r, 100).split())
+    os.close(r)
+    os.waitpid(pid, 0)
+    del data
+
+    assert rss > 64 * 1024 * 1024
+    assert uss < 32 * 1024 * 1024
@@ -0,0 +1,86 @@
+import os
+import io
+
+import pytest
+
+pytest.importorskip('pelican')
+
+from mailpy.contrib.pelican.api import PelicanAPI
+
+SETTINGS = """
+PATH = %(path)r + '/content'
+OUTPUT_PATH = %(path)r + '/output'
+CACHE_PATH = %(path)r + '/cache'
+TIMEZONE = 'UTC'
+FEED_ALL_ATOM = None
+CATEGORY_FEED_ATOM = None
+TRANSLATION_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+"""
+
+
+def test_build_worker(tmp_path):
+    os.makedirs(str(tmp_path / 'content'))
+    settings_file = str(tmp_path / 'pelicanconf.py')
+
+    with io.open(settings_file, 'w') as fp:
+        fp.write(SETTINGS % {'path': str(tmp_path)})
+
+    with io.open(str(tmp_path / 'content' / 'hello.rst'), 'w') as fp:
+        fp.write(u'Hello\n#####\n\n:date: 2015-01-05\n\nHello world\n')
+
+    papi = PelicanAPI(settings_file, build_worker=True, build_worker_max_builds=2, settings_cache_dir=False)
+
+    try:
+        pid = papi.build_worker.pid
+        assert pid and papi.build_worker.is_alive()  # Started with the API object
+
+        stats = papi.publish()
+        assert stats.pid == pid != os.getpid()
+        assert stats.builds == 1
+        assert stats.rss > 0 and stats.peak_rss > 0
+        assert abs(stats.rss_delta) < stats.rss  # Growth during the build, not the inherited memory
+        assert 'hello.html' in stats.written
+        assert os.path.exists(str(tmp_path / 'output' / 'hello.html'))
+
+        papi.publish(articles=[papi.get_article('hello.rst')])
+        assert papi.build_worker.pid != pid  # Recycled after max_builds
+        assert papi.build_worker.is_alive()
+    finally:
+        papi.close()
+
+    assert not papi.build_worker.is_alive()
+
+
+def test_build_worker_in_forked_process(tmp_path):
+    os.makedirs(str(tmp_path / 'content'))
+    settings_file = str(tmp_path / 'pelicanconf.py')
+
+    with io.open(settings_file, 'w') as fp:
+        fp.write(SETTINGS % {'path': str(tmp_path)})
+
+    papi = PelicanAPI(settings_file, build_worker=True, settings_cache_dir=False)
+    parent_worker = papi.build_worker.pid
+
+    try:
+        r, w = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            try:
+                stats = papi.publish()
+                os.write(w, str(stats.pid).encode('ascii'))
+                papi.close()
+            finally:
+                os._exit(0)
+
+        os.close(w)
+        child_worker = int(os.read(r, 100) or 0)
+        os.close(r)
+        os.waitpid(pid, 0)
+
+        assert child_worker and child_worker != parent_worker  # The child started its own build worker
+        assert papi.build_worker.pid == parent_worker and papi.build_worker.is_alive()
+    finally:
+        papi.close()